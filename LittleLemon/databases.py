@@ -0,0 +1,108 @@
+"""
+Database profiles, picked with the ``LITTLELEMON_DATABASE`` environment variable.
+
+``sqlite`` (default)
+    ``db.sqlite3`` (or ``SQLITE_PATH``) in WAL mode, so readers never block
+    the writer. Pragmas are applied on every connect: ``busy_timeout`` makes
+    a writer wait for the lock instead of failing with "database is locked",
+    ``synchronous=NORMAL`` is safe with WAL and skips an fsync per commit,
+    and ``mmap_size`` serves reads from the page cache. Transactions start
+    ``IMMEDIATE``, so they take the write lock up front and wait on
+    ``busy_timeout`` rather than failing when a read lock can't be upgraded.
+
+``postgresql``
+    Configured from ``POSTGRES_DB``, ``POSTGRES_USER``, ``POSTGRES_PASSWORD``,
+    ``POSTGRES_HOST`` and ``POSTGRES_PORT``. With ``POSTGRES_POOL_SIZE`` set,
+    connections come from a psycopg pool of that size (``psycopg[pool]``).
+    Otherwise each worker thread keeps its connection for ``CONN_MAX_AGE``
+    seconds, with a health check before reuse.
+
+Either profile can add read replicas with ``LITTLELEMON_REPLICAS`` (see
+``LittleLemonAPI/routers.py``).
+"""
+import os
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+def sqlite(base_dir, env):
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': env.get('SQLITE_PATH') or base_dir / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'CONN_MAX_AGE': int(env.get('CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+
+
+def postgresql(env):
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': env.get('POSTGRES_DB', 'littlelemon'),
+        'USER': env.get('POSTGRES_USER', 'littlelemon'),
+        'PASSWORD': env.get('POSTGRES_PASSWORD', ''),
+        'HOST': env.get('POSTGRES_HOST', 'localhost'),
+        'PORT': env.get('POSTGRES_PORT', '5432'),
+        'OPTIONS': {},
+    }
+    pool_size = int(env.get('POSTGRES_POOL_SIZE', 0))
+    if pool_size:
+        # Pooled connections are checked out per request; CONN_MAX_AGE must stay 0
+        database['OPTIONS']['pool'] = {
+            'min_size': max(1, pool_size // 4),
+            'max_size': pool_size,
+            'timeout': 10,
+            'check': check_pooled_connection,
+        }
+    else:
+        database['CONN_MAX_AGE'] = int(env.get('CONN_MAX_AGE', 60))
+        database['CONN_HEALTH_CHECKS'] = True
+    return database
+
+
+def check_pooled_connection(connection):
+    # Same as psycopg_pool.ConnectionPool.check_connection, without importing
+    # psycopg_pool for the SQLite profile
+    from psycopg_pool import ConnectionPool
+    ConnectionPool.check_connection(connection)
+
+
+def replica(primary, location):
+    """A read replica of ``primary`` at ``location`` (a file for SQLite, a host otherwise)."""
+    database = {**primary, 'OPTIONS': dict(primary['OPTIONS'])}
+    if primary['ENGINE'].endswith('sqlite3'):
+        database['NAME'] = location
+    else:
+        database['HOST'] = location
+    # Tests run against the primary's test database
+    database['TEST'] = {'MIRROR': 'default'}
+    return database
+
+
+def databases(base_dir, env=os.environ):
+    """
+    ``DATABASES`` for the chosen profile. ``LITTLELEMON_REPLICAS`` adds read
+    replicas ``replica1``, ``replica2``, ...: a comma-separated list of SQLite
+    files or PostgreSQL hosts.
+    """
+    profile = env.get('LITTLELEMON_DATABASE', 'sqlite')
+    if profile == 'sqlite':
+        primary = sqlite(base_dir, env)
+    elif profile == 'postgresql':
+        primary = postgresql(env)
+    else:
+        raise ValueError(f"Unknown LITTLELEMON_DATABASE profile {profile!r}; use 'sqlite' or 'postgresql'")
+    result = {'default': primary}
+    locations = [location.strip() for location in env.get('LITTLELEMON_REPLICAS', '').split(',') if location.strip()]
+    for number, location in enumerate(locations, start=1):
+        result[f'replica{number}'] = replica(primary, location)
+    return result
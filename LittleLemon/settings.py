@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
+from LittleLemon.databases import databases
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -44,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'LittleLemonAPI.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,13 +79,37 @@ WSGI_APPLICATION = 'LittleLemon.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Profile (tuned SQLite or PostgreSQL) picked from the environment; see databases.py
+
+DATABASES = databases(BASE_DIR)
+
+# Safe requests to the menu, cart, order and group endpoints read from these
+# aliases; users are pinned to the primary for a few seconds after a write
+DATABASE_ROUTERS = ['LittleLemonAPI.routers.ReplicaRouter']
+LITTLELEMON_READ_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+LITTLELEMON_REPLICA_PIN_SECONDS = 5
+
+# Cache shared by every worker process: the menu catalogue version and
+# rendered pages, replica pins, idempotency keys and throttle buckets must be
+# the same for all of them. Redis when REDIS_URL is set (recommended with more
+# than one worker), otherwise a table in the default database that
+# `python manage.py createcachetable` creates. Never a per-process cache.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'littlelemon_cache',
+            # Culling would also drop idempotency keys and the catalogue version
+            'OPTIONS': {'MAX_ENTRIES': 1_000_000},
+        },
     }
-}
 
 
 # Password validation
@@ -128,10 +155,144 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'LittleLemonAPI.authentication.CachedTokenAuthentication',
+    ],
+    # orjson-backed when orjson is installed, DRF's stdlib JSON otherwise
+    'DEFAULT_RENDERER_CLASSES': [
+        'LittleLemonAPI.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'LittleLemonAPI.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
 }
 
 DJOSER = {
     'USER_ID_FIELD': 'username',
 }
+
+# Process-level cache of each user's group names, used for role checks.
+# Membership changes and group renames or deletions invalidate it in the
+# current process; other worker processes pick them up once TTL (seconds)
+# expires, so keep it short. Set to None to disable.
+LITTLELEMON_ROLE_CACHE = {
+    'MAXSIZE': 4096,
+    'TTL': 5,
+}
+
+# How long (seconds) a rendered menu page stays in the cache. Entries are
+# also dropped implicitly whenever the menu catalogue version changes.
+LITTLELEMON_MENU_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Each process also keeps up to MAXSIZE rendered menu pages in memory and
+# reads the catalogue version from the shared cache at most every
+# VERSION_CHECK seconds, so menu writes made through another worker show up
+# here within that interval. Set to None to always ask the shared cache.
+LITTLELEMON_MENU_LOCAL_CACHE = {
+    'MAXSIZE': 256,
+    'VERSION_CHECK': 2,
+}
+
+# Each process answers menu_items GET (filters, search and pages) from an
+# in-memory snapshot of the menu, reloaded when the catalogue version
+# changes. Menus larger than MAX_ITEMS are queried with SQL instead. Set to
+# None to always use SQL.
+LITTLELEMON_MENU_SNAPSHOT = {
+    'MAX_ITEMS': 10_000,
+}
+
+# Backend used for menu ?search= when the snapshot doesn't answer it: 'fts'
+# (SQLite FTS5 trigram index),
+# 'memory' (in-process index, for small menus) or 'like' (plain icontains).
+LITTLELEMON_MENU_SEARCH = 'fts'
+
+# Cache of token -> user (with group names) used by CachedTokenAuthentication:
+# TTL seconds in the shared cache, plus up to MAXSIZE entries for LOCAL_TTL
+# seconds in each process. Logout, user changes and group changes revoke the
+# shared entries at once; other worker processes may serve their local copy
+# for up to LOCAL_TTL seconds. Set to None to disable.
+LITTLELEMON_TOKEN_CACHE = {
+    'MAXSIZE': 10000,
+    'TTL': 300,
+    'LOCAL_TTL': 5,
+}
+
+# How the dispatch_orders worker assigns queued orders to the delivery crew:
+# 'least-loaded', 'round-robin' or the dotted path of a strategy function
+# (see LittleLemonAPI/dispatch.py).
+LITTLELEMON_DISPATCH_STRATEGY = 'least-loaded'
+
+# Also queue a dispatch run with every checkout, so new orders get a crew
+# member before the next dispatch_orders poll. Off by default: dispatch_orders
+# already assigns them, and each checkout would queue one more job.
+LITTLELEMON_DISPATCH_ON_CHECKOUT = False
+
+# Background jobs (receipts, optional delivery assignment) run by
+# manage.py runworker: attempts before a job is marked failed, the retry
+# backoff (BACKOFF * 2 ** (attempt - 1) seconds, at most MAX_BACKOFF) and how
+# long a worker holds a job before another worker may take it over.
+LITTLELEMON_JOBS = {
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 2,
+    'MAX_BACKOFF': 300,
+    'VISIBILITY_TIMEOUT': 60,
+}
+
+# Receipts are printed to the console unless an email backend is configured
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+
+# Broker for the /api/orders/stream events, and the seconds between
+# keepalive comments on an idle stream (each also rechecks the stream's
+# token). The cache broker reaches the clients of every worker through the
+# shared cache; 'LittleLemonAPI.events.InProcessBroker' only those connected
+# to the process that made the change.
+LITTLELEMON_EVENTS_BACKEND = 'LittleLemonAPI.events.CacheBroker'
+LITTLELEMON_EVENTS_HEARTBEAT = 15
+
+# Token-bucket limits on writes to the cart ('cart') and checkout
+# ('checkout') endpoints, per user: 'requests/period' (s, min, hour, day)
+# by role, None for no limit. STORE is 'cache' (shared between workers when
+# the Django cache is), 'local' (per process) or a dotted path.
+LITTLELEMON_THROTTLE = {
+    'STORE': 'cache',
+    'RATES': {
+        'cart': {'customer': '120/min', 'crew': '120/min', 'manager': None},
+        'checkout': {'customer': '10/min', 'crew': '10/min', 'manager': None},
+    },
+}
+
+# Writes to the cart and checkout endpoints are turned away with 503 and
+# Retry-After (seconds) while their moving average latency is above
+# THRESHOLD (seconds). Set to None to disable.
+LITTLELEMON_LOAD_SHEDDING = {
+    'THRESHOLD': 0.5,
+    'RETRY_AFTER': 2,
+}
+
+# Idempotency-Key support on cart and checkout writes: responses are kept
+# for TTL seconds and replayed to retries with the same key, and a retry
+# that arrives while the first request is still running waits up to WAIT
+# seconds for it. The first request holds the key for CLAIM_TTL seconds,
+# which must be longer than any request can run (the server's worker
+# timeout); it only runs out if a worker dies mid-request. Set to None to
+# disable.
+LITTLELEMON_IDEMPOTENCY = {
+    'TTL': 24 * 60 * 60,
+    'WAIT': 10,
+    'CLAIM_TTL': 300,
+}
+
+# Route the hot read endpoints (menu items, cart, orders) to their async
+# implementations. Only enable this when serving through LittleLemon.asgi.
+LITTLELEMON_ASYNC_VIEWS = os.environ.get('LITTLELEMON_ASYNC_VIEWS') == '1'
+
+# Per-request timing (auth, roles, SQL, serialization, rendering), recorded
+# in histograms served at /metrics. SERVER_TIMING also sends the breakdown
+# back in a Server-Timing response header: 'managers' to managers and staff
+# only, True to everyone (it reveals query counts and timings), False to
+# nobody. Set to None to disable.
+LITTLELEMON_INSTRUMENTATION = {
+    'SERVER_TIMING': 'managers',
+} if os.environ.get('LITTLELEMON_INSTRUMENTATION', '1') == '1' else None
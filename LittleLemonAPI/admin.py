@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, MenuItem, Cart, Order, OrderItem
+from .models import Category, MenuItem, Cart, Order, OrderItem, ArchivedOrder, ArchivedOrderItem, DailySales, ItemSales, Job
 
 
 class CategoryAdmin(admin.ModelAdmin):
@@ -18,3 +18,15 @@ admin.site.register(MenuItem, MenuItemAdmin)
 admin.site.register(Cart)
 admin.site.register(Order)
 admin.site.register(OrderItem)
+admin.site.register(ArchivedOrder)
+admin.site.register(ArchivedOrderItem)
+admin.site.register(DailySales)
+admin.site.register(ItemSales)
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "attempts", "run_at", "failed")
+    list_filter = ("failed", "name")
+    ordering = ["run_at", "id"]
+
+admin.site.register(Job, JobAdmin)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class LittlelemonapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'LittleLemonAPI'
+
+    def ready(self):
+        from . import signals, tasks  # noqa: F401
+        from .routers import check_shared_cache
+        check_shared_cache()
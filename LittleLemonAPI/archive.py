@@ -0,0 +1,72 @@
+"""
+Archival of delivered orders.
+
+Delivered orders never change again, yet they made up most of ``Order`` and
+``OrderItem`` and every index on them. ``archive_orders()`` (the
+``archive_orders`` command) moves the ones older than a cutoff into
+``ArchivedOrder``/``ArchivedOrderItem``, keeping their ids, in batched
+transactions: copy a batch, delete it from the hot tables, commit. The hot
+tables then only hold recent and pending orders, which keeps them and their
+indexes small enough to stay cached.
+
+Reads only see the archive when they ask for it: ``orders`` GET and
+``single_order`` GET take ``?include_archived=1``. Sales rollups are left as
+they are: archived orders are still sales, and ``rebuild_sales`` reads both.
+"""
+import datetime
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+from .roles import is_manager, is_delivery_crew
+
+ORDER_FIELDS = ('id', 'user_id', 'delivery_crew_id', 'status', 'total', 'date')
+ITEM_FIELDS = ('id', 'order_id', 'menuitem_id', 'quantity', 'unit_price', 'price')
+
+
+def requested(query_params):
+    return query_params.get('include_archived') in ('1', 'true')
+
+
+def archived_queryset(user, query_params):
+    """
+    The archived orders ``views.orders_queryset`` would list for ``user``, or
+    None when the archive wasn't asked for or can't match.
+    """
+    if not requested(query_params):
+        return None
+    if is_manager(user):
+        # Archived orders are all delivered
+        return None if query_params.get('status') == 'pending' else ArchivedOrder.objects.all()
+    if is_delivery_crew(user):
+        # Crew only list their pending orders
+        return None
+    return ArchivedOrder.objects.filter(user=user)
+
+
+def _archive_batch(cutoff, batch_size):
+    with transaction.atomic():
+        delivered = Order.objects.filter(status=True, date__lt=cutoff).order_by('date', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            delivered = delivered.select_for_update(skip_locked=True)
+        orders = list(delivered.values_list(*ORDER_FIELDS)[:batch_size])
+        if not orders:
+            return 0
+        ids = [order[0] for order in orders]
+        ArchivedOrder.objects.bulk_create([ArchivedOrder(**dict(zip(ORDER_FIELDS, order))) for order in orders])
+        items = OrderItem.objects.filter(order_id__in=ids)
+        ArchivedOrderItem.objects.bulk_create(
+            [ArchivedOrderItem(**dict(zip(ITEM_FIELDS, item))) for item in items.values_list(*ITEM_FIELDS)])
+        items.delete()
+        Order.objects.filter(pk__in=ids).delete()
+    return len(orders)
+
+
+def archive_orders(older_than_days, batch_size=500, stdout=None):
+    """Move delivered orders older than ``older_than_days`` to the archive. Returns how many were moved."""
+    cutoff = timezone.now() - datetime.timedelta(days=older_than_days)
+    archived = 0
+    while moved := _archive_batch(cutoff, batch_size):
+        archived += moved
+        if stdout:
+            stdout.write(f"Archived {archived} orders")
+    return archived
@@ -0,0 +1,194 @@
+"""
+Async (ASGI-native) implementations of the hot read endpoints.
+
+Each view serves GET itself, using async token authentication and Django's
+async ORM, and hands every other method to the regular DRF view in
+``views.py``. They are routed in place of the sync views when
+``LITTLELEMON_ASYNC_VIEWS`` is enabled, which only pays off under an ASGI
+server; under WSGI every request would need an event loop of its own.
+
+``orders_stream`` is always async: it holds its connection open for as long
+as the client listens, which only an ASGI server can afford.
+"""
+import time
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.paginator import Paginator, EmptyPage
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from .authentication import CachedTokenAuthentication
+from .instrumentation import timed
+from .models import MenuItem, Cart
+from .pagination import keyset_query, keyset_queries, keyset_result, keyset_merged, cursor_response_data
+from .renderers import FastJSONRenderer
+from .roles import aget_roles, is_manager
+from .representations import MENU_ITEM, CART, ORDER, aorders
+from .routers import replicas, ais_pinned, use_replica
+from . import archive, catalogue, events, search, snapshot, views
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    with timed('render'):
+        body = FastJSONRenderer().render(data)
+    return HttpResponse(body, status=status, content_type='application/json')
+
+
+def async_get(sync_view, authenticated=True):
+    """Serve GET with the decorated coroutine and any other method with ``sync_view``."""
+    sync_handler = sync_to_async(sync_view)
+    authenticator = CachedTokenAuthentication()
+
+    def decorator(func):
+        @csrf_exempt
+        @wraps(func)
+        async def view(request, *args, **kwargs):
+            if request.method != 'GET':
+                return await sync_handler(request, *args, **kwargs)
+            try:
+                user_auth = await authenticator.aauthenticate(request)
+                request.user, request.auth = user_auth if user_auth else (AnonymousUser(), None)
+                if authenticated and not request.user.is_authenticated:
+                    raise exceptions.NotAuthenticated()
+                if replicas() and not await ais_pinned(request.user):
+                    with use_replica():
+                        return await func(request, *args, **kwargs)
+                return await func(request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                response = json_response({"detail": exc.detail}, status=exc.status_code)
+                if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+                    response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+                return response
+            except Http404 as exc:
+                return json_response({"detail": str(exc)}, status=status.HTTP_404_NOT_FOUND)
+        return view
+    return decorator
+
+
+async def paginate(queryset, perpage, page):
+    """Same as the views' ``Paginator`` usage, with the count and page fetched asynchronously."""
+    paginator = Paginator(queryset, per_page=perpage)
+    paginator.count = await queryset.acount()
+    try:
+        page = paginator.page(number=page)
+    except EmptyPage:
+        return []
+    return [row async for row in page.object_list]
+
+
+async def keyset_page(queryset, ordering, cursor, perpage, key=None):
+    queryset, state = keyset_query(queryset, ordering, cursor, perpage)
+    return keyset_result([row async for row in queryset], state, key)
+
+
+async def menu_page(query_params):
+    data = await snapshot.amenu_page(query_params)
+    if data is not None:
+        return data
+
+    index = await search.aprepare(query_params.get('search') or '')
+    items = MENU_ITEM.values(views.menu_queryset(query_params, search_index=index))
+    perpage = query_params.get('perpage', default=10)
+
+    if 'cursor' in query_params:
+        items, next_cursor, previous_cursor = await keyset_page(
+            items, ('id',), query_params['cursor'], perpage, key=MENU_ITEM.key(('id',)))
+        return cursor_response_data(MENU_ITEM.many(items), next_cursor, previous_cursor)
+
+    items = await paginate(items, perpage, query_params.get('page', default=1))
+    return MENU_ITEM.many(items)
+
+
+@async_get(views.menu_items, authenticated=False)
+async def menu_items(request):
+    return await catalogue.amenu_response(request, menu_page)
+
+
+@async_get(views.single_items, authenticated=False)
+async def single_items(request, pk):
+    try:
+        item = await MENU_ITEM.values(MenuItem.objects).aget(pk=pk)
+    except MenuItem.DoesNotExist:
+        raise Http404("No MenuItem matches the given query.")
+    return json_response(MENU_ITEM.one(item))
+
+
+@async_get(views.cart_menu_items)
+async def cart_menu_items(request):
+    user = request.user
+    await aget_roles(user)
+    if is_manager(user):
+        return json_response({"detail": "Managers and Superusers are not allowed to access this endpoint."}, status=status.HTTP_403_FORBIDDEN)
+
+    cart_items = [item async for item in CART.values(Cart.objects.filter(user=user))]
+    return json_response(CART.many(cart_items))
+
+
+@async_get(views.orders)
+async def orders(request):
+    user = request.user
+    # Resolve roles asynchronously so orders_queryset's role checks are free
+    await aget_roles(user)
+    orders = ORDER.values(views.orders_queryset(user, request.GET))
+    archived = archive.archived_queryset(user, request.GET)
+    perpage = request.GET.get('perpage', default=10)
+
+    if 'cursor' in request.GET:
+        key = ORDER.key(('date', 'id'))
+        if archived is None:
+            orders, next_cursor, previous_cursor = await keyset_page(
+                orders, ('date', 'id'), request.GET['cursor'], perpage, key=key)
+        else:
+            queries, state = keyset_queries(
+                [orders, ORDER.values(archived)], ('date', 'id'), request.GET['cursor'], perpage)
+            orders, next_cursor, previous_cursor = keyset_merged(
+                [[row async for row in query] for query in queries], state, key)
+        return json_response(cursor_response_data(
+            await aorders(orders, archived is not None), next_cursor, previous_cursor))
+
+    if archived is not None:
+        orders = orders.union(ORDER.values(archived), all=True).order_by('date', 'id')
+    orders = await paginate(orders, perpage, request.GET.get('page', default=1))
+    return json_response(await aorders(orders, archived is not None))
+
+
+async def order_events(user, token, heartbeat):
+    authenticator = CachedTokenAuthentication()
+    checked = time.monotonic()
+    async with events.broker().subscribe() as subscription:
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                event = await subscription.get(timeout=heartbeat)
+            except TimeoutError:
+                event = None
+            if time.monotonic() - checked >= heartbeat:
+                # Open streams follow logouts and deactivations (the stream
+                # ends and the reconnect is refused) and role changes
+                try:
+                    user, token = await authenticator.aauthenticate_credentials(token.key)
+                except exceptions.AuthenticationFailed:
+                    return
+                checked = time.monotonic()
+            if event is None:
+                # Keeps proxies from closing an idle connection
+                yield ': keepalive\n\n'
+            elif events.visible_to(user, event):
+                yield events.format_sse(event)
+
+
+@async_get(lambda request: HttpResponseNotAllowed(['GET']))
+async def orders_stream(request):
+    """Server-sent events for status and delivery crew changes of the orders the user can see."""
+    if not isinstance(request, ASGIRequest):
+        return json_response({"detail": "Order events are only served over ASGI"}, status=status.HTTP_501_NOT_IMPLEMENTED)
+    await aget_roles(request.user)
+    response = StreamingHttpResponse(
+        order_events(request.user, request.auth, getattr(settings, 'LITTLELEMON_EVENTS_HEARTBEAT', 15)),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,247 @@
+import copy
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework import authentication, exceptions
+from rest_framework.authtoken.models import Token
+from .instrumentation import timed
+from .lru import LRUCache
+from .roles import get_roles, aget_roles, set_roles
+
+
+class TokenAuthentication(authentication.TokenAuthentication):
+    """
+    DRF's token authentication with an async entry point, so plain Django
+    async views can authenticate without a thread hop for the header checks.
+    """
+
+    def get_key(self, request):
+        auth = authentication.get_authorization_header(request).split()
+
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+
+        if len(auth) == 1:
+            msg = _('Invalid token header. No credentials provided.')
+            raise exceptions.AuthenticationFailed(msg)
+        elif len(auth) > 2:
+            msg = _('Invalid token header. Token string should not contain spaces.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        try:
+            return auth[1].decode()
+        except UnicodeError:
+            msg = _('Invalid token header. Token string should not contain invalid characters.')
+            raise exceptions.AuthenticationFailed(msg)
+
+    def authenticate(self, request):
+        with timed('auth'):
+            key = self.get_key(request)
+            return None if key is None else self.authenticate_credentials(key)
+
+    async def aauthenticate(self, request):
+        with timed('auth'):
+            key = self.get_key(request)
+            return None if key is None else await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        model = self.get_model()
+        try:
+            token = await model.objects.select_related('user').aget(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
+
+
+# Bumped to revoke every cached token at once
+GENERATION_KEY = 'littlelemon:token:generation'
+
+
+class TokenCache:
+    """
+    Token key -> (user, token, group names), in two tiers.
+
+    The shared cache (``CACHES``) keeps each entry for ``ttl`` seconds along
+    with the revocation generations it was loaded under: one for the token
+    and one for all tokens. Logout and user or group changes bump them, so
+    no worker accepts the entry from the shared cache afterwards. In front of
+    it each process keeps a short-lived LRU (``local_ttl`` seconds), which
+    is all that other workers may still serve a revoked token from.
+
+    The LRU keeps a reverse index by user id so every token of a user can be
+    dropped when the user or their groups change. Every invalidation also
+    bumps a local generation counter: an entry loaded before one (which may
+    hold the stale user) isn't stored locally, and in the shared cache it is
+    stored under the generations read before loading, which no longer match.
+    """
+
+    def __init__(self, maxsize, ttl, local_ttl):
+        self.ttl = ttl
+        self._entries = LRUCache(maxsize, local_ttl, on_evict=self._forget)
+        self._keys_by_user = {}
+        self._generation = 0
+        # Reentrant: set() evicts, and eviction calls _forget, under the lock
+        self._lock = threading.RLock()
+
+    def _forget(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                # Set again since it was dropped
+                return
+            keys = self._keys_by_user.get(entry[0].pk)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_user[entry[0].pk]
+
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, entry, generation=None):
+        """Store ``entry``, unless ``generation`` (from ``generation()``) is out of date."""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._keys_by_user.setdefault(entry[0].pk, set()).add(key)
+            self._entries.set(key, entry)
+
+    @staticmethod
+    def _shared_keys(key):
+        return f'littlelemon:token:{key}', f'littlelemon:token:{key}:generation'
+
+    def _shared_entry(self, key, found):
+        entry_key, generation_key = self._shared_keys(key)
+        generations = (found.get(generation_key), found.get(GENERATION_KEY))
+        stored = found.get(entry_key)
+        if stored is not None and stored[0] == generations:
+            return stored[1], generations
+        return None, generations
+
+    def get_shared(self, key):
+        """
+        Return ``(entry, generations)`` from the shared cache; ``entry`` is
+        None if missing or revoked, and a reload is stored under ``generations``.
+        """
+        return self._shared_entry(key, cache.get_many([*self._shared_keys(key), GENERATION_KEY]))
+
+    async def aget_shared(self, key):
+        return self._shared_entry(key, await cache.aget_many([*self._shared_keys(key), GENERATION_KEY]))
+
+    def set_shared(self, key, entry, generations):
+        cache.set(self._shared_keys(key)[0], (generations, entry), timeout=self.ttl)
+
+    async def aset_shared(self, key, entry, generations):
+        await cache.aset(self._shared_keys(key)[0], (generations, entry), timeout=self.ttl)
+
+    def _revoke(self, keys):
+        # Outlives every entry stored under the old generation, including one
+        # stored late by a request that loaded it before the revocation
+        timeout = 2 * self.ttl if self.ttl else None
+        cache.set_many({self._shared_keys(key)[1]: time.time_ns() for key in keys}, timeout=timeout)
+
+    def invalidate_key(self, key):
+        with self._lock:
+            self._generation += 1
+            entry = self._entries.get(key)
+            self._entries.delete(key)
+            if entry is not None:
+                self._forget(key, entry)
+        self._revoke([key])
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._generation += 1
+            keys = self._keys_by_user.pop(user_id, set())
+            for key in keys:
+                self._entries.delete(key)
+        # Tokens this process hasn't seen may be cached by other workers
+        self._revoke(keys.union(Token.objects.filter(user_id=user_id).values_list('key', flat=True)))
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._keys_by_user.clear()
+            self._entries.clear()
+        cache.set(GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+_token_cache = None
+_token_cache_loaded = False
+
+
+def token_cache():
+    global _token_cache, _token_cache_loaded
+    if not _token_cache_loaded:
+        options = getattr(settings, 'LITTLELEMON_TOKEN_CACHE', None)
+        _token_cache = TokenCache(
+            options.get('MAXSIZE', 4096), options.get('TTL'), options.get('LOCAL_TTL', 5),
+        ) if options else None
+        _token_cache_loaded = True
+    return _token_cache
+
+
+@receiver(setting_changed)
+def _reset_token_cache(setting, **kwargs):
+    global _token_cache, _token_cache_loaded
+    if setting == 'LITTLELEMON_TOKEN_CACHE':
+        _token_cache, _token_cache_loaded = None, False
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication served from ``token_cache()`` on the hot path.
+
+    A local hit costs one dictionary lookup and a shallow copy of the cached
+    user, so each request gets its own instance, with its roles already
+    resolved; a local miss asks the shared cache before the database.
+    Entries are revoked when the token is deleted (djoser's ``token/logout``)
+    or the user or their groups change (see ``signals.py``), and an entry
+    loaded while such a change happened is not served again.
+    """
+
+    def _from_cache(self, entry):
+        user, token, roles = entry
+        user = copy.copy(user)
+        set_roles(user, roles)
+        return (user, token)
+
+    def authenticate_credentials(self, key):
+        tokens = token_cache()
+        if tokens is None:
+            return super().authenticate_credentials(key)
+        entry = tokens.get(key)
+        if entry is None:
+            generation = tokens.generation()
+            entry, generations = tokens.get_shared(key)
+            if entry is None:
+                user, token = super().authenticate_credentials(key)
+                entry = (user, token, get_roles(user))
+                tokens.set_shared(key, entry, generations)
+            tokens.set(key, entry, generation)
+        return self._from_cache(entry)
+
+    async def aauthenticate_credentials(self, key):
+        tokens = token_cache()
+        if tokens is None:
+            return await super().aauthenticate_credentials(key)
+        entry = tokens.get(key)
+        if entry is None:
+            generation = tokens.generation()
+            entry, generations = await tokens.aget_shared(key)
+            if entry is None:
+                user, token = await super().aauthenticate_credentials(key)
+                entry = (user, token, await aget_roles(user))
+                await tokens.aset_shared(key, entry, generations)
+            tokens.set(key, entry, generation)
+        return self._from_cache(entry)
@@ -0,0 +1,200 @@
+"""
+Versioned cache of rendered menu responses.
+
+The menu changes a few times a day but is read on every page load, so each
+filter/page combination of ``menu_items`` GET is cached as pre-rendered JSON
+bytes under the current catalogue version. Every write to ``MenuItem`` or
+``Category`` bumps the version (see ``signals.py``), which makes all older
+entries unreachable. The version and the pages live in the shared cache
+(see ``CACHES``), so a write made through one worker invalidates the pages
+of all of them. In front of it each process keeps the pages it served in a
+small LRU and checks the shared version at most every ``VERSION_CHECK``
+seconds (see ``LITTLELEMON_MENU_LOCAL_CACHE``), so a warm menu read makes
+no cache round trip at all. The version doubles as the ``ETag`` validator,
+so conditional requests are answered without touching the cache entry.
+There is no ``Last-Modified``: two writes within the same second would share
+it.
+"""
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from .instrumentation import timed
+from .lru import LRUCache
+from .renderers import FastJSONRenderer
+from .routers import use_replica
+
+VERSION_KEY = 'littlelemon:menu:version'
+# Query parameters that change the menu_items GET response
+MENU_PARAMS = ('category', 'price', 'search', 'perpage', 'page', 'cursor')
+
+# (version, time.monotonic() it was read from the shared cache)
+_version = None
+_pages = None
+_pages_loaded = False
+
+
+def _timeout():
+    return getattr(settings, 'LITTLELEMON_MENU_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def _local_options():
+    return getattr(settings, 'LITTLELEMON_MENU_LOCAL_CACHE', None)
+
+
+def _local_pages():
+    global _pages, _pages_loaded
+    if not _pages_loaded:
+        options = _local_options()
+        _pages = LRUCache(options.get('MAXSIZE', 256), _timeout()) if options else None
+        _pages_loaded = True
+    return _pages
+
+
+def clear_local():
+    """Forget this process's pages and version check."""
+    global _version, _pages, _pages_loaded
+    _version, _pages, _pages_loaded = None, None, False
+
+
+@receiver(setting_changed)
+def _reset_local(setting, **kwargs):
+    if setting in ('LITTLELEMON_MENU_LOCAL_CACHE', 'LITTLELEMON_MENU_CACHE_TIMEOUT'):
+        clear_local()
+
+
+def _checked_version():
+    options = _local_options()
+    if options and _version is not None:
+        version, checked = _version
+        if time.monotonic() - checked < options.get('VERSION_CHECK', 1):
+            return version
+    return None
+
+
+def _remember_version(version):
+    global _version
+    _version = (version, time.monotonic())
+    return version
+
+
+def get_version():
+    """Return the current catalogue version, a ``time.time_ns()`` stamp of the last write."""
+    version = _checked_version()
+    if version is None:
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            # Nothing recorded yet (cold cache): start a new version now
+            cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+            version = cache.get(VERSION_KEY)
+        _remember_version(version)
+    return version
+
+
+async def aget_version():
+    version = _checked_version()
+    if version is None:
+        version = await cache.aget(VERSION_KEY)
+        if version is None:
+            await cache.aadd(VERSION_KEY, time.time_ns(), timeout=None)
+            version = await cache.aget(VERSION_KEY)
+        _remember_version(version)
+    return version
+
+
+def bump_version():
+    version = max(time.time_ns(), (cache.get(VERSION_KEY) or 0) + 1)
+    cache.set(VERSION_KEY, version, timeout=None)
+    # The writing process sees its own write at once, the others on their next check
+    _remember_version(version)
+
+
+def bump_version_on_commit():
+    # Bump after commit, otherwise a concurrent read could cache the old rows
+    # under the new version.
+    transaction.on_commit(bump_version)
+
+
+def _params_key(query_params):
+    params = '&'.join(f'{name}={query_params.get(name, "")}' for name in MENU_PARAMS if name in query_params)
+    return hashlib.blake2b(params.encode(), digest_size=8).hexdigest()
+
+
+def _validators(version, query_params):
+    params_key = _params_key(query_params)
+    return params_key, quote_etag(f'menu-{version:x}-{params_key}')
+
+
+def _page_key(version, params_key):
+    return f'littlelemon:menu:{version}:{params_key}'
+
+
+def _local_page(key):
+    pages = _local_pages()
+    return pages.get(key) if pages is not None else None
+
+
+def _store_local_page(key, body):
+    pages = _local_pages()
+    if pages is not None:
+        pages.set(key, body)
+    return body
+
+
+def _finalize(response, etag):
+    response['ETag'] = etag
+    return response
+
+
+def menu_response(request, build):
+    """
+    Serve a menu listing from the cache.
+
+    ``build(query_params)`` returns the response data and is only called on a
+    cache miss for the current version.
+    """
+    version = get_version()
+    params_key, etag = _validators(version, request.GET)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        key = _page_key(version, params_key)
+        body = _local_page(key)
+        if body is None:
+            body = cache.get(key)
+            if body is None:
+                # Built from the primary: a lagging replica would be cached under the new version
+                with use_replica(False):
+                    data = build(request.GET)
+                with timed('render'):
+                    body = FastJSONRenderer().render(data)
+                cache.set(key, body, timeout=_timeout())
+            _store_local_page(key, body)
+        response = HttpResponse(body, content_type='application/json')
+    return _finalize(response, etag)
+
+
+async def amenu_response(request, abuild):
+    """Async ``menu_response``; ``abuild`` is a coroutine function."""
+    version = await aget_version()
+    params_key, etag = _validators(version, request.GET)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        key = _page_key(version, params_key)
+        body = _local_page(key)
+        if body is None:
+            body = await cache.aget(key)
+            if body is None:
+                with use_replica(False):
+                    data = await abuild(request.GET)
+                with timed('render'):
+                    body = FastJSONRenderer().render(data)
+                await cache.aset(key, body, timeout=_timeout())
+            _store_local_page(key, body)
+        response = HttpResponse(body, content_type='application/json')
+    return _finalize(response, etag)
@@ -0,0 +1,120 @@
+"""
+Delivery dispatch.
+
+Pending orders without a delivery crew member form the dispatch queue,
+oldest first (served by ``order_queue_idx``). Orders leave it in two ways:
+
+* ``dispatch()``, run by the ``dispatch_orders`` worker, assigns a batch of
+  them to the active crew with the ``LITTLELEMON_DISPATCH_STRATEGY``
+  strategy: ``'least-loaded'``, ``'round-robin'`` or the dotted path of a
+  function with the same signature.
+* A crew member claims the oldest one with ``claim_next()``
+  (``POST /api/orders/next``).
+
+Both take their orders with ``SELECT ... FOR UPDATE SKIP LOCKED`` where the
+database supports it, so concurrent claimers each get different orders
+instead of queueing on the same rows. SQLite has no row locks; there the
+IMMEDIATE transactions of the default profile already serialize writers.
+Either way the assignment itself is a conditional ``UPDATE ... WHERE
+delivery_crew_id IS NULL``, so an order is never handed out twice.
+"""
+import heapq
+from collections import defaultdict
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils.module_loading import import_string
+from .models import Order
+from .roles import DELIVERY_CREW
+from . import events
+
+QUEUED = Q(delivery_crew__isnull=True, status=False)
+ROUND_ROBIN_KEY = 'littlelemon:dispatch:last-crew'
+
+
+def crew_ids():
+    return list(User.objects.filter(groups__name=DELIVERY_CREW, is_active=True)
+                .order_by('id').values_list('id', flat=True))
+
+
+def least_loaded(order_ids, crew):
+    """Give each order to the crew member with the fewest pending orders."""
+    loads = dict(Order.objects.filter(status=False, delivery_crew__in=crew)
+                 .values_list('delivery_crew').annotate(Count('id')).order_by())
+    heap = [(loads.get(crew_id, 0), crew_id) for crew_id in crew]
+    heapq.heapify(heap)
+    assigned = []
+    for _ in order_ids:
+        load, crew_id = heapq.heappop(heap)
+        assigned.append(crew_id)
+        heapq.heappush(heap, (load + 1, crew_id))
+    return assigned
+
+
+def round_robin(order_ids, crew):
+    """Cycle through the crew, carrying on from the last batch's position."""
+    last = cache.get(ROUND_ROBIN_KEY)
+    start = next((i for i, crew_id in enumerate(crew) if last is not None and crew_id > last), 0)
+    assigned = [crew[(start + i) % len(crew)] for i in range(len(order_ids))]
+    if assigned:
+        cache.set(ROUND_ROBIN_KEY, assigned[-1], timeout=None)
+    return assigned
+
+
+STRATEGIES = {
+    'least-loaded': least_loaded,
+    'round-robin': round_robin,
+}
+
+
+def get_strategy(name=None):
+    name = name or getattr(settings, 'LITTLELEMON_DISPATCH_STRATEGY', 'least-loaded')
+    if name in STRATEGIES:
+        return STRATEGIES[name]
+    if '.' in name:
+        return import_string(name)
+    raise ValueError(f"Unknown dispatch strategy {name!r}")
+
+
+def _take_queued(limit):
+    """``(id, user_id)`` of the oldest ``limit`` queued orders, locked where supported. Call in a transaction."""
+    orders = Order.objects.filter(QUEUED).order_by('date', 'id')
+    if connection.features.has_select_for_update_skip_locked:
+        orders = orders.select_for_update(skip_locked=True)
+    return list(orders.values_list('id', 'user_id')[:limit])
+
+
+def _assigned(order_id, user_id, crew_id):
+    events.publish_order_change(Order(pk=order_id, user_id=user_id, delivery_crew_id=crew_id, status=False))
+
+
+def dispatch(batch_size=100, strategy=None):
+    """Assign up to ``batch_size`` queued orders to the crew. Returns how many were assigned."""
+    crew = crew_ids()
+    if not crew:
+        return 0
+    strategy = get_strategy(strategy)
+    assigned = 0
+    with transaction.atomic():
+        queued = _take_queued(batch_size)
+        batches = defaultdict(list)
+        for order, crew_id in zip(queued, strategy([order_id for order_id, _ in queued], crew)):
+            batches[crew_id].append(order)
+        for crew_id, orders in batches.items():
+            assigned += Order.objects.filter(QUEUED, pk__in=[order_id for order_id, _ in orders]).update(
+                delivery_crew_id=crew_id)
+            for order_id, user_id in orders:
+                _assigned(order_id, user_id, crew_id)
+    return assigned
+
+
+def claim_next(user, candidates=5):
+    """Assign the oldest queued order to ``user`` and return its id, or None if the queue is empty."""
+    with transaction.atomic():
+        for order_id, user_id in _take_queued(candidates):
+            if Order.objects.filter(QUEUED, pk=order_id).update(delivery_crew=user):
+                _assigned(order_id, user_id, user.pk)
+                return order_id
+    return None
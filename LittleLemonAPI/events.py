@@ -0,0 +1,204 @@
+"""
+Order change events, pushed to ``/api/orders/stream`` subscribers.
+
+Status and delivery crew changes are published once their transaction
+commits. The broker is ``LITTLELEMON_EVENTS_BACKEND``; any class with
+``publish(event)`` (callable from any thread) and ``subscribe()`` (an async
+context manager with ``await get(timeout)``) will do. The default
+``CacheBroker`` passes events through the shared cache, so they reach
+subscribers in every worker, including changes made by ``dispatch_orders``
+and ``runworker``. ``InProcessBroker`` only reaches subscribers in the
+publishing process.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from functools import partial
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import close_old_connections, connections, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .roles import is_manager, is_delivery_crew, is_customer
+
+_broker = None
+
+
+class Subscription:
+    def __init__(self, broker, loop, maxsize):
+        self.broker = broker
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def put(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if self.queue.full():
+            # A reader this far behind loses the oldest events, not the newest
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Fans events out to the subscribers in this process."""
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.put(event)
+            except RuntimeError:
+                # Its event loop is closed
+                self.unsubscribe(subscription)
+
+    def subscribe(self):
+        subscription = Subscription(self, asyncio.get_running_loop(), self.maxsize)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+
+class CacheBroker(InProcessBroker):
+    """
+    Fans events out through the shared cache (``CACHES``) to the subscribers
+    of every process.
+
+    Each event is stored for ``retention`` seconds under the next free
+    sequence number, claimed with ``cache.add``, so publishers in different
+    processes never overwrite each other and an event is only stored once the
+    ones before it are. While a process has subscribers, one thread polls for
+    the following numbers every ``interval`` seconds and hands the events to
+    them. Events published before a subscriber connects are not replayed.
+    """
+    PREFIX = 'littlelemon:events:'
+    HEAD_KEY = 'littlelemon:events:head'
+    BATCH = 50
+
+    def __init__(self, maxsize=100, interval=0.5, retention=60):
+        super().__init__(maxsize)
+        self.interval = interval
+        self.retention = retention
+        self._poller = None
+
+    def publish(self, event):
+        number = (cache.get(self.HEAD_KEY) or 0) + 1
+        while not cache.add(f'{self.PREFIX}{number}', {**event, 'id': number}, timeout=self.retention):
+            number += 1
+        cache.set(self.HEAD_KEY, number, timeout=None)
+
+    def subscribe(self):
+        subscription = super().subscribe()
+        with self._lock:
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='littlelemon-events', daemon=True)
+                self._poller.start()
+        return subscription
+
+    def _fetch(self, position):
+        """The events stored after ``position``, up to the first missing number."""
+        numbers = range(position + 1, position + 1 + self.BATCH)
+        found = cache.get_many([f'{self.PREFIX}{number}' for number in numbers])
+        events = []
+        for number in numbers:
+            event = found.get(f'{self.PREFIX}{number}')
+            if event is None:
+                break
+            events.append(event)
+        return events
+
+    def _poll(self):
+        position = None
+        try:
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        self._poller = None
+                        return
+                try:
+                    if position is None:
+                        # Start after the newest event: the head can lag behind it
+                        position = cache.get(self.HEAD_KEY) or 0
+                        while skipped := self._fetch(position):
+                            position += len(skipped)
+                    events = self._fetch(position)
+                except Exception:
+                    # The cache is unreachable for now: keep the subscribers and retry
+                    close_old_connections()
+                    events = []
+                for event in events:
+                    position += 1
+                    super().publish(event)
+                if len(events) < self.BATCH:
+                    time.sleep(self.interval)
+        finally:
+            # The cache may be a database table
+            connections.close_all()
+
+
+def broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'LITTLELEMON_EVENTS_BACKEND', 'LittleLemonAPI.events.InProcessBroker'))()
+    return _broker
+
+
+@receiver(setting_changed)
+def _reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'LITTLELEMON_EVENTS_BACKEND':
+        _broker = None
+
+
+_ids = itertools.count(1)
+
+
+def publish_order_change(order, previous_crew_id=None):
+    """Publish ``order``'s status and delivery crew when the current transaction commits."""
+    event = {
+        'id': next(_ids),
+        'order': order.pk,
+        'user': order.user_id,
+        'delivery_crew': order.delivery_crew_id,
+        'status': order.status,
+    }
+    if previous_crew_id != order.delivery_crew_id:
+        event['previous_delivery_crew'] = previous_crew_id
+    transaction.on_commit(partial(broker().publish, event))
+
+
+def visible_to(user, event):
+    """The same rule as ``single_order`` GET. The user's roles must already be resolved."""
+    if is_customer(user):
+        return event['user'] == user.pk
+    if is_delivery_crew(user):
+        # Crew also hear about orders taken off them
+        return user.pk in (event['delivery_crew'], event.get('previous_delivery_crew'))
+    return is_manager(user)
+
+
+def format_sse(event):
+    data = {key: value for key, value in event.items() if key != 'id'}
+    return f"id: {event['id']}\nevent: order\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
@@ -0,0 +1,124 @@
+"""
+Streaming order and menu exports.
+
+Rows are read in keyset batches of ``chunk_size`` (``id > last id``), orders
+with their items fetched per batch, and written out one row at a time, so
+memory use stays flat no matter how many rows are exported.
+"""
+import csv
+import json
+from collections import defaultdict
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+from .models import OrderItem
+
+ORDER_FIELDS = ('id', 'user_id', 'delivery_crew_id', 'status', 'total', 'date')
+ITEM_FIELDS = ('order_id', 'id', 'menuitem__title', 'quantity', 'unit_price', 'price')
+CSV_HEADER = (
+    'order_id', 'user', 'delivery_crew', 'status', 'total', 'date',
+    'item_id', 'menuitem', 'quantity', 'unit_price', 'price',
+)
+# The columns read by imports.import_menu
+MENU_FIELDS = ('id', 'title', 'price', 'featured', 'category__title', 'category__slug')
+MENU_HEADER = ('id', 'title', 'price', 'featured', 'category', 'category_slug')
+
+
+def format_decimal(value):
+    return '{:f}'.format(value)
+
+
+def format_datetime(value):
+    # Same output as DRF's DateTimeField
+    value = timezone.localtime(value).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def iter_orders(orders, chunk_size=1000):
+    """Yield ``(order, items)`` value dicts for every order in ``orders``, in id order."""
+    orders = orders.order_by('id').values(*ORDER_FIELDS)
+    last_id = None
+    while True:
+        batch = orders.filter(id__gt=last_id) if last_id is not None else orders
+        batch = list(batch[:chunk_size])
+        if not batch:
+            return
+        items = defaultdict(list)
+        for item in (OrderItem.objects.filter(order_id__in=[order['id'] for order in batch])
+                     .order_by('order_id', 'id').values(*ITEM_FIELDS)):
+            items[item['order_id']].append(item)
+        for order in batch:
+            yield order, items[order['id']]
+        last_id = batch[-1]['id']
+
+
+def ndjson_rows(orders, chunk_size=1000):
+    """One JSON document per order, shaped like ``OrderSerializer`` output."""
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for order, items in iter_orders(orders, chunk_size):
+        yield encoder.encode({
+            'id': order['id'],
+            'user': order['user_id'],
+            'delivery_crew': order['delivery_crew_id'],
+            'status': order['status'],
+            'total': format_decimal(order['total']),
+            'date': format_datetime(order['date']),
+            'orderitem_set': [{
+                'id': item['id'],
+                'menuitem': item['menuitem__title'],
+                'quantity': item['quantity'],
+                'unit_price': format_decimal(item['unit_price']),
+                'price': format_decimal(item['price']),
+            } for item in items],
+        }) + '\n'
+
+
+class _Echo:
+    # csv.writer wants a file; hand each formatted line straight back instead
+    def write(self, value):
+        return value
+
+
+def csv_rows(orders, chunk_size=1000):
+    """One CSV row per order item; orders without items get a single row."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+    for order, items in iter_orders(orders, chunk_size):
+        order_columns = (
+            order['id'], order['user_id'], order['delivery_crew_id'] or '', order['status'],
+            format_decimal(order['total']), format_datetime(order['date']),
+        )
+        if not items:
+            yield writer.writerow(order_columns + ('',) * 5)
+        for item in items:
+            yield writer.writerow(order_columns + (
+                item['id'], item['menuitem__title'], item['quantity'],
+                format_decimal(item['unit_price']), format_decimal(item['price']),
+            ))
+
+
+def iter_menu(items, chunk_size=1000):
+    items = items.order_by('id').values_list(*MENU_FIELDS)
+    last_id = None
+    while True:
+        batch = items.filter(id__gt=last_id) if last_id is not None else items
+        batch = list(batch[:chunk_size])
+        if not batch:
+            return
+        for pk, title, price, featured, category, category_slug in batch:
+            yield pk, title, format_decimal(price), featured, category, category_slug
+        last_id = batch[-1][0]
+
+
+def menu_csv_rows(items, chunk_size=1000):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(MENU_HEADER)
+    for row in iter_menu(items, chunk_size):
+        yield writer.writerow(row)
+
+
+def menu_ndjson_rows(items, chunk_size=1000):
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for row in iter_menu(items, chunk_size):
+        yield encoder.encode(dict(zip(MENU_HEADER, row))) + '\n'
@@ -0,0 +1,124 @@
+"""
+``Idempotency-Key`` support for retried writes.
+
+A client that sends an unsafe request with an ``Idempotency-Key`` header and
+retries it with the same key gets the first response replayed, without the
+view running again. Keys are scoped to the user. Responses are kept in the
+Django cache, which all workers share (see ``CACHES``), for
+``LITTLELEMON_IDEMPOTENCY['TTL']`` seconds as ``(request fingerprint, status,
+JSON bytes)``, so a retry is replayed whichever worker it reaches.
+
+The first request claims its key with an atomic ``cache.add`` before running
+the view. The claim lasts ``CLAIM_TTL`` seconds, longer than any request
+may run, so it only runs out if the worker died mid-request. A duplicate
+that arrives while the first request is still running waits up to ``WAIT``
+seconds for the response instead of racing it, then gives up with ``409``. Server errors (5xx, including shed load) and exceptions release the
+key, so the retry runs the view again. Reusing a key for a different request
+is a ``422``. Rate limits don't count retries that are replayed from a
+stored response (see ``throttling.TokenBucketThrottle``).
+"""
+import hashlib
+import json
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from .renderers import FastJSONRenderer
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+IN_PROGRESS = 'in-progress'
+POLL_SECONDS = 0.05
+
+
+def _cache_key(user, key):
+    return f'littlelemon:idempotency:{user.pk}:{key}'
+
+
+def fingerprint(request):
+    """Digest of the method, path and parsed body, to spot a key reused for another request."""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = sorted(data.lists())
+    body = json.dumps([request.method, request.path, data], sort_keys=True, default=str)
+    return hashlib.blake2b(body.encode(), digest_size=16).digest()
+
+
+def has_stored_response(request):
+    """
+    Whether an unsafe request carries a key whose response is stored, so it
+    will only be replayed. Throttles let such retries through.
+    """
+    key = request.headers.get(HEADER)
+    if (not getattr(settings, 'LITTLELEMON_IDEMPOTENCY', None) or not key or request.method in SAFE_METHODS
+            or not request.user.is_authenticated):
+        return False
+    stored = cache.get(_cache_key(request.user, key))
+    return stored is not None and stored != IN_PROGRESS
+
+
+def replay(stored):
+    _, status_code, content = stored
+    response = HttpResponse(content, status=status_code, content_type='application/json')
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _wait_for(cache_key, deadline):
+    while time.monotonic() < deadline:
+        time.sleep(POLL_SECONDS)
+        stored = cache.get(cache_key)
+        if stored != IN_PROGRESS:
+            return stored
+    return IN_PROGRESS
+
+
+def idempotent(view):
+    """
+    Replay the response of an earlier unsafe request with the same
+    ``Idempotency-Key``. Goes below ``@api_view``, like ``replica_reads``.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        options = getattr(settings, 'LITTLELEMON_IDEMPOTENCY', None)
+        key = request.headers.get(HEADER)
+        if not options or key is None or request.method in SAFE_METHODS or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response({"detail": f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        cache_key = _cache_key(request.user, key)
+        digest = fingerprint(request)
+        wait = options.get('WAIT', 10)
+        while not cache.add(cache_key, IN_PROGRESS, timeout=options.get('CLAIM_TTL', 300)):
+            stored = cache.get(cache_key)
+            if stored == IN_PROGRESS:
+                stored = _wait_for(cache_key, time.monotonic() + wait)
+                if stored == IN_PROGRESS:
+                    return Response({"detail": "A request with this Idempotency-Key is still in progress"},
+                                    status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+            if stored is None:
+                # Released by a failed first attempt (or expired): claim it again
+                continue
+            if stored[0] != digest:
+                return Response({"detail": f"{HEADER} was already used for a different request"},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return replay(stored)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            cache.delete(cache_key)
+            raise
+        if response.status_code >= 500 or not isinstance(response, Response):
+            cache.delete(cache_key)
+        else:
+            content = FastJSONRenderer().render(response.data)
+            cache.set(cache_key, (digest, response.status_code, content), timeout=options.get('TTL', 24 * 60 * 60))
+        return response
+    return wrapper
@@ -0,0 +1,203 @@
+"""
+Bulk menu import.
+
+Rows are menu items keyed by title: ``title``, ``price``, ``featured`` and
+``category`` (a category title) with an optional ``category_slug`` for
+categories that don't exist yet. Rows are validated and written in
+batches of ``batch_size``, each costing a few queries: look up the batch's
+titles, create its new categories, one ``bulk_create``, then one ``UPDATE``
+per distinct new (price, featured, category). Items whose
+values didn't change aren't written.
+
+An import is all or nothing: it runs in one transaction, which is rolled
+back if any row is invalid. ``bulk_create`` and queryset ``update()`` skip the model
+signals, so the search index is rebuilt and the catalogue version bumped
+once at the end instead.
+"""
+import codecs
+import csv
+import json
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.text import slugify
+from .catalogue import bump_version_on_commit
+from .models import Category, MenuItem
+from . import search
+
+FORMATS = ('csv', 'json', 'ndjson')
+# Errors beyond this many are counted, not listed
+MAX_ERRORS = 100
+
+
+class MenuImportError(Exception):
+    def __init__(self, errors, error_count):
+        super().__init__(errors)
+        self.errors = errors
+        self.error_count = error_count
+
+
+def read_rows(lines, format):
+    """
+    Parse an iterable of text lines into ``(categories, items)`` row iterables.
+
+    JSON is either a list of items or ``{"categories": [...], "items": [...]}``;
+    CSV and NDJSON hold one item per line.
+    """
+    if format == 'csv':
+        return [], csv.DictReader(lines)
+    if format == 'ndjson':
+        return [], (json.loads(line, parse_float=Decimal) for line in lines if line.strip())
+    if format == 'json':
+        data = json.loads(''.join(lines), parse_float=Decimal)
+        categories, items = [], data
+        if isinstance(data, dict):
+            categories, items = data.get('categories', []), data.get('items', [])
+        if not isinstance(categories, list) or not isinstance(items, list):
+            raise ValueError("expected a list of items or an object with 'categories' and 'items' lists")
+        return categories, items
+    raise ValueError(f"Unknown menu import format {format!r}; use one of {', '.join(FORMATS)}")
+
+
+def decode_lines(stream, encoding='utf-8-sig'):
+    """Text lines from a binary file-like object, decoded incrementally."""
+    return codecs.iterdecode(stream, encoding)
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+_FIELDS = (
+    # (row key, model field, default when missing)
+    ('title', MenuItem._meta.get_field('title'), None),
+    ('price', MenuItem._meta.get_field('price'), None),
+    ('featured', MenuItem._meta.get_field('featured'), False),
+    ('category', Category._meta.get_field('title'), None),
+    ('category_slug', Category._meta.get_field('slug'), ''),
+)
+_CATEGORY_FIELDS = (
+    ('title', Category._meta.get_field('title'), None),
+    ('slug', Category._meta.get_field('slug'), ''),
+)
+
+
+def _clean(row, fields=_FIELDS):
+    """Return ``(values, errors)`` for one item row, or category row with ``_CATEGORY_FIELDS``."""
+    if not isinstance(row, dict):
+        return None, {'non_field_errors': ["Expected an object."]}
+    values, errors = {}, {}
+    for name, field, default in fields:
+        value = row.get(name)
+        if isinstance(value, str):
+            value = value.strip()
+            if name == 'featured' and value.lower() in ('true', 'false'):
+                value = value.lower() == 'true'
+        if value in (None, ''):
+            if default is None:
+                errors[name] = ["This field is required."]
+                continue
+            value = default
+        try:
+            values[name] = field.clean(value, None) if value != '' else value
+        except ValidationError as exc:
+            errors[name] = exc.messages
+    return values, errors
+
+
+def import_menu(items, categories=(), dry_run=False, batch_size=1000):
+    """
+    Create or update menu items (and their categories) from rows.
+
+    Returns counts of ``created``, ``updated`` and ``unchanged`` items and of
+    ``categories`` created. Raises ``MenuImportError`` with per-row errors
+    (``{"row": n, field: [messages]}``, or ``{"category_row": n, ...}`` for
+    categories, rows numbered from 1) if any row is invalid; nothing is
+    written then, nor with ``dry_run``.
+    """
+    report = {'created': 0, 'updated': 0, 'unchanged': 0, 'categories': 0}
+    errors, error_count = [], 0
+    seen = set()
+
+    with transaction.atomic():
+        known = {}
+        for pk, title in Category.objects.order_by('-id').values_list('id', 'title'):
+            known[title] = pk
+
+        def add_categories(rows):
+            new = {}
+            for title, slug in rows:
+                if title not in known and title not in new:
+                    new[title] = Category(title=title, slug=slug or slugify(title)[:50])
+            if new:
+                for category in Category.objects.bulk_create(new.values()):
+                    known[category.title] = category.pk
+                report['categories'] += len(new)
+
+        category_rows = []
+        for number, row in enumerate(categories, 1):
+            values, row_errors = _clean(row, _CATEGORY_FIELDS)
+            if row_errors:
+                error_count += 1
+                if len(errors) < MAX_ERRORS:
+                    errors.append({'category_row': number, **row_errors})
+            else:
+                category_rows.append((values['title'], values['slug']))
+        if not error_count:
+            add_categories(category_rows)
+
+        number = 0
+        for batch in _batches(items, batch_size):
+            valid = []
+            for row in batch:
+                number += 1
+                values, row_errors = _clean(row)
+                if not row_errors and values['title'] in seen:
+                    row_errors = {'title': ["Duplicate title in this import."]}
+                if row_errors:
+                    error_count += 1
+                    if len(errors) < MAX_ERRORS:
+                        errors.append({'row': number, **row_errors})
+                    continue
+                seen.add(values['title'])
+                valid.append(values)
+            if error_count:
+                # Keep validating, but there is nothing left to write
+                continue
+
+            add_categories((values['category'], values['category_slug']) for values in valid)
+            # First item with the title wins, like get() on the oldest row would
+            existing = {}
+            for row in (MenuItem.objects.filter(title__in=[values['title'] for values in valid])
+                        .order_by('-id').values_list('title', 'id', 'price', 'featured', 'category_id')):
+                existing[row[0]] = row[1:]
+
+            created, updated = [], defaultdict(list)
+            for values in valid:
+                new = (values['price'], values['featured'], known[values['category']])
+                current = existing.get(values['title'])
+                if current is None:
+                    created.append(MenuItem(title=values['title'], price=new[0], featured=new[1], category_id=new[2]))
+                elif current[1:] != new:
+                    updated[new].append(current[0])
+                else:
+                    report['unchanged'] += 1
+            MenuItem.objects.bulk_create(created)
+            # One UPDATE per distinct set of values; far cheaper than bulk_update's CASE per row
+            for (price, featured, category_id), pks in updated.items():
+                MenuItem.objects.filter(pk__in=pks).update(price=price, featured=featured, category_id=category_id)
+            report['created'] += len(created)
+            report['updated'] += sum(len(pks) for pks in updated.values())
+
+        if error_count:
+            raise MenuImportError(errors, error_count)
+        if dry_run:
+            transaction.set_rollback(True)
+        elif report['created'] or report['updated'] or report['categories']:
+            search.rebuild_index()
+            bump_version_on_commit()
+    return report
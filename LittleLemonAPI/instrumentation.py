@@ -0,0 +1,245 @@
+"""
+Per-request timing breakdown and an in-process metrics registry.
+
+``InstrumentationMiddleware`` collects, for each request, the time spent in
+authentication, role checks, SQL (query count, total and slowest query),
+serialization and rendering. The breakdown is sent back in a
+``Server-Timing`` header and recorded in histograms labelled by route, which
+the ``metrics`` view serves in the Prometheus text format.
+
+Phases are wall time and may overlap: queries issued while authenticating
+or serializing count towards ``db`` as well. Code outside a request (or with
+instrumentation disabled) pays one context variable lookup per ``timed``
+block or query.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 500, 1000)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _label_value(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        """Record ``value`` for the tuple of label values ``labels``."""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, [list(counts), total, count]) for labels, (counts, total, count) in self._series.items())
+        for labels, (counts, total, count) in series:
+            base = ''.join(f'{name}="{_label_value(value)}",' for name, value in zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{base}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base}le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{base.rstrip(",")}}} {total}')
+            lines.append(f'{self.name}_count{{{base.rstrip(",")}}} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def histogram(self, name, documentation, labelnames, buckets=BUCKETS):
+        metric = self._metrics[name] = Histogram(name, documentation, labelnames, buckets)
+        return metric
+
+    def clear(self):
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    'littlelemon_request_duration_seconds', 'Request duration.', ('view', 'method', 'status'))
+PHASE_SECONDS = REGISTRY.histogram(
+    'littlelemon_request_phase_seconds', 'Time spent in each phase of a request.', ('view', 'phase'))
+QUERIES = REGISTRY.histogram(
+    'littlelemon_request_queries', 'SQL queries per request.', ('view',), QUERY_BUCKETS)
+SLOWEST_QUERY_SECONDS = REGISTRY.histogram(
+    'littlelemon_request_slowest_query_seconds', 'Slowest SQL query of each request.', ('view',))
+
+
+class RequestTimings:
+    __slots__ = ('phases', 'queries', 'slowest')
+
+    def __init__(self):
+        self.phases = {}
+        self.queries = 0
+        self.slowest = 0.0
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_query(self, seconds):
+        self.add('db', seconds)
+        self.queries += 1
+        if seconds > self.slowest:
+            self.slowest = seconds
+
+
+_current = contextvars.ContextVar('littlelemon_timings', default=None)
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to ``phase`` of the current request."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - start)
+
+
+def _record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(time.perf_counter() - start)
+
+
+def _instrument(connection):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@receiver(connection_created)
+def _instrument_new_connection(connection, **kwargs):
+    _instrument(connection)
+
+
+def server_timing(timings, total):
+    entries = []
+    for phase, seconds in timings.phases.items():
+        entry = f'{phase};dur={seconds * 1000:.2f}'
+        if phase == 'db':
+            entry += f';desc="{timings.queries} queries (slowest {timings.slowest * 1000:.2f}ms)"'
+        entries.append(entry)
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+
+class InstrumentationMiddleware:
+    """
+    Time each request and record it in ``REGISTRY``.
+
+    Put it first in ``MIDDLEWARE`` so the total covers the other middleware.
+    Disabled unless ``LITTLELEMON_INSTRUMENTATION`` is set.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        options = getattr(settings, 'LITTLELEMON_INSTRUMENTATION', None)
+        if not options:
+            raise MiddlewareNotUsed
+        self.server_timing = options.get('SERVER_TIMING', 'managers')
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # Connections opened before this point never sent connection_created
+        for connection in connections.all(initialized_only=True):
+            _instrument(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns
+        timings = _current.get()
+        if timings is not None:
+            start = time.perf_counter()
+            response.add_post_render_callback(lambda response: timings.add('render', time.perf_counter() - start))
+        return response
+
+    def finish(self, request, response, timings, total):
+        match = request.resolver_match
+        view = match.route if match is not None else 'unmatched'
+        REQUEST_SECONDS.observe((view, request.method, str(response.status_code)), total)
+        for phase, seconds in timings.phases.items():
+            PHASE_SECONDS.observe((view, phase), seconds)
+        QUERIES.observe((view,), timings.queries)
+        if timings.queries:
+            SLOWEST_QUERY_SECONDS.observe((view,), timings.slowest)
+        if self.sends_server_timing(request):
+            response['Server-Timing'] = server_timing(timings, total)
+        return response
+
+    def sends_server_timing(self, request):
+        if self.server_timing != 'managers':
+            return bool(self.server_timing)
+        # roles imports this module
+        from .roles import is_manager
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_authenticated and (user.is_staff or is_manager(user))
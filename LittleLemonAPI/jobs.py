@@ -0,0 +1,130 @@
+"""
+Database-backed background jobs.
+
+Work that doesn't have to finish before a response is sent (receipts,
+delivery assignment, ...) is stored as ``Job`` rows with ``enqueue()`` and
+run by ``python manage.py runworker``. No broker is needed: the queue is a
+table, so it works on SQLite and PostgreSQL alike, and a job enqueued
+inside a transaction only becomes visible if that transaction commits.
+
+Tasks are plain functions registered with ``@task`` (see ``tasks.py``) and
+called with the job's JSON payload as keyword arguments. A worker takes a
+batch of due jobs at once, leasing them for the visibility timeout: their
+``run_at`` moves that far ahead, so if the worker dies, another one picks
+them up once the lease expires. Finished jobs are deleted. A job that
+raises is retried after an exponential backoff, and after ``max_attempts``
+it is kept with ``failed`` set and the traceback in ``last_error``.
+
+Like dispatch, batches are taken with ``SELECT ... FOR UPDATE SKIP LOCKED``
+where supported, and the lease is a conditional ``UPDATE``, so concurrent
+workers never run the same job twice within a lease. A job may still run
+again if its lease expires before it finishes, so tasks should be safe to
+repeat.
+"""
+import datetime
+import traceback
+import uuid
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Job
+
+TASKS = {}
+
+
+def _options():
+    return getattr(settings, 'LITTLELEMON_JOBS', None) or {}
+
+
+def task(function):
+    """Register ``function`` as a task under its name."""
+    TASKS[function.__name__] = function
+    return function
+
+
+def enqueue_many(calls, delay=0):
+    """
+    Enqueue ``(task name, payload dict)`` pairs in one INSERT. Runs in the
+    caller's transaction: the jobs are only queued if it commits.
+    """
+    for name, _ in calls:
+        if name not in TASKS:
+            raise ValueError(f"Unknown task {name!r}")
+    run_at = timezone.now() + datetime.timedelta(seconds=delay)
+    max_attempts = _options().get('MAX_ATTEMPTS', 5)
+    return Job.objects.bulk_create([
+        Job(name=name, payload=payload, run_at=run_at, max_attempts=max_attempts) for name, payload in calls
+    ])
+
+
+def enqueue(name, payload=None, delay=0):
+    return enqueue_many([(name, payload or {})], delay=delay)[0]
+
+
+def dequeue(batch_size=10, visibility_timeout=None):
+    """Lease up to ``batch_size`` due jobs, oldest first, and return them."""
+    if visibility_timeout is None:
+        visibility_timeout = _options().get('VISIBILITY_TIMEOUT', 60)
+    now = timezone.now()
+    lease = uuid.uuid4().hex
+    with transaction.atomic():
+        due = Job.objects.filter(failed=False, run_at__lte=now).order_by('run_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return []
+        Job.objects.filter(pk__in=ids, failed=False, run_at__lte=now).update(
+            run_at=now + datetime.timedelta(seconds=visibility_timeout), lease=lease, attempts=F('attempts') + 1)
+    return list(Job.objects.filter(pk__in=ids, lease=lease).order_by('run_at', 'id'))
+
+
+def backoff(attempts):
+    """Seconds before retrying a job that has failed ``attempts`` times."""
+    options = _options()
+    return min(options.get('MAX_BACKOFF', 300), options.get('BACKOFF', 2) * 2 ** (attempts - 1))
+
+
+def complete(job):
+    # Unless the lease expired and another worker has the job now
+    Job.objects.filter(pk=job.pk, lease=job.lease).delete()
+
+
+def fail(job, error):
+    jobs = Job.objects.filter(pk=job.pk, lease=job.lease)
+    if job.attempts >= job.max_attempts:
+        jobs.update(failed=True, lease='', last_error=error)
+    else:
+        jobs.update(run_at=timezone.now() + datetime.timedelta(seconds=backoff(job.attempts)), lease='',
+                    last_error=error)
+
+
+def execute(name, payload):
+    """Run one task; returns None, or the traceback if it raised. Called in the worker pool."""
+    try:
+        TASKS[name](**payload)
+    except Exception:
+        return traceback.format_exc()
+    finally:
+        close_old_connections()
+    return None
+
+
+def run_batch(executor=None, batch_size=10, visibility_timeout=None):
+    """
+    Lease a batch of jobs and run them, on ``executor`` (a
+    ``concurrent.futures`` pool) if given. Returns ``(succeeded, failed)``.
+    """
+    jobs = dequeue(batch_size, visibility_timeout)
+    if executor is None:
+        errors = [execute(job.name, job.payload) for job in jobs]
+    else:
+        errors = [future.result() for future in [executor.submit(execute, job.name, job.payload) for job in jobs]]
+    for job, error in zip(jobs, errors):
+        if error is None:
+            complete(job)
+        else:
+            fail(job, error)
+    failed = sum(error is not None for error in errors)
+    return len(jobs) - failed, failed
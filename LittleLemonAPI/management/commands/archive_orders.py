@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI import archive
+
+
+class Command(BaseCommand):
+    help = "Move delivered orders older than --days into the order archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help="Archive delivered orders older than this.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Orders moved per transaction.")
+
+    def handle(self, *args, days, batch_size, verbosity, **options):
+        archived = archive.archive_orders(days, batch_size=batch_size, stdout=self.stdout if verbosity > 1 else None)
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} orders."))
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from LittleLemonAPI import dispatch
+
+
+class Command(BaseCommand):
+    help = "Assign queued orders to the delivery crew, once or every --interval seconds."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Orders assigned per transaction.")
+        parser.add_argument('--strategy', help="Overrides LITTLELEMON_DISPATCH_STRATEGY.")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Drain the queue and exit.")
+
+    def handle(self, *args, batch_size, strategy, interval, once, verbosity, **options):
+        dispatch.get_strategy(strategy)
+        while True:
+            close_old_connections()
+            assigned = dispatch.dispatch(batch_size=batch_size, strategy=strategy)
+            if assigned and verbosity > 1:
+                self.stdout.write(f"Assigned {assigned} orders.")
+            if assigned == batch_size:
+                continue
+            if once:
+                break
+            time.sleep(interval)
+        if verbosity:
+            self.stdout.write(self.style.SUCCESS("Dispatch queue drained."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.models import MenuItem
+from LittleLemonAPI import exports
+
+
+class Command(BaseCommand):
+    help = "Write every menu item as CSV or NDJSON, in the format import_menu reads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=('csv', 'ndjson'), default='csv')
+        parser.add_argument('--output', '-o', help="File to write instead of standard output.")
+
+    def handle(self, *args, format, output, **options):
+        rows = (exports.menu_csv_rows if format == 'csv' else exports.menu_ndjson_rows)(MenuItem.objects.all())
+        if output is None:
+            for row in rows:
+                self.stdout.write(row, ending='')
+            return
+        with open(output, 'w', encoding='utf-8', newline='') as stream:
+            stream.writelines(rows)
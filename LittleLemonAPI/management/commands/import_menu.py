@@ -0,0 +1,39 @@
+import csv
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from LittleLemonAPI import imports
+
+
+class Command(BaseCommand):
+    help = "Create or update menu items and categories from a CSV, JSON or NDJSON file, keyed by title."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for standard input.")
+        parser.add_argument('--format', choices=imports.FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--dry-run', action='store_true', help="Validate and count, but write nothing.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows validated and written per batch.")
+
+    def handle(self, *args, path, format, dry_run, batch_size, **options):
+        format = format or os.path.splitext(path)[1].lstrip('.').lower()
+        if format not in imports.FORMATS:
+            raise CommandError(f"Pass --format, one of {', '.join(imports.FORMATS)}")
+        stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            categories, items = imports.read_rows(imports.decode_lines(stream), format)
+            report = imports.import_menu(items, categories, dry_run=dry_run, batch_size=batch_size)
+        except imports.MenuImportError as exc:
+            for error in exc.errors:
+                label = f"Row {error.pop('row')}" if 'row' in error else f"Category row {error.pop('category_row')}"
+                self.stderr.write(f"{label}: " + '; '.join(
+                    f"{field}: {' '.join(messages)}" for field, messages in error.items()))
+            raise CommandError(f"{exc.error_count} invalid rows, nothing imported.")
+        except (ValueError, csv.Error) as exc:
+            raise CommandError(f"Invalid {format}: {exc}")
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+        prefix = "Dry run: would have" if dry_run else "Menu imported:"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} created {report['created']}, updated {report['updated']} "
+            f"({report['unchanged']} unchanged) items and {report['categories']} categories."))
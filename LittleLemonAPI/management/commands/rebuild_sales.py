@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.models import ArchivedOrder, Order
+from LittleLemonAPI import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the DailySales and ItemSales rollups from order history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help="Orders read per query.")
+
+    def handle(self, *args, batch_size, verbosity, **options):
+        days, items = rollups.rebuild(
+            Order.objects.all(), batch_size=batch_size, stdout=self.stdout if verbosity > 1 else None,
+            archived_orders=ArchivedOrder.objects.all())
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt sales rollups: {days} days, {items} item rows."))
@@ -0,0 +1,52 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+
+
+def _init_process():
+    import django
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = "Run background jobs, polling every --interval seconds when the queue is empty."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help="Jobs run at the same time.")
+        parser.add_argument('--executor', choices=('thread', 'process'), default='thread',
+                            help="Run jobs in a thread pool (default) or a process pool.")
+        parser.add_argument('--batch-size', type=int, help="Jobs leased at once (default: --concurrency).")
+        parser.add_argument('--visibility-timeout', type=float,
+                            help="Seconds a worker holds a job. Overrides LITTLELEMON_JOBS['VISIBILITY_TIMEOUT'].")
+        parser.add_argument('--interval', type=float, default=1, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Run the due jobs and exit.")
+
+    def handle(self, *args, concurrency, executor, batch_size, visibility_timeout, interval, once, verbosity,
+               **options):
+        # Imported here: spawned pool processes load this module before django.setup()
+        from django.db import close_old_connections
+        from LittleLemonAPI import jobs
+
+        batch_size = batch_size or concurrency
+        if executor == 'process':
+            # Spawned, not forked: children must not inherit the open database connections
+            pool = ProcessPoolExecutor(concurrency, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_process)
+        else:
+            pool = ThreadPoolExecutor(concurrency, thread_name_prefix='littlelemon-job')
+        succeeded = failed = 0
+        with pool:
+            while True:
+                close_old_connections()
+                done, errors = jobs.run_batch(pool, batch_size, visibility_timeout)
+                succeeded, failed = succeeded + done, failed + errors
+                if errors and verbosity:
+                    self.stderr.write(f"{errors} jobs failed and will be retried or marked failed.")
+                if done + errors == batch_size:
+                    continue
+                if once:
+                    break
+                time.sleep(interval)
+        if verbosity:
+            self.stdout.write(self.style.SUCCESS(f"Ran {succeeded + failed} jobs, {failed} failed."))
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.2 on 2026-10-18 20:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_fts_index(apps, schema_editor):
+    # Only SQLite gets the FTS5 index, other databases keep using LIKE
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS "LittleLemonAPI_menuitem_fts" '
+        "USING fts5(title, tokenize='trigram')"
+    )
+    schema_editor.execute(
+        'INSERT INTO "LittleLemonAPI_menuitem_fts" (rowid, title) '
+        'SELECT id, title FROM "LittleLemonAPI_menuitem"'
+    )
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS "LittleLemonAPI_menuitem_fts"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0003_alter_category_options_alter_order_total'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuItemSearch',
+            fields=[
+                ('menuitem', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='LittleLemonAPI.menuitem')),
+                ('title', models.TextField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'LittleLemonAPI_menuitem_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
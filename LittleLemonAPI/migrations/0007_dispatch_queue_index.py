@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 20:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0006_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('delivery_crew__isnull', True), ('status', False)), fields=['date', 'id'], name='order_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.1.2 on 2026-10-18 20:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0008_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('status', models.BooleanField(default=True)),
+                ('total', models.DecimalField(decimal_places=2, default=0.0, max_digits=6)),
+                ('date', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('quantity', models.SmallIntegerField(default=1)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=6)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', True)), fields=['date', 'id'], name='order_delivered_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='delivery_crew',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='menuitem',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='LittleLemonAPI.menuitem'),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='order',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='LittleLemonAPI.archivedorder'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', 'date', 'id'], name='archivedorder_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['date', 'id'], name='archivedorder_date_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='archivedorderitem',
+            unique_together={('order', 'menuitem')},
+        ),
+    ]
@@ -17,13 +17,21 @@ class MenuItem(models.Model):
     title = models.CharField(max_length=255, db_index=True)
     price = models.DecimalField(max_digits=6, decimal_places=2, db_index=True)
     featured = models.BooleanField(db_index=True)
-    category = models.ForeignKey(Category, on_delete=models.PROTECT)
+    # Indexed by menuitem_category_price_idx
+    category = models.ForeignKey(Category, on_delete=models.PROTECT, db_index=False)
+
+    class Meta:
+        indexes = [
+            # ?category= with ?price=
+            models.Index(fields=['category', 'price'], name='menuitem_category_price_idx'),
+        ]
 
     def __str__(self):
         return self.title
     
 class Cart(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Indexed by the unique (user, menuitems) index
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     menuitems = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
     quantity = models.SmallIntegerField(default=1)
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
@@ -36,19 +44,38 @@ class Cart(models.Model):
         return f"Cart: {self.user.username} - {self.menuitems.title} (x{self.quantity})"
     
 class Order(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Indexed by order_user_date_idx
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     delivery_crew = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='delivery_crew', null=True)
     status = models.BooleanField(db_index=True, default=0)
     total = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
     date = models.DateTimeField(db_index=True, auto_now_add=True)
 
+    class Meta:
+        # Order lists are paginated on (date, id)
+        indexes = [
+            # A customer's orders
+            models.Index(fields=['user', 'date', 'id'], name='order_user_date_idx'),
+            # A crew member's pending deliveries
+            models.Index(fields=['delivery_crew', 'date', 'id'], condition=models.Q(status=False),
+                         name='order_crew_pending_idx'),
+            # ?status=pending for managers
+            models.Index(fields=['date', 'id'], condition=models.Q(status=False), name='order_pending_date_idx'),
+            # The dispatch queue: pending orders nobody has been assigned to
+            models.Index(fields=['date', 'id'], condition=models.Q(status=False, delivery_crew__isnull=True),
+                         name='order_queue_idx'),
+            # ?status=delivered for managers, and the archiver
+            models.Index(fields=['date', 'id'], condition=models.Q(status=True), name='order_delivered_date_idx'),
+        ]
+
     def __str__(self):
         delivery_status = 'Assigned' if self.delivery_crew else 'Not Assigned'
         order_status = 'Completed' if self.status else 'Pending'
         return f"Order #{self.id} by {self.user.username} - {order_status}, Delivery: {delivery_status}, Total: ${self.total}"
 
 class OrderItem(models.Model):
-    order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    # Indexed by the unique (order, menuitem) index
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, db_index=False)
     menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
     quantity = models.SmallIntegerField(default=1)
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
@@ -58,4 +85,102 @@ class OrderItem(models.Model):
         unique_together = ('order', 'menuitem')
 
     def __str__(self):
-         return f"{self.quantity} x {self.menuitem.title} for Order #{self.order.id} - Unit Price: ${self.unit_price}, Total: ${self.price}"
\ No newline at end of file
+         return f"{self.quantity} x {self.menuitem.title} for Order #{self.order.id} - Unit Price: ${self.unit_price}, Total: ${self.price}"
+
+class ArchivedOrder(models.Model):
+    # Delivered orders moved out of Order by archive.py, keeping their ids
+    id = models.BigIntegerField(primary_key=True)
+    # Indexed by archivedorder_user_date_idx
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False, related_name='+')
+    delivery_crew = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    status = models.BooleanField(default=True)
+    total = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
+    date = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date', 'id'], name='archivedorder_user_date_idx'),
+            models.Index(fields=['date', 'id'], name='archivedorder_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived order #{self.id} by user #{self.user_id}, Total: ${self.total}"
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    # Indexed by the unique (order, menuitem) index
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, db_index=False)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='+')
+    quantity = models.SmallIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    price = models.DecimalField(max_digits=6, decimal_places=2)
+
+    class Meta:
+        unique_together = ('order', 'menuitem')
+
+    def __str__(self):
+        return f"{self.quantity} x {self.menuitem.title} for archived Order #{self.order_id}"
+
+class MenuItemSearch(models.Model):
+    # Read-only mapping of the SQLite FTS5 index over menu item titles.
+    # The table is created by migration and kept in sync by search.py.
+    menuitem = models.OneToOneField(MenuItem, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', related_name='search_entry')
+    title = models.TextField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'LittleLemonAPI_menuitem_fts'
+
+
+class DailySales(models.Model):
+    # Rollup of orders per day, maintained incrementally by rollups.py
+    date = models.DateField(unique=True)
+    orders = models.IntegerField(default=0)
+    delivered = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = "daily sales"
+
+    def __str__(self):
+        return f"{self.date}: {self.orders} orders, ${self.revenue}"
+
+
+class ItemSales(models.Model):
+    # Rollup of order items per day and menu item, maintained by rollups.py
+    date = models.DateField()
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = "item sales"
+        unique_together = ('date', 'menuitem')
+
+    def __str__(self):
+        return f"{self.date}: {self.quantity} x {self.menuitem.title}, ${self.revenue}"
+
+
+class Job(models.Model):
+    # A unit of background work, run by the runworker command (see jobs.py)
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    attempts = models.SmallIntegerField(default=0)
+    max_attempts = models.SmallIntegerField(default=5)
+    # Due time; while a worker holds the job, when its lease expires
+    run_at = models.DateTimeField()
+    lease = models.CharField(max_length=32, blank=True, default='')
+    failed = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Jobs that are due
+            models.Index(fields=['run_at', 'id'], condition=models.Q(failed=False), name='job_queue_idx'),
+        ]
+
+    def __str__(self):
+        state = 'failed' if self.failed else f'due {self.run_at:%Y-%m-%d %H:%M:%S}'
+        return f"Job #{self.id} {self.name} ({state}, {self.attempts} attempts)"
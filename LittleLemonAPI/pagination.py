@@ -0,0 +1,131 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of ``COUNT(*)`` plus ``OFFSET``, a page is fetched with a ``WHERE``
+on the ordering key of the last row seen, so every page costs the same
+index range scan no matter how deep it is. Cursors are opaque to clients.
+"""
+import base64
+import json
+from bisect import bisect_left, bisect_right
+from itertools import chain
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+
+
+def encode_cursor(position, reverse=False):
+    payload = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, ordering):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        position = payload['p']
+        reverse = bool(payload['r'])
+        if len(position) != len(ordering):
+            raise ValueError
+        position = [model._meta.get_field(name).to_python(value) for name, value in zip(ordering, position)]
+    except Exception:
+        raise NotFound("Invalid cursor")
+    return position, reverse
+
+
+def _after(ordering, position, reverse):
+    """Build ``(f1, f2, ...) > (v1, v2, ...)`` (or ``<``) as nested Q objects."""
+    lookup = 'lt' if reverse else 'gt'
+    condition = Q()
+    for i in range(len(ordering)):
+        equal = {name: value for name, value in zip(ordering[:i], position[:i])}
+        condition |= Q(**equal, **{f'{ordering[i]}__{lookup}': position[i]})
+    # Redundant bound on the first column, so the ORs become an index range
+    return Q(**{f'{ordering[0]}__{lookup}e': position[0]}) & condition
+
+
+def keyset_query(queryset, ordering, cursor, perpage):
+    """
+    Return the (unevaluated) queryset for one page and the state needed by
+    ``keyset_result`` to turn its rows into a page.
+    """
+    perpage = int(perpage)
+    if perpage < 1:
+        raise NotFound("Invalid page size")
+    position, reverse = decode_cursor(cursor, queryset.model, ordering) if cursor else (None, False)
+
+    if position is not None:
+        queryset = queryset.filter(_after(ordering, position, reverse))
+    queryset = queryset.order_by(*(f'-{name}' if reverse else name for name in ordering))
+    # One extra row tells us whether there is another page
+    return queryset[:perpage + 1], (ordering, perpage, position, reverse)
+
+
+def keyset_result(rows, state, key=None):
+    """``key(row)`` returns the ordering values of a row; rows are model instances by default."""
+    ordering, perpage, position, reverse = state
+    has_more = len(rows) > perpage
+    rows = rows[:perpage]
+    if reverse:
+        rows.reverse()
+
+    if key is None:
+        def key(row):
+            return [getattr(row, name) for name in ordering]
+
+    next_cursor = previous_cursor = None
+    if rows:
+        if has_more or reverse:
+            next_cursor = encode_cursor(key(rows[-1]))
+        if position is not None and (has_more or not reverse):
+            previous_cursor = encode_cursor(key(rows[0]), reverse=True)
+    return rows, next_cursor, previous_cursor
+
+
+def keyset_page(queryset, ordering, cursor, perpage, key=None):
+    """
+    Return ``(rows, next_cursor, previous_cursor)`` for one page of ``queryset``.
+
+    ``ordering`` is a tuple of ascending field names that must be unique
+    together, e.g. ``('date', 'id')``. An empty ``cursor`` means the first page.
+    """
+    queryset, state = keyset_query(queryset, ordering, cursor, perpage)
+    return keyset_result(list(queryset), state, key)
+
+
+def keyset_queries(querysets, ordering, cursor, perpage):
+    """``keyset_query`` for several querysets of the same rows, to be merged by ``keyset_merged``."""
+    queries = []
+    for queryset in querysets:
+        queryset, state = keyset_query(queryset, ordering, cursor, perpage)
+        queries.append(queryset)
+    return queries, state
+
+
+def keyset_merged(row_lists, state, key):
+    """``keyset_result`` for the rows of every ``keyset_queries`` query."""
+    rows = sorted(chain.from_iterable(row_lists), key=key, reverse=state[3])
+    return keyset_result(rows, state, key)
+
+
+def keyset_list(rows, ordering, cursor, perpage, key, model):
+    """
+    ``keyset_page`` over a list of rows already sorted by ``ordering``,
+    with the same cursors. ``key(row)`` returns the ordering values of a row.
+    """
+    perpage = int(perpage)
+    if perpage < 1:
+        raise NotFound("Invalid page size")
+    position, reverse = decode_cursor(cursor, model, ordering) if cursor else (None, False)
+
+    if position is None:
+        page = rows[:perpage + 1]
+    elif reverse:
+        end = bisect_left(rows, position, key=key)
+        page = rows[max(0, end - perpage - 1):end][::-1]
+    else:
+        start = bisect_right(rows, position, key=key)
+        page = rows[start:start + perpage + 1]
+    return keyset_result(page, (ordering, perpage, position, reverse), key)
+
+
+def cursor_response_data(results, next_cursor, previous_cursor):
+    return {'next': next_cursor, 'previous': previous_cursor, 'results': results}
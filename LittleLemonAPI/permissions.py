@@ -0,0 +1,23 @@
+from rest_framework.permissions import BasePermission
+from .roles import is_manager, is_delivery_crew, is_customer
+
+
+class IsManager(BasePermission):
+    message = "Not authorized"
+
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and is_manager(request.user)
+
+
+class IsDeliveryCrew(BasePermission):
+    message = "Not authorized"
+
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and is_delivery_crew(request.user)
+
+
+class IsCustomer(BasePermission):
+    message = "Not authorized"
+
+    def has_permission(self, request, view):
+        return is_customer(request.user)
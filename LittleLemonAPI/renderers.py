@@ -0,0 +1,79 @@
+import csv
+import io
+import json
+from decimal import Decimal
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson writes datetimes exactly like DRF's encoder once UTC is spelled 'Z'
+_ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z) if orjson else 0
+_drf_default = JSONEncoder().default
+
+
+def _encode_default(obj):
+    # Everything orjson can't serialize itself goes through DRF's encoder,
+    # with a shortcut for the most common case
+    if type(obj) is Decimal:
+        return float(obj)
+    return _drf_default(obj)
+
+# Escaped by DRF for JavaScript compatibility; orjson leaves them raw
+_LINE_SEPARATORS = ('\u2028'.encode(), '\u2029'.encode())
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    ``JSONRenderer`` backed by orjson when it is installed.
+
+    Output is the same as DRF's compact JSON. Requests for indented output
+    (e.g. the browsable API), or a missing orjson, fall back to the
+    standard library encoder.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if (self.get_indent(accepted_media_type or '', renderer_context or {})
+                or not self.compact or self.ensure_ascii):
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = orjson.dumps(data, default=_encode_default, option=_ORJSON_OPTIONS)
+        if b'\xe2\x80' in ret:
+            ret = ret.replace(_LINE_SEPARATORS[0], b'\\u2028').replace(_LINE_SEPARATORS[1], b'\\u2029')
+        return ret
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(
+            json.dumps(row, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')) + '\n'
+            for row in rows
+        ).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        buffer = io.StringIO()
+        if rows:
+            writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        return buffer.getvalue().encode(self.charset)
@@ -0,0 +1,160 @@
+"""
+Fast read-only serialization for GET responses.
+
+Produces the same data as ``MenuItemSerializer``, ``CartSerializer`` and
+``OrderSerializer`` but from ``values_list()`` tuples instead of model
+instances. Each representation compiles its fields once into a function
+that turns a row into a dict, from ``itemgetter``s and the formatters, so
+there is no per-field ``to_representation`` dispatch and no model
+instantiation per row. Write paths keep using the DRF serializers for
+validation.
+"""
+from collections import defaultdict
+from operator import itemgetter
+from .exports import format_decimal, format_datetime
+from .instrumentation import timed
+from .models import ArchivedOrderItem, OrderItem
+
+
+def _formatted(getter, formatter):
+    return lambda row: formatter(getter(row))
+
+
+class Representation:
+    """
+    A read-only serializer compiled from ``{output name: spec}``.
+
+    A spec is a field lookup, a ``(lookup, formatter)`` pair or a nested
+    dict of specs (for nested serializers).
+    """
+
+    def __init__(self, fields):
+        self.lookups = []
+        self.build = self._compile(fields)
+
+    def _compile(self, fields):
+        getters = []
+        for name, spec in fields.items():
+            if isinstance(spec, dict):
+                getter = self._compile(spec)
+            else:
+                lookup, formatter = (spec, None) if isinstance(spec, str) else spec
+                self.lookups.append(lookup)
+                getter = itemgetter(len(self.lookups) - 1)
+                if formatter is not None:
+                    getter = _formatted(getter, formatter)
+            getters.append((name, getter))
+        getters = tuple(getters)
+        return lambda row: {name: getter(row) for name, getter in getters}
+
+    def values(self, queryset):
+        """``queryset`` as the rows this representation is built from."""
+        return queryset.prefetch_related(None).values_list(*self.lookups)
+
+    def key(self, ordering):
+        """Row -> ordering values, for ``keyset_page``."""
+        getter = itemgetter(*(self.lookups.index(name) for name in ordering))
+        if len(ordering) == 1:
+            return lambda row: [getter(row)]
+        return lambda row: list(getter(row))
+
+    def many(self, rows):
+        build = self.build
+        with timed('serialize'):
+            return [build(row) for row in rows]
+
+    def one(self, row):
+        with timed('serialize'):
+            return self.build(row)
+
+
+MENU_ITEM = Representation({
+    'id': 'id',
+    'title': 'title',
+    'price': ('price', format_decimal),
+    'featured': 'featured',
+    'category': {
+        'id': 'category_id',
+        'title': 'category__title',
+        'slug': 'category__slug',
+    },
+})
+
+CART = Representation({
+    'id': 'id',
+    'user': 'user_id',
+    'menuitems': {
+        'id': 'menuitems_id',
+        'title': 'menuitems__title',
+        'price': ('menuitems__price', format_decimal),
+    },
+    'quantity': 'quantity',
+    'unit_price': ('unit_price', format_decimal),
+    'price': ('price', format_decimal),
+})
+
+ORDER = Representation({
+    'id': 'id',
+    'user': 'user_id',
+    'delivery_crew': 'delivery_crew_id',
+    'status': 'status',
+    'total': ('total', format_decimal),
+    'date': ('date', format_datetime),
+})
+
+ORDER_ITEM = Representation({
+    'id': 'id',
+    'menuitem': 'menuitem__title',
+    'quantity': 'quantity',
+    'unit_price': ('unit_price', format_decimal),
+    'price': ('price', format_decimal),
+})
+
+
+def _order_items(order_ids, model=OrderItem):
+    return model.objects.filter(order_id__in=order_ids).order_by('id').values_list('order_id', *ORDER_ITEM.lookups)
+
+
+def _attach_items(orders, item_rows):
+    items = defaultdict(list)
+    build = ORDER_ITEM.build
+    for order_id, *row in item_rows:
+        items[order_id].append(build(row))
+    for order in orders:
+        order['orderitem_set'] = items[order['id']]
+    return orders
+
+
+def with_items(orders, archived=False):
+    """
+    Add ``orderitem_set`` to ``ORDER`` dicts, fetching the items in one query,
+    or two if some of the orders may be archived.
+    """
+    if not orders:
+        return orders
+    order_ids = [order['id'] for order in orders]
+    item_rows = list(_order_items(order_ids))
+    if archived:
+        item_rows += _order_items(order_ids, ArchivedOrderItem)
+    with timed('serialize'):
+        return _attach_items(orders, item_rows)
+
+
+async def awith_items(orders, archived=False):
+    if not orders:
+        return orders
+    order_ids = [order['id'] for order in orders]
+    item_rows = [row async for row in _order_items(order_ids)]
+    if archived:
+        item_rows += [row async for row in _order_items(order_ids, ArchivedOrderItem)]
+    with timed('serialize'):
+        return _attach_items(orders, item_rows)
+
+
+def orders(rows, archived=False):
+    """``OrderSerializer(many=True)`` data for ``ORDER`` rows."""
+    return with_items(ORDER.many(rows), archived)
+
+
+async def aorders(rows, archived=False):
+    return await awith_items(ORDER.many(rows), archived)
@@ -0,0 +1,117 @@
+"""
+Role resolution for request users.
+
+A user's group names are loaded with one query and memoized on the user
+instance, so every role check after the first one in a request is free.
+Optionally the names are also kept in a process-level LRU keyed by user id
+(see the ``LITTLELEMON_ROLE_CACHE`` setting), which is invalidated whenever
+group membership changes or a group is renamed or deleted in this process,
+and expires after a few seconds for changes made in other workers.
+"""
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from .instrumentation import timed
+from .lru import LRUCache
+from .routers import use_replica
+
+MANAGER = 'Manager'
+DELIVERY_CREW = 'Delivery Crew'
+
+_MEMO_ATTR = '_littlelemon_roles'
+_cache = None
+_cache_loaded = False
+
+
+def _role_cache():
+    global _cache, _cache_loaded
+    if not _cache_loaded:
+        options = getattr(settings, 'LITTLELEMON_ROLE_CACHE', None)
+        _cache = LRUCache(options.get('MAXSIZE', 1024), options.get('TTL')) if options else None
+        _cache_loaded = True
+    return _cache
+
+
+@receiver(setting_changed)
+def _reset_role_cache(setting, **kwargs):
+    global _cache, _cache_loaded
+    if setting == 'LITTLELEMON_ROLE_CACHE':
+        _cache, _cache_loaded = None, False
+
+
+def _cached_roles(user):
+    roles = getattr(user, _MEMO_ATTR, None)
+    if roles is None:
+        cache = _role_cache()
+        if cache is not None:
+            roles = cache.get(user.pk)
+            if roles is not None:
+                setattr(user, _MEMO_ATTR, roles)
+    return roles
+
+
+def _store_roles(user, roles):
+    cache = _role_cache()
+    if cache is not None:
+        cache.set(user.pk, roles)
+    setattr(user, _MEMO_ATTR, roles)
+    return roles
+
+
+def get_roles(user):
+    """Return the frozenset of group names the user belongs to."""
+    if not user.is_authenticated:
+        return frozenset()
+    roles = _cached_roles(user)
+    if roles is None:
+        # Always from the primary: the result is cached beyond this request
+        with timed('roles'), use_replica(False):
+            roles = _store_roles(user, frozenset(user.groups.values_list('name', flat=True)))
+    return roles
+
+
+async def aget_roles(user):
+    """Async ``get_roles``; afterwards the sync helpers are free for this user."""
+    if not user.is_authenticated:
+        return frozenset()
+    roles = _cached_roles(user)
+    if roles is None:
+        with timed('roles'), use_replica(False):
+            roles = _store_roles(user, frozenset([name async for name in user.groups.values_list('name', flat=True)]))
+    return roles
+
+
+def set_roles(user, roles):
+    """Seed the per-request memo when the group names are already known."""
+    setattr(user, _MEMO_ATTR, frozenset(roles))
+
+
+def invalidate_roles(user=None, user_id=None):
+    """Forget cached roles for one user, or for everyone when no user is given."""
+    if user is not None:
+        user.__dict__.pop(_MEMO_ATTR, None)
+        user_id = user.pk
+    cache = _role_cache()
+    if cache is None:
+        return
+    if user_id is None:
+        cache.clear()
+    else:
+        cache.delete(user_id)
+
+
+def has_role(user, name):
+    return name in get_roles(user)
+
+
+def is_manager(user):
+    # Superusers are treated as managers everywhere
+    return user.is_superuser or has_role(user, MANAGER)
+
+
+def is_delivery_crew(user):
+    return has_role(user, DELIVERY_CREW)
+
+
+def is_customer(user):
+    return user.is_authenticated and not user.is_superuser and not (get_roles(user) & {MANAGER, DELIVERY_CREW})
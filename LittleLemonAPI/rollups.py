@@ -0,0 +1,151 @@
+"""
+Incrementally maintained sales rollups.
+
+``DailySales`` and ``ItemSales`` are updated as orders are created, deleted
+or change status, so reports read a handful of summary rows instead of
+aggregating over ``Order``/``OrderItem``. Each change costs a constant
+number of queries regardless of how many items an order has:
+insert-if-missing with ``ignore_conflicts``, then one ``F()`` update.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import Case, When, F, Value
+from django.utils import timezone
+from .models import ArchivedOrderItem, DailySales, ItemSales, OrderItem
+
+
+def _order_items(order, items):
+    if items is None:
+        items = OrderItem.objects.filter(order=order).values_list('menuitem_id', 'quantity', 'price')
+    return [(menuitem_id, quantity, price) for menuitem_id, quantity, price in items]
+
+
+def _add_daily(day, orders=0, delivered=0, revenue=0):
+    DailySales.objects.bulk_create([DailySales(date=day)], ignore_conflicts=True)
+    DailySales.objects.filter(date=day).update(
+        orders=F('orders') + orders,
+        delivered=F('delivered') + delivered,
+        revenue=F('revenue') + revenue,
+    )
+
+
+def _add_items(day, items, sign):
+    if not items:
+        return
+    ItemSales.objects.bulk_create(
+        [ItemSales(date=day, menuitem_id=menuitem_id) for menuitem_id, _, _ in items],
+        ignore_conflicts=True)
+
+    def delta(index):
+        return Case(*(When(menuitem_id=item[0], then=Value(sign * item[index])) for item in items))
+
+    ItemSales.objects.filter(date=day, menuitem_id__in=[item[0] for item in items]).update(
+        quantity=F('quantity') + delta(1),
+        revenue=F('revenue') + delta(2),
+    )
+
+
+def record_order(order, items=None):
+    """
+    Add a new order to the rollups.
+
+    ``items`` is an optional iterable of ``(menuitem_id, quantity, price)``
+    for callers that already have them; otherwise they are read from the DB.
+    """
+    items = _order_items(order, items)
+    day = timezone.localdate(order.date)
+    with transaction.atomic():
+        _add_daily(day, orders=1, delivered=int(bool(order.status)), revenue=sum(price for _, _, price in items))
+        _add_items(day, items, 1)
+
+
+def unrecord_order(order, items=None):
+    """Remove an order from the rollups, before it is deleted."""
+    items = _order_items(order, items)
+    day = timezone.localdate(order.date)
+    with transaction.atomic():
+        _add_daily(day, orders=-1, delivered=-int(bool(order.status)), revenue=-sum(price for _, _, price in items))
+        _add_items(day, items, -1)
+
+
+def record_status_change(order, was_delivered):
+    if bool(order.status) == bool(was_delivered):
+        return
+    _add_daily(timezone.localdate(order.date), delivered=1 if order.status else -1)
+
+
+def _lock_for_rebuild(outermost):
+    """
+    Hold off incremental updates until the rebuild commits, and make its
+    reads one snapshot, so an order archived meanwhile is counted once.
+    """
+    if connection.vendor != 'postgresql':
+        # SQLite: the IMMEDIATE transaction already holds the write lock
+        return
+    with connection.cursor() as cursor:
+        if outermost:
+            # Inside a caller's transaction, the caller's isolation level applies
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        # Before any query, which would take the snapshot. Blocks checkouts
+        # and status changes (which update the rollups), not reports.
+        tables = ', '.join(connection.ops.quote_name(model._meta.db_table) for model in (DailySales, ItemSales))
+        cursor.execute(f'LOCK TABLE {tables} IN SHARE ROW EXCLUSIVE MODE')
+
+
+def rebuild(orders, batch_size=2000, stdout=None, archived_orders=None):
+    """
+    Recompute the rollups from ``orders`` and ``archived_orders`` (querysets)
+    in keyset batches.
+
+    Totals are accumulated in memory, which is bounded by days x menu items.
+    Everything runs in one transaction that holds off incremental updates,
+    so none is lost to the swap at the end and orders are counted once even
+    if they are archived meanwhile; checkouts wait for it to commit.
+    """
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        _lock_for_rebuild(outermost)
+        return _rebuild(orders, batch_size, stdout, archived_orders)
+
+
+def _rebuild(orders, batch_size, stdout, archived_orders):
+    daily = defaultdict(lambda: [0, 0, Decimal(0)])
+    per_item = defaultdict(lambda: [0, Decimal(0)])
+    sources = [(orders, OrderItem)]
+    if archived_orders is not None:
+        sources.append((archived_orders, ArchivedOrderItem))
+    for orders, item_model in sources:
+        orders = orders.order_by('id').values_list('id', 'date', 'status')
+        last_id = 0
+        while True:
+            batch = list(orders.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            days = {}
+            for order_id, date, delivered in batch:
+                days[order_id] = timezone.localdate(date)
+                totals = daily[days[order_id]]
+                totals[0] += 1
+                totals[1] += int(delivered)
+            items = item_model.objects.filter(order_id__in=list(days)).values_list(
+                'order_id', 'menuitem_id', 'quantity', 'price')
+            for order_id, menuitem_id, quantity, price in items:
+                daily[days[order_id]][2] += price
+                totals = per_item[days[order_id], menuitem_id]
+                totals[0] += quantity
+                totals[1] += price
+            last_id = batch[-1][0]
+            if stdout:
+                stdout.write(f"Processed orders up to #{last_id}")
+
+    DailySales.objects.all().delete()
+    ItemSales.objects.all().delete()
+    DailySales.objects.bulk_create(
+        [DailySales(date=day, orders=o, delivered=d, revenue=r) for day, (o, d, r) in daily.items()],
+        batch_size=batch_size)
+    ItemSales.objects.bulk_create(
+        [ItemSales(date=day, menuitem_id=menuitem_id, quantity=q, revenue=r)
+         for (day, menuitem_id), (q, r) in per_item.items()],
+        batch_size=batch_size)
+    return len(daily), len(per_item)
@@ -0,0 +1,122 @@
+"""
+Read-replica routing.
+
+Views decorated with ``replica_reads`` run their safe (GET/HEAD/OPTIONS)
+requests with ``ReplicaRouter`` sending reads to one of the
+``LITTLELEMON_READ_REPLICAS`` aliases. Everything else, including all
+writes, goes to ``default``.
+
+Replication lags, so a user who just changed something (checkout, cart or
+any other successful unsafe request through a decorated view) is pinned to
+the primary for ``LITTLELEMON_REPLICA_PIN_SECONDS`` and reads their own
+writes. Pins live in the Django cache, which must be shared by all workers:
+with replicas configured, ``check_shared_cache()`` (run at startup) refuses
+a per-process one, since a pin set by one worker would not reach the next
+request on another.
+"""
+import contextvars
+import random
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.permissions import SAFE_METHODS
+
+_use_replica = contextvars.ContextVar('littlelemon_use_replica', default=False)
+
+
+def replicas():
+    return getattr(settings, 'LITTLELEMON_READ_REPLICAS', [])
+
+
+def _pin_key(user_id):
+    return f'littlelemon:pin:{user_id}'
+
+
+def _pin_seconds():
+    return getattr(settings, 'LITTLELEMON_REPLICA_PIN_SECONDS', 5)
+
+
+def check_shared_cache():
+    if replicas() and isinstance(caches['default'], (LocMemCache, DummyCache)):
+        raise ImproperlyConfigured(
+            "Read replicas need a cache shared by all workers for read-your-writes pins; "
+            "the default cache is per process. See CACHES in settings.")
+
+
+def pin_to_primary(user):
+    """Serve ``user``'s reads from the primary for the next few seconds."""
+    if user.is_authenticated and replicas():
+        cache.set(_pin_key(user.pk), True, timeout=_pin_seconds())
+
+
+def is_pinned(user):
+    return user.is_authenticated and cache.get(_pin_key(user.pk), False)
+
+
+async def ais_pinned(user):
+    return user.is_authenticated and await cache.aget(_pin_key(user.pk), False)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # The database cache backend's table: pins and versions must not lag
+        if _use_replica.get() and model._meta.app_label != 'django_cache':
+            aliases = replicas()
+            if aliases:
+                return random.choice(aliases)
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Explicit, or instances read from a replica would be saved back to it
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {'default', *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class use_replica:
+    """
+    Context manager routing the reads inside it to a replica, or with
+    ``enabled=False`` back to the primary, for data that is cached beyond
+    the request and must not be stale.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
+    def __enter__(self):
+        self._token = _use_replica.set(self.enabled)
+
+    def __exit__(self, *exc_info):
+        _use_replica.reset(self._token)
+
+
+def replica_reads(view):
+    """
+    Route the safe requests of a DRF function view to a replica, and pin
+    the user to the primary after a successful unsafe one.
+
+    Goes below ``@api_view``/``@permission_classes``, so ``request.user`` is
+    the authenticated user.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not replicas():
+            return view(request, *args, **kwargs)
+        if request.method not in SAFE_METHODS:
+            response = view(request, *args, **kwargs)
+            if response.status_code < 400:
+                pin_to_primary(request.user)
+            return response
+        if is_pinned(request.user):
+            return view(request, *args, **kwargs)
+        with use_replica():
+            return view(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,201 @@
+"""
+Menu item search behind ``?search=``.
+
+The parameter keeps its substring (``icontains``) semantics, but instead of
+a full table scan it is answered by one of these backends, picked with the
+``LITTLELEMON_MENU_SEARCH`` setting:
+
+* ``fts``: an SQLite FTS5 trigram index over titles (``MenuItemSearch``).
+  Falls back to ``like`` on other databases.
+* ``memory``: an in-process trigram inverted index, for small menus. It is
+  rebuilt lazily whenever the menu catalogue version changes.
+* ``like``: plain ``title__icontains``.
+
+Queries shorter than one trigram can't use an index and always use ``like``.
+Every backend ranks the same way: prefix matches first, then earlier matches
+and shorter titles.
+"""
+import threading
+from asgiref.sync import sync_to_async
+from collections import defaultdict
+from django.conf import settings
+from django.db import connections
+from django.db.models import Lookup, Value
+from django.db.models.functions import Length, Lower, StrIndex
+from .models import MenuItem, MenuItemSearch
+from . import catalogue
+
+FTS_TABLE = MenuItemSearch._meta.db_table
+TRIGRAM = 3
+# Above this many hits an id__in filter costs more than it saves
+MEMORY_MAX_IDS = 10_000
+
+
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+MenuItemSearch._meta.get_field('title').register_lookup(Match)
+
+
+def get_backend():
+    return getattr(settings, 'LITTLELEMON_MENU_SEARCH', 'like')
+
+
+_fts_tables = {}
+
+
+def fts_enabled(using='default'):
+    """Whether the FTS5 table exists on this database (checked once per alias)."""
+    if using not in _fts_tables:
+        connection = connections[using]
+        _fts_tables[using] = (
+            connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names())
+    return _fts_tables[using]
+
+
+def _phrase(query):
+    # Quote the whole query as one FTS5 phrase so user input can't use the
+    # query syntax; with the trigram tokenizer a phrase is a substring match.
+    return '"' + query.replace('"', '""') + '"'
+
+
+def _ranked(items, query):
+    return items.order_by(StrIndex(Lower('title'), Value(query.lower())), Length('title'), 'id')
+
+
+def filter_menu_items(items, query, index=None):
+    """
+    Filter a ``MenuItem`` queryset by a search string, best matches first.
+
+    ``index`` is an already loaded in-process index (see ``aprepare``).
+    """
+    backend = get_backend()
+    if len(query) < TRIGRAM or backend == 'like':
+        return _ranked(items.filter(title__icontains=query), query)
+
+    if backend == 'fts':
+        if not fts_enabled(items.db):
+            return _ranked(items.filter(title__icontains=query), query)
+        return _ranked(items.filter(search_entry__title__match=_phrase(query)), query)
+
+    if backend == 'memory':
+        ids = (index or memory_index()).search(query)
+        if not ids:
+            return items.none()
+        if len(ids) > MEMORY_MAX_IDS:
+            return _ranked(items.filter(title__icontains=query), query)
+        return _ranked(items.filter(id__in=ids), query)
+
+    raise ValueError(f"Unknown menu search backend {backend!r}")
+
+
+# FTS5 index maintenance
+
+def index_items(items, using='default'):
+    if not fts_enabled(using):
+        return
+    rows = [(item.pk, item.title) for item in items]
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM "{FTS_TABLE}" WHERE rowid = %s', [(pk,) for pk, _ in rows])
+        cursor.executemany(f'INSERT INTO "{FTS_TABLE}" (rowid, title) VALUES (%s, %s)', rows)
+
+
+def remove_items(pks, using='default'):
+    if not fts_enabled(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM "{FTS_TABLE}" WHERE rowid = %s', [(pk,) for pk in pks])
+
+
+def rebuild_index(using='default'):
+    """Rebuild the FTS5 index from scratch, e.g. after bulk writes that skip signals."""
+    if not fts_enabled(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{FTS_TABLE}"')
+        cursor.execute(
+            f'INSERT INTO "{FTS_TABLE}" (rowid, title) SELECT id, title FROM "{MenuItem._meta.db_table}"')
+
+
+# In-process index
+
+class InvertedIndex:
+    """Trigram postings over lower-cased titles, for substring search."""
+
+    def __init__(self, rows):
+        self.titles = {}
+        self.postings = defaultdict(set)
+        for pk, title in rows:
+            title = title.lower()
+            self.titles[pk] = title
+            for gram in self.trigrams(title):
+                self.postings[gram].add(pk)
+
+    @staticmethod
+    def trigrams(text):
+        return {text[i:i + TRIGRAM] for i in range(len(text) - TRIGRAM + 1)}
+
+    def search(self, query):
+        """Return matching ids, prefix matches first, then earlier and shorter matches."""
+        query = query.lower()
+        postings = sorted((self.postings.get(gram, set()) for gram in self.trigrams(query)), key=len)
+        if not postings or not postings[0]:
+            return []
+        candidates = postings[0].intersection(*postings[1:])
+        matches = []
+        for pk in candidates:
+            title = self.titles[pk]
+            position = title.find(query)
+            if position >= 0:
+                matches.append((position, len(title), pk))
+        matches.sort()
+        return [pk for _, _, pk in matches]
+
+
+_memory_index = (None, None)
+_memory_lock = threading.Lock()
+
+
+def memory_index():
+    global _memory_index
+    version = catalogue.get_version()
+    indexed_version, index = _memory_index
+    if indexed_version != version:
+        with _memory_lock:
+            indexed_version, index = _memory_index
+            if indexed_version != version:
+                index = InvertedIndex(MenuItem.objects.values_list('id', 'title').iterator())
+                _memory_index = (version, index)
+    return index
+
+
+async def amemory_index():
+    global _memory_index
+    version = await catalogue.aget_version()
+    indexed_version, index = _memory_index
+    if indexed_version != version:
+        index = InvertedIndex([row async for row in MenuItem.objects.values_list('id', 'title')])
+        _memory_index = (version, index)
+    return index
+
+
+async def aprepare(query, using='default'):
+    """
+    Load whatever ``filter_menu_items`` would otherwise fetch synchronously,
+    so async views can build the queryset without blocking the event loop.
+    Returns the index to pass on to ``filter_menu_items``.
+    """
+    backend = get_backend()
+    if len(query) < TRIGRAM:
+        return None
+    if backend == 'fts' and using not in _fts_tables:
+        await sync_to_async(fts_enabled)(using)
+    elif backend == 'memory':
+        return await amemory_index()
+    return None
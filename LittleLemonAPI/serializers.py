@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Category, MenuItem, Cart, Order, OrderItem
+from .models import Category, MenuItem, Cart, Order, OrderItem, DailySales
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -44,6 +44,22 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'menuitems', 'menuitems_id', 'quantity', 'unit_price', 'price']
 
 
+class CartChangeSerializer(serializers.Serializer):
+    menuitems_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, max_value=32767, default=1)
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'], default='add')
+
+    def validate(self, data):
+        if data['op'] == 'add' and data['quantity'] < 1:
+            raise serializers.ValidationError({"quantity": "Quantity must be at least 1"})
+        return data
+
+
+class CartBatchSerializer(serializers.Serializer):
+    items = CartChangeSerializer(many=True)
+    replace = serializers.BooleanField(default=False)
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     menuitem =  serializers.SlugRelatedField(slug_field='title', queryset=MenuItem.objects.all(), read_only=False)
 
@@ -58,4 +74,23 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ['id', 'user', 'delivery_crew', 'status', 'total', 'date', 'orderitem_set']
\ No newline at end of file
+        fields = ['id', 'user', 'delivery_crew', 'status', 'total', 'date', 'orderitem_set']
+
+
+class DailySalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailySales
+        fields = ['date', 'orders', 'delivered', 'revenue']
+
+
+class SalesTotalsSerializer(serializers.Serializer):
+    orders = serializers.IntegerField()
+    delivered = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class ItemSalesReportSerializer(serializers.Serializer):
+    menuitem = serializers.IntegerField(source='menuitem_id')
+    title = serializers.CharField(source='menuitem__title')
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
@@ -0,0 +1,204 @@
+from decimal import Decimal
+from django.db import transaction, IntegrityError
+from django.db.models import F, OuterRef, Subquery, Sum
+from .models import Cart, MenuItem, Order, OrderItem
+from . import rollups, tasks
+
+
+# Limits of Cart.quantity (SmallIntegerField) and Cart.price
+MAX_QUANTITY = 32767
+_PRICE = Cart._meta.get_field('price')
+MAX_LINE_PRICE = Decimal(10) ** (_PRICE.max_digits - _PRICE.decimal_places) - Decimal(1).scaleb(-_PRICE.decimal_places)
+
+
+class EmptyCartError(Exception):
+    pass
+
+
+class CartChangeError(Exception):
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def checkout(user):
+    """
+    Turn the user's cart into an order.
+
+    Everything runs in one transaction with a constant number of queries:
+    lock the cart rows, insert the order, bulk insert its items, compute the
+    total with a DB-side aggregate, clear the cart, update the sales rollups
+    and queue the follow-up jobs.
+    """
+    with transaction.atomic():
+        # Lock the user's cart rows so a concurrent cart change or a second
+        # checkout cannot slip in between reading and clearing the cart.
+        cart_items = list(
+            Cart.objects.select_for_update()
+            .filter(user=user)
+            .values_list('id', 'menuitems_id', 'quantity', 'unit_price', 'price'))
+        if not cart_items:
+            raise EmptyCartError
+
+        order = Order.objects.create(user=user, total=0)
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                menuitem_id=menuitem_id,
+                quantity=quantity,
+                unit_price=unit_price,
+                price=price,
+            )
+            for _, menuitem_id, quantity, unit_price, price in cart_items
+        ])
+
+        # Compute the total in the database in the same statement that stores it
+        order_total = (
+            OrderItem.objects.filter(order=OuterRef('pk'))
+            .values('order')
+            .annotate(total=Sum('price'))
+            .values('total'))
+        Order.objects.filter(pk=order.pk).update(total=Subquery(order_total))
+
+        Cart.objects.filter(id__in=[cart_id for cart_id, *_ in cart_items]).delete()
+
+        rollups.record_order(order, [
+            (menuitem_id, quantity, price) for _, menuitem_id, quantity, _, price in cart_items
+        ])
+        # Follow-up work (the receipt) runs in the background, after commit
+        tasks.order_placed(order)
+
+    order.refresh_from_db(fields=['total'])
+    return order
+
+
+def cart_line_error(quantity, unit_price):
+    """Why a cart line of ``quantity`` at ``unit_price`` can't be stored, or None."""
+    if quantity > MAX_QUANTITY:
+        return f"Ensure the quantity in the cart is at most {MAX_QUANTITY}."
+    if unit_price * quantity > MAX_LINE_PRICE:
+        return f"Ensure the cart line costs at most {MAX_LINE_PRICE}."
+    return None
+
+
+def _increment_cart_line(user, menuitem, quantity):
+    # One UPDATE; SET expressions see the old quantity, so price stays consistent.
+    # Lines that would go past the field limits are left alone.
+    return (
+        Cart.objects.filter(user=user, menuitems=menuitem, quantity__lte=MAX_QUANTITY - quantity)
+        .alias(new_price=(F('quantity') + quantity) * F('unit_price'))
+        .filter(new_price__lte=MAX_LINE_PRICE)
+        .update(quantity=F('quantity') + quantity, price=(F('quantity') + quantity) * F('unit_price'))
+    )
+
+
+def add_to_cart(user, menuitem, quantity=1):
+    """
+    Add ``quantity`` of ``menuitem`` to the user's cart.
+
+    An existing line is incremented in place with a single ``F()`` update;
+    otherwise a new line is inserted. If a concurrent request inserts the
+    same line first, the unique constraint on (user, menuitems) catches it
+    and we fall back to incrementing. Returns ``(line, created)``. Raises
+    ``CartChangeError`` if the line would go past the quantity or price limits.
+    """
+    error = cart_line_error(quantity, menuitem.price)
+    if error:
+        raise CartChangeError({"quantity": [error]})
+    created = False
+    if not _increment_cart_line(user, menuitem, quantity):
+        try:
+            with transaction.atomic():
+                line = Cart.objects.create(
+                    user=user,
+                    menuitems=menuitem,
+                    quantity=quantity,
+                    unit_price=menuitem.price,
+                    price=menuitem.price * quantity,
+                )
+                created = True
+        except IntegrityError:
+            # The line exists (maybe just inserted concurrently): too full, or increment it now
+            if not _increment_cart_line(user, menuitem, quantity):
+                line = Cart.objects.get(user=user, menuitems=menuitem)
+                raise CartChangeError({"quantity": [cart_line_error(line.quantity + quantity, line.unit_price)]})
+    if not created:
+        line = Cart.objects.select_related('menuitems').get(user=user, menuitems=menuitem)
+    return line, created
+
+
+def apply_cart_changes(user, changes, replace=False):
+    """
+    Apply many cart changes in one transaction.
+
+    ``changes`` is a list of dicts with ``menuitems_id``, ``quantity`` and
+    ``op``: ``add`` increments a line, ``set`` sets its quantity (0 removes
+    it) and ``remove`` deletes it. With ``replace`` every line not mentioned
+    is removed, so a client can sync its whole cart in one call.
+
+    Costs a constant number of queries: menu prices, locked cart lines, then
+    at most one delete, one bulk insert and one bulk update. Raises
+    ``CartChangeError`` with per-change errors for unknown menu items and
+    for lines that would go past the quantity or price limits.
+    """
+    menuitem_ids = {change['menuitems_id'] for change in changes}
+    prices = dict(MenuItem.objects.filter(id__in=menuitem_ids).values_list('id', 'price'))
+    errors = [
+        {"menuitems_id": [f"Menu item {change['menuitems_id']} does not exist."]}
+        if change['menuitems_id'] not in prices else {}
+        for change in changes
+    ]
+    if any(errors):
+        raise CartChangeError(errors)
+
+    with transaction.atomic():
+        lines = {line.menuitems_id: line for line in Cart.objects.select_for_update().filter(user=user)}
+        quantities = {menuitem_id: line.quantity for menuitem_id, line in lines.items()}
+        if replace:
+            quantities = {menuitem_id: 0 for menuitem_id in quantities}
+        for change in changes:
+            menuitem_id = change['menuitems_id']
+            if change['op'] == 'add':
+                quantities[menuitem_id] = quantities.get(menuitem_id, 0) + change['quantity']
+            elif change['op'] == 'set':
+                quantities[menuitem_id] = change['quantity']
+            else:
+                quantities[menuitem_id] = 0
+
+        # Reported on the last change to each line
+        last_change = {change['menuitems_id']: index for index, change in enumerate(changes)}
+        for menuitem_id, index in last_change.items():
+            line = lines.get(menuitem_id)
+            error = cart_line_error(quantities[menuitem_id], line.unit_price if line else prices[menuitem_id])
+            if error:
+                errors[index] = {"quantity": [error]}
+        if any(errors):
+            raise CartChangeError(errors)
+
+        removed, added, updated = [], [], []
+        for menuitem_id, quantity in quantities.items():
+            line = lines.get(menuitem_id)
+            if line is None:
+                if quantity > 0:
+                    added.append(Cart(
+                        user=user,
+                        menuitems_id=menuitem_id,
+                        quantity=quantity,
+                        unit_price=prices[menuitem_id],
+                        price=prices[menuitem_id] * quantity,
+                    ))
+            elif quantity <= 0:
+                removed.append(line.pk)
+            elif quantity != line.quantity:
+                line.quantity = quantity
+                line.price = line.unit_price * quantity
+                updated.append(line)
+
+        if removed:
+            Cart.objects.filter(id__in=removed).delete()
+        if added:
+            Cart.objects.bulk_create(added)
+        if updated:
+            Cart.objects.bulk_update(updated, ['quantity', 'price'])
+
+    return Cart.objects.select_related('menuitems').filter(user=user).order_by('id')
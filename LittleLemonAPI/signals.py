@@ -0,0 +1,86 @@
+from django.contrib.auth.models import Group, User
+from rest_framework.authtoken.models import Token
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+from .authentication import token_cache
+from .catalogue import bump_version_on_commit
+from .models import Category, MenuItem
+from .roles import invalidate_roles
+from . import search
+
+
+def _invalidate_tokens(invalidate, *args):
+    # Again after commit: a request may have loaded and cached the old rows
+    # between the change and its commit
+    invalidate(*args)
+    transaction.on_commit(lambda: invalidate(*args))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def group_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    tokens = token_cache()
+    if not reverse:
+        invalidate_roles(instance)
+        if tokens is not None:
+            _invalidate_tokens(tokens.invalidate_user, instance.pk)
+    elif pk_set:
+        for user_id in pk_set:
+            invalidate_roles(user_id=user_id)
+            if tokens is not None:
+                _invalidate_tokens(tokens.invalidate_user, user_id)
+    else:
+        # group.user_set.clear(): we don't know who was affected
+        invalidate_roles()
+        if tokens is not None:
+            _invalidate_tokens(tokens.clear)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, created=False, **kwargs):
+    # Roles are group names: a rename or deletion changes them for every
+    # member, and deleting a group removes its memberships without m2m_changed
+    if created:
+        return
+    invalidate_roles()
+    tokens = token_cache()
+    if tokens is not None:
+        _invalidate_tokens(tokens.clear)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Covers deactivation, superuser changes and deletion
+    tokens = token_cache()
+    if tokens is not None:
+        _invalidate_tokens(tokens.invalidate_user, instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    # djoser's token/logout deletes the user's token
+    tokens = token_cache()
+    if tokens is not None:
+        _invalidate_tokens(tokens.invalidate_key, instance.key)
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def menu_changed(sender, **kwargs):
+    bump_version_on_commit()
+
+
+@receiver(post_save, sender=MenuItem)
+def menu_item_saved(sender, instance, using, **kwargs):
+    search.index_items([instance], using=using)
+
+
+@receiver(post_delete, sender=MenuItem)
+def menu_item_deleted(sender, instance, using, **kwargs):
+    search.remove_items([instance.pk], using=using)
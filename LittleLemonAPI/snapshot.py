@@ -0,0 +1,203 @@
+"""
+In-process snapshot of the menu, for filtering without SQL.
+
+The menu is small and read-mostly, so each process keeps every menu item as
+a ``MENU_ITEM`` row, ordered by id, and answers ``menu_items`` GET from it:
+
+* ``?category=`` looks up the positions of the category's items,
+* ``?price=`` bisects an array of prices (in cents), sorted per category
+  and overall,
+* ``?search=`` uses a trigram index over the titles (``search.InvertedIndex``)
+  with the same substring semantics and ranking as the SQL backends.
+
+Page numbers and cursors work as with SQL, with the same cursors.
+
+A snapshot belongs to one catalogue version. Menu and category writes bump
+the version on commit (``signals.py``; bulk writes do it themselves). Menu
+reads check the version in the cache all workers share (``CACHES``: Redis or
+the database, never per-process memory) at most every
+``LITTLELEMON_MENU_LOCAL_CACHE['VERSION_CHECK']`` seconds
+(``catalogue.get_version``), so a write made through any worker reloads the
+snapshot in all of them within that interval, and reads in between make no
+query at all. Loading builds the new snapshot on the side and swaps it in
+with one assignment, so readers never see a half-built one. Menus with more than
+``LITTLELEMON_MENU_SNAPSHOT['MAX_ITEMS']`` items are left to SQL.
+"""
+import threading
+from array import array
+from bisect import bisect_right
+from decimal import ROUND_FLOOR
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator, EmptyPage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from .models import MenuItem
+from .pagination import keyset_list, cursor_response_data
+from .representations import MENU_ITEM
+from .routers import use_replica
+from .search import InvertedIndex, TRIGRAM
+from . import catalogue
+
+TITLE, PRICE, CATEGORY_TITLE = (MENU_ITEM.lookups.index(name) for name in ('title', 'price', 'category__title'))
+PRICE_FIELD = MenuItem._meta.get_field('price')
+
+
+def _cents(price):
+    return int((price * 100).to_integral_value(rounding=ROUND_FLOOR))
+
+
+class PriceIndex:
+    """Row positions in id order, and sorted by price for ``price <= limit`` by bisection."""
+
+    def __init__(self, rows, positions):
+        self.positions = array('i', positions)
+        by_price = sorted(positions, key=lambda position: (rows[position][PRICE], position))
+        self.by_price = array('i', by_price)
+        self.cents = array('q', (_cents(rows[position][PRICE]) for position in by_price))
+
+    def at_most(self, limit):
+        return sorted(self.by_price[:bisect_right(self.cents, _cents(limit))])
+
+
+class MenuSnapshot:
+    def __init__(self, rows):
+        self.rows = rows
+        by_category = {}
+        for position, row in enumerate(rows):
+            by_category.setdefault(row[CATEGORY_TITLE], []).append(position)
+        self.all = PriceIndex(rows, range(len(rows)))
+        self.categories = {title: PriceIndex(rows, positions) for title, positions in by_category.items()}
+        self.titles = InvertedIndex((position, row[TITLE]) for position, row in enumerate(rows))
+
+    def search(self, query):
+        """Positions of the titles containing ``query``, best matches first."""
+        if len(query) >= TRIGRAM:
+            return self.titles.search(query)
+        query = query.lower()
+        matches = []
+        for position, title in self.titles.titles.items():
+            index = title.find(query)
+            if index >= 0:
+                matches.append((index, len(title), position))
+        matches.sort()
+        return [position for _, _, position in matches]
+
+    def filter(self, query_params, ranked=True):
+        """
+        The rows ``views.menu_queryset`` would return, by id or, for a search
+        with ``ranked``, best matches first. Raises ``ValidationError`` for a
+        ``?price=`` that isn't a number.
+        """
+        category = query_params.get('category')
+        to_price = query_params.get('price')
+        search = query_params.get('search')
+
+        index = self.all
+        if category:
+            index = self.categories.get(category)
+            if index is None:
+                return []
+        positions = index.at_most(PRICE_FIELD.to_python(to_price)) if to_price else index.positions
+        if search:
+            matches = self.search(search)
+            if len(positions) < len(self.rows):
+                wanted = set(positions)
+                matches = [position for position in matches if position in wanted]
+            positions = matches if ranked else sorted(matches)
+        rows = self.rows
+        return [rows[position] for position in positions]
+
+    def menu_page(self, query_params):
+        """Same as ``views.menu_page``."""
+        perpage = query_params.get('perpage', default=10)
+
+        if 'cursor' in query_params:
+            rows, next_cursor, previous_cursor = keyset_list(
+                self.filter(query_params, ranked=False), ('id',), query_params['cursor'], perpage,
+                MENU_ITEM.key(('id',)), MenuItem)
+            return cursor_response_data(MENU_ITEM.many(rows), next_cursor, previous_cursor)
+
+        paginator = Paginator(self.filter(query_params), per_page=perpage)
+        try:
+            rows = paginator.page(number=query_params.get('page', default=1))
+        except EmptyPage:
+            rows = []
+        return MENU_ITEM.many(rows)
+
+
+_snapshot = (None, None)
+_lock = threading.Lock()
+
+
+def _max_items():
+    options = getattr(settings, 'LITTLELEMON_MENU_SNAPSHOT', None)
+    return options.get('MAX_ITEMS', 10_000) if options else None
+
+
+def _queryset(max_items):
+    # One past the limit tells us the menu is too big
+    return MENU_ITEM.values(MenuItem.objects.order_by('id'))[:max_items + 1]
+
+
+def _build(rows, max_items):
+    return MenuSnapshot(rows) if len(rows) <= max_items else None
+
+
+def get_snapshot():
+    """The snapshot for the current catalogue version, or None if disabled or the menu is too big."""
+    global _snapshot
+    max_items = _max_items()
+    if max_items is None:
+        return None
+    version = catalogue.get_version()
+    snapshot_version, snapshot = _snapshot
+    if snapshot_version != version:
+        with _lock:
+            snapshot_version, snapshot = _snapshot
+            if snapshot_version != version:
+                # From the primary: it is kept for the whole version
+                with use_replica(False):
+                    snapshot = _build(list(_queryset(max_items)), max_items)
+                _snapshot = (version, snapshot)
+    return snapshot
+
+
+async def aget_snapshot():
+    global _snapshot
+    max_items = _max_items()
+    if max_items is None:
+        return None
+    version = await catalogue.aget_version()
+    snapshot_version, snapshot = _snapshot
+    if snapshot_version != version:
+        with use_replica(False):
+            snapshot = _build([row async for row in _queryset(max_items)], max_items)
+        _snapshot = (version, snapshot)
+    return snapshot
+
+
+@receiver(setting_changed)
+def _reset_snapshot(setting, **kwargs):
+    global _snapshot
+    if setting == 'LITTLELEMON_MENU_SNAPSHOT':
+        _snapshot = (None, None)
+
+
+def _page(snapshot, query_params):
+    if snapshot is None:
+        return None
+    try:
+        return snapshot.menu_page(query_params)
+    except ValidationError:
+        # An invalid ?price= fails exactly as it does with SQL
+        return None
+
+
+def menu_page(query_params):
+    """``views.menu_page`` data from the snapshot, or None to use SQL."""
+    return _page(get_snapshot(), query_params)
+
+
+async def amenu_page(query_params):
+    return _page(await aget_snapshot(), query_params)
@@ -0,0 +1,42 @@
+"""
+Background tasks, run by ``runworker`` (see ``jobs.py``).
+"""
+from django.conf import settings
+from django.core.mail import send_mail
+from .models import Order, OrderItem
+from . import dispatch, jobs
+
+
+@jobs.task
+def send_receipt(order_id):
+    order = Order.objects.select_related('user').filter(pk=order_id).first()
+    if order is None or not order.user.email:
+        return
+    lines = [
+        f"{quantity} x {title}: ${price}"
+        for title, quantity, price in OrderItem.objects.filter(order=order).order_by('id')
+        .values_list('menuitem__title', 'quantity', 'price')
+    ]
+    send_mail(
+        f"Little Lemon order #{order.pk}",
+        '\n'.join([f"Thanks for your order, {order.user.username}!", '', *lines, '', f"Total: ${order.total}"]),
+        None,
+        [order.user.email],
+    )
+
+
+@jobs.task
+def assign_delivery():
+    # New orders get a crew member now rather than on the next dispatch_orders poll
+    dispatch.dispatch()
+
+
+def order_placed(order):
+    """Queue the follow-up work for a new order, in the checkout transaction."""
+    calls = []
+    if order.user.email:
+        calls.append(('send_receipt', {'order_id': order.pk}))
+    if getattr(settings, 'LITTLELEMON_DISPATCH_ON_CHECKOUT', False):
+        calls.append(('assign_delivery', {}))
+    if calls:
+        jobs.enqueue_many(calls)
@@ -1,3 +1,1714 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock, skipUnless
+from asgiref.sync import sync_to_async
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import Count
+from django.contrib.auth.models import User, Group
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import connection, connections
+from django.db.utils import load_backend
+from django.core.management import call_command
+from django.http import QueryDict
+from django.test import override_settings, AsyncRequestFactory, SimpleTestCase
+from rest_framework.authtoken.models import Token
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from .models import Category, MenuItem, Cart, Order, OrderItem, ArchivedOrder, ArchivedOrderItem, DailySales, ItemSales, Job
+from .serializers import MenuItemSerializer, CartSerializer, OrderSerializer
+from . import archive, authentication, catalogue, exports, async_views, dispatch, events, idempotency, instrumentation, jobs, renderers, representations, routers, snapshot, throttling, views
+from .pagination import keyset_query, encode_cursor
+from .parsers import FastJSONParser
+from .renderers import FastJSONRenderer
+from .services import checkout, EmptyCartError
+from . import search
+from .authentication import CachedTokenAuthentication, TokenCache, token_cache
+from .roles import get_roles, invalidate_roles, is_manager, MANAGER
+from LittleLemon import databases as database_profiles
 
-# Create your tests here.
+
+# A per-process cache, not shared between workers
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def bump_version_on_another_worker():
+    # Another worker process has its own cache connection and version check
+    with mock.patch.object(catalogue, 'cache', caches.create_connection('default')), \
+            mock.patch.object(catalogue, '_version', None):
+        catalogue.bump_version()
+
+
+def after_version_check():
+    seconds = settings.LITTLELEMON_MENU_LOCAL_CACHE['VERSION_CHECK']
+    return mock.patch('time.monotonic', return_value=time.monotonic() + seconds)
+
+
+class LittleLemonTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager_group = Group.objects.create(name='Manager')
+        cls.crew_group = Group.objects.create(name='Delivery Crew')
+        cls.category = Category.objects.create(title='Desserts', slug='desserts')
+        cls.menu = MenuItem.objects.bulk_create([
+            MenuItem(title=f'Cake {i}', price=Decimal('4.50') + i, featured=False, category=cls.category)
+            for i in range(5)
+        ])
+        cls.customer = User.objects.create_user('customer')
+        cls.manager = User.objects.create_user('manager')
+        cls.manager.groups.add(cls.manager_group)
+        cls.crew = User.objects.create_user('crew')
+        cls.crew.groups.add(cls.crew_group)
+
+    def setUp(self):
+        self.clear_caches()
+
+    def clear_caches(self):
+        # The role LRU is process-wide and user ids are reused between tests
+        invalidate_roles()
+        token_cache().clear()
+        cache.clear()
+        catalogue.clear_local()
+
+    def fill_cart(self, user, items, quantity=2):
+        Cart.objects.bulk_create([
+            Cart(user=user, menuitems=item, quantity=quantity, unit_price=item.price, price=quantity * item.price)
+            for item in items
+        ])
+
+
+class CheckoutTests(LittleLemonTestCase):
+    def test_checkout_moves_cart_into_order(self):
+        self.fill_cart(self.customer, self.menu[:3])
+        order = checkout(self.customer)
+
+        self.assertEqual(order.total, sum(2 * item.price for item in self.menu[:3]))
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        self.assertFalse(Cart.objects.filter(user=self.customer).exists())
+
+    def test_checkout_empty_cart(self):
+        with self.assertRaises(EmptyCartError):
+            checkout(self.customer)
+        self.assertFalse(Order.objects.exists())
+
+    def test_checkout_query_count_does_not_grow_with_cart(self):
+        category = Category.objects.create(title='Bulk', slug='bulk')
+        menu = MenuItem.objects.bulk_create([
+            MenuItem(title=f'Bulk {i}', price=Decimal('1.00'), featured=False, category=category)
+            for i in range(150)
+        ])
+        query_counts = []
+        for size in (1, 150):
+            self.fill_cart(self.customer, menu[:size])
+            with CaptureQueriesContext(connection) as ctx:
+                checkout(self.customer)
+            query_counts.append(len(ctx.captured_queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_orders_post(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/api/orders')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.fill_cart(self.customer, self.menu[:2])
+        response = self.client.post('/api/orders')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.get(user=self.customer).orderitem_set.count(), 2)
+
+
+class CartTests(LittleLemonTestCase):
+    def test_adding_existing_item_increments_quantity(self):
+        self.client.force_authenticate(self.customer)
+        item = self.menu[0]
+        response = self.client.post('/api/cart/menu-items', {'menuitems_id': item.id, 'quantity': 2})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # 3 for the cart and 6 to update the throttle bucket in the database cache
+        with self.assertNumQueries(9):
+            response = self.client.post('/api/cart/menu-items', {'menuitems_id': item.id, 'quantity': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['quantity'], 5)
+        self.assertEqual(Decimal(response.data['price']), item.price * 5)
+        self.assertEqual(Cart.objects.filter(user=self.customer).count(), 1)
+
+    def test_batch_changes(self):
+        self.fill_cart(self.customer, self.menu[:3])
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/api/cart/menu-items/batch', {'items': [
+            {'menuitems_id': self.menu[0].id, 'quantity': 1},
+            {'menuitems_id': self.menu[1].id, 'quantity': 5, 'op': 'set'},
+            {'menuitems_id': self.menu[2].id, 'op': 'remove'},
+            {'menuitems_id': self.menu[3].id, 'quantity': 4},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        cart = dict(Cart.objects.filter(user=self.customer).values_list('menuitems_id', 'quantity'))
+        self.assertEqual(cart, {self.menu[0].id: 3, self.menu[1].id: 5, self.menu[3].id: 4})
+        line = Cart.objects.get(user=self.customer, menuitems=self.menu[1])
+        self.assertEqual(line.price, self.menu[1].price * 5)
+
+    def test_batch_replace(self):
+        self.fill_cart(self.customer, self.menu[:3])
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/api/cart/menu-items/batch', {
+            'items': [{'menuitems_id': self.menu[4].id, 'quantity': 1}],
+            'replace': True,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([line['menuitems']['id'] for line in response.data], [self.menu[4].id])
+
+    def test_batch_unknown_item_changes_nothing(self):
+        self.fill_cart(self.customer, self.menu[:1])
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/api/cart/menu-items/batch', {'items': [
+            {'menuitems_id': self.menu[0].id, 'op': 'remove'},
+            {'menuitems_id': 999999},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['items'][0], {})
+        self.assertIn('menuitems_id', response.data['items'][1])
+        self.assertTrue(Cart.objects.filter(user=self.customer).exists())
+
+    def test_quantity_and_price_limits(self):
+        self.client.force_authenticate(self.customer)
+        mint = MenuItem.objects.create(title='Mint', price=Decimal('0.10'), featured=False, category=self.category)
+        post = lambda item, quantity: self.client.post('/api/cart/menu-items', {'menuitems_id': item.id, 'quantity': quantity})
+        self.assertEqual(post(mint, 40000).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(post(mint, 'many').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(post(mint, 30000).status_code, status.HTTP_201_CREATED)
+        response = post(mint, 3000)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('32767', response.data['quantity'][0])
+
+        # Cake 0 costs 4.50: 2222 of them fit in 9999.99, 2223 don't
+        self.assertEqual(post(self.menu[0], 2223).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(post(self.menu[0], 2000).status_code, status.HTTP_201_CREATED)
+        response = post(self.menu[0], 223)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('9999.99', response.data['quantity'][0])
+        self.assertEqual(post(self.menu[0], 222).status_code, status.HTTP_200_OK)
+        cart = dict(Cart.objects.filter(user=self.customer).values_list('menuitems_id', 'quantity'))
+        self.assertEqual(cart, {mint.id: 30000, self.menu[0].id: 2222})
+
+        response = self.client.post('/api/cart/menu-items/batch', {'items': [
+            {'menuitems_id': mint.id, 'quantity': 2000},
+            {'menuitems_id': mint.id, 'quantity': 2000},
+            {'menuitems_id': self.menu[1].id, 'quantity': 2000, 'op': 'set'},
+            {'menuitems_id': self.menu[2].id, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([set(errors) for errors in response.data['items']], [set(), {'quantity'}, {'quantity'}, set()])
+        self.assertEqual(Cart.objects.get(user=self.customer, menuitems=mint).quantity, 30000)
+        self.assertFalse(Cart.objects.filter(menuitems__in=self.menu[1:3]).exists())
+
+    def test_batch_query_count_does_not_grow(self):
+        self.client.force_authenticate(self.customer)
+        for items in (self.menu[:1], self.menu):
+            Cart.objects.filter(user=self.customer).delete()
+            self.fill_cart(self.customer, items[:1])
+            changes = [{'menuitems_id': item.id, 'quantity': 2} for item in items]
+            # 7 for the batch and 6 for the throttle bucket, however many items
+            with self.assertNumQueries(13):
+                self.client.post('/api/cart/menu-items/batch', {'items': changes}, format='json')
+
+
+class RoleTests(LittleLemonTestCase):
+    def test_roles_are_loaded_once_per_request_user(self):
+        user = User.objects.get(pk=self.manager.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_roles(user), {MANAGER})
+            self.assertTrue(is_manager(user))
+            self.assertTrue(is_manager(user))
+
+    def test_lru_shared_between_instances(self):
+        get_roles(User.objects.get(pk=self.crew.pk))
+        other = User.objects.get(pk=self.crew.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(is_manager(other))
+
+    def test_membership_change_invalidates_cache(self):
+        self.assertFalse(is_manager(User.objects.get(pk=self.customer.pk)))
+        self.client.force_authenticate(self.manager)
+        response = self.client.post('/api/groups/manager/users', {'id': self.customer.pk})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(is_manager(User.objects.get(pk=self.customer.pk)))
+
+        response = self.client.delete(f'/api/groups/manager/users/{self.customer.pk}')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(is_manager(User.objects.get(pk=self.customer.pk)))
+
+    def test_group_rename_and_delete_invalidate_cache(self):
+        self.assertTrue(is_manager(User.objects.get(pk=self.manager.pk)))
+        self.manager_group.name = 'Former managers'
+        self.manager_group.save()
+        self.assertFalse(is_manager(User.objects.get(pk=self.manager.pk)))
+
+        self.assertEqual(get_roles(User.objects.get(pk=self.crew.pk)), {'Delivery Crew'})
+        self.crew_group.delete()
+        self.assertEqual(get_roles(User.objects.get(pk=self.crew.pk)), frozenset())
+
+    def test_single_order_resolves_roles_once(self):
+        order = Order.objects.create(user=self.customer, delivery_crew=self.crew)
+        self.client.force_authenticate(User.objects.get(pk=self.crew.pk))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/api/orders/{order.pk}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        group_queries = [q for q in ctx.captured_queries if 'auth_group' in q['sql']]
+        self.assertEqual(len(group_queries), 1)
+
+
+class MenuCatalogueTests(LittleLemonTestCase):
+    def test_repeat_reads_hit_the_cache(self):
+        response = self.client.get('/api/menu-items', {'perpage': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.json()], [self.menu[0].pk, self.menu[1].pk])
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/menu-items', {'perpage': 2})
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_conditional_requests(self):
+        response = self.client.get('/api/menu-items')
+        not_modified = self.client.get('/api/menu-items', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        # Versions change within a second, so only the ETag validates
+        self.assertNotIn('Last-Modified', response)
+        modified = self.client.get('/api/menu-items', HTTP_IF_MODIFIED_SINCE='Sun, 18 Oct 2099 00:00:00 GMT')
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+
+    def test_version_is_shared_between_workers(self):
+        self.assertNotIsInstance(caches['default'], LocMemCache)
+        etag = self.client.get('/api/menu-items')['ETag']
+        bump_version_on_another_worker()
+        # This worker only sees it on its next version check
+        response = self.client.get('/api/menu-items', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        with after_version_check():
+            response = self.client.get('/api/menu-items', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_writes_bump_the_version(self):
+        etag = self.client.get('/api/menu-items')['ETag']
+        self.client.force_authenticate(self.manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(f'/api/menu-items/{self.menu[0].pk}', {
+                'title': 'Renamed', 'price': '1.00', 'featured': True, 'category_id': self.category.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(None)
+        response = self.client.get('/api/menu-items', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()[0]['title'], 'Renamed')
+
+
+class CursorPaginationTests(LittleLemonTestCase):
+    def walk(self, url, params):
+        pages, cursor = [], ''
+        while cursor is not None:
+            data = self.client.get(url, {**params, 'cursor': cursor}).json()
+            pages.append([row['id'] for row in data['results']])
+            cursor = data['next']
+        return pages, data
+
+    def test_menu_items_cursor(self):
+        pages, last = self.walk('/api/menu-items', {'perpage': 2})
+        self.assertEqual(pages, [[m.pk for m in self.menu[i:i + 2]] for i in (0, 2, 4)])
+
+        previous = self.client.get('/api/menu-items', {'perpage': 2, 'cursor': last['previous']}).json()
+        self.assertEqual([row['id'] for row in previous['results']], pages[1])
+        self.assertIsNotNone(previous['previous'])
+        self.assertIsNotNone(previous['next'])
+
+    def test_orders_cursor_is_stable_and_skips_count(self):
+        orders = Order.objects.bulk_create([Order(user=self.customer) for _ in range(5)])
+        self.client.force_authenticate(self.manager)
+        pages, _ = self.walk('/api/orders', {'perpage': 2})
+        self.assertEqual(sum(pages, []), [o.pk for o in orders])
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/orders', {'perpage': 2, 'cursor': ''})
+        self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/menu-items', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(LITTLELEMON_MENU_SNAPSHOT=None)
+class MenuSearchTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pancakes = MenuItem.objects.create(title='Pancakes', price=Decimal('3.00'), featured=True, category=self.category)
+        self.chocolate = MenuItem.objects.create(title='Chocolate Cake', price=Decimal('6.00'), featured=True, category=self.category)
+        # The fixtures were bulk created, which bypasses the signals
+        search.rebuild_index()
+
+    def search_ids(self, query):
+        response = self.client.get('/api/menu-items', {'search': query, 'perpage': 100})
+        return [item['id'] for item in response.json()]
+
+    def test_backends_match_icontains(self):
+        for backend in ('like', 'fts', 'memory'):
+            with self.subTest(backend=backend), override_settings(LITTLELEMON_MENU_SEARCH=backend):
+                cache.clear()
+                expected = set(MenuItem.objects.filter(title__icontains='cake').values_list('id', flat=True))
+                self.assertEqual(set(self.search_ids('CAKE')), expected)
+                self.assertEqual(self.search_ids('cake 3'), [self.menu[3].pk])
+                self.assertEqual(self.search_ids('zzz'), [])
+                self.assertEqual(set(self.search_ids('ch')), {self.chocolate.pk})
+
+    @override_settings(LITTLELEMON_MENU_SEARCH='fts')
+    def test_fts_index_follows_writes(self):
+        self.chocolate.title = 'Lemon Tart'
+        self.chocolate.save()
+        self.pancakes.delete()
+        self.assertEqual(self.search_ids('lemon'), [self.chocolate.pk])
+        self.assertEqual(self.search_ids('pancake'), [])
+
+    @override_settings(LITTLELEMON_MENU_SEARCH='memory')
+    def test_memory_ranks_prefix_matches_first(self):
+        self.assertEqual(self.search_ids('cake')[0], self.menu[0].pk)
+        self.assertEqual(self.search_ids('choc'), [self.chocolate.pk])
+
+
+class MenuSnapshotTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        drinks = Category.objects.create(title='Drinks', slug='drinks')
+        for i, title in enumerate(('Lemonade', 'Iced Lemon Tea', 'Cake Shake', 'Espresso')):
+            MenuItem.objects.create(title=title, price=Decimal('2.25') + i, featured=False, category=drinks)
+        search.rebuild_index()
+
+    def page(self, params):
+        return views.menu_page(QueryDict(params))
+
+    def test_matches_sql(self):
+        for params in ('', 'perpage=3&page=2', 'category=Drinks', 'category=Desserts&price=6.50', 'price=4.25',
+                       'price=0', 'category=Nope', 'search=cake', 'search=LEMON&price=3.25', 'search=ke',
+                       'search=cake&category=Drinks', 'search=zzz', 'cursor=&perpage=2&search=cake',
+                       'cursor=&perpage=3&price=5'):
+            with self.subTest(params=params):
+                cache.clear()
+                data = self.page(params)
+                with override_settings(LITTLELEMON_MENU_SNAPSHOT=None):
+                    expected = self.page(params)
+                if 'search' in params or 'cursor' in params:
+                    self.assertEqual(data, expected)
+                else:
+                    # Unordered in SQL
+                    self.assertCountEqual(data, expected)
+
+    def test_cursor_pages(self):
+        # Start the catalogue version first: only the snapshot load is counted
+        catalogue.get_version()
+        with self.assertNumQueries(1):
+            first = self.page('cursor=&perpage=4')
+        with self.assertNumQueries(0):
+            second = self.page(f'cursor={first["next"]}&perpage=4')
+            self.assertEqual(self.page(f'cursor={second["previous"]}&perpage=4'), first)
+        with override_settings(LITTLELEMON_MENU_SNAPSHOT=None):
+            self.assertEqual(views.menu_page(QueryDict(f'cursor={first["next"]}&perpage=4')), second)
+
+    def test_reloaded_after_writes(self):
+        self.page('')
+        with self.assertNumQueries(0):
+            self.page('category=Drinks&search=lemon&price=3')
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuItem.objects.create(title='Lemon Soda', price=Decimal('1.00'), featured=False, category=self.category)
+        titles = [item['title'] for item in self.page('search=lemon&price=3')]
+        self.assertEqual(titles, ['Lemonade', 'Lemon Soda'])
+
+    def test_reloaded_after_writes_on_another_worker(self):
+        titles = lambda params: [item['title'] for item in self.page(params)]
+        self.assertIn('Lemonade', titles('search=lemon'))
+        MenuItem.objects.filter(title='Lemonade').update(title='Orangeade')
+        self.assertIn('Lemonade', titles('search=lemon'))
+        # The writer is another process: only the shared version tells this one
+        bump_version_on_another_worker()
+        with after_version_check():
+            self.assertNotIn('Lemonade', titles('search=lemon'))
+        self.assertEqual(titles('search=orange'), ['Orangeade'])
+
+    def test_large_menus_use_sql(self):
+        with override_settings(LITTLELEMON_MENU_SNAPSHOT={'MAX_ITEMS': 5}):
+            self.assertIsNone(snapshot.get_snapshot())
+            self.assertEqual(len(self.page('perpage=100')), 9)
+            # Invalid prices fail as they always did
+            with self.assertRaises(ValidationError):
+                self.page('price=abc')
+
+
+class OrderExportTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        for items in (self.menu[:2], self.menu[2:3], self.menu[3:5]):
+            self.fill_cart(self.customer, items)
+            checkout(self.customer)
+        Order.objects.filter(pk=Order.objects.order_by('id').first().pk).update(status=True)
+        self.client.force_authenticate(self.manager)
+
+    def export(self, **params):
+        response = self.client.get('/api/orders/export', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_matches_order_serializer(self):
+        rows = [json.loads(line) for line in self.export().splitlines()]
+        expected = OrderSerializer(Order.objects.order_by('id'), many=True).data
+        self.assertEqual(rows, json.loads(json.dumps(expected)))
+
+    def test_csv_has_a_row_per_item(self):
+        rows = list(csv.DictReader(io.StringIO(self.export(format='csv'))))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['menuitem'], self.menu[0].title)
+
+    def test_filters(self):
+        self.assertEqual(len(self.export(status='pending').splitlines()), 2)
+        self.assertEqual(len(self.export(status='delivered').splitlines()), 1)
+        today = timezone.localdate()
+        self.assertEqual(len(self.export(start=today.isoformat(), end=today.isoformat()).splitlines()), 3)
+        self.assertEqual(self.export(start=(today + datetime.timedelta(days=1)).isoformat()), '')
+        response = self.client.get('/api/orders/export', {'start': '2024-13-45'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_queries_are_per_chunk(self):
+        with CaptureQueriesContext(connection) as ctx:
+            rows = list(exports.ndjson_rows(Order.objects.all(), chunk_size=2))
+        self.assertEqual(len(rows), 3)
+        # Two queries for each of the two chunks, and one to find the end
+        self.assertEqual(len(ctx.captured_queries), 5)
+
+    def test_managers_only(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.get('/api/orders/export')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(LITTLELEMON_THROTTLE={'STORE': 'cache', 'RATES': {'cart': {'customer': '3/min'}, 'checkout': {}}})
+class ThrottlingTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.customer)
+        self.clock = mock.Mock(return_value=1000.0)
+        patcher = mock.patch.object(throttling.TokenBucketThrottle, 'timer', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add(self):
+        return self.client.post('/api/cart/menu-items', {'menuitems_id': self.menu[0].id})
+
+    def test_token_bucket(self):
+        for store in ('cache', 'local'):
+            options = {'STORE': store, 'RATES': {'cart': {'customer': '3/min'}}}
+            with self.subTest(store=store), override_settings(LITTLELEMON_THROTTLE=options):
+                cache.clear()
+                self.clock.return_value = 1000.0
+                self.assertTrue(all(self.add().status_code < 400 for _ in range(3)))
+                response = self.add()
+                self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+                # One token every 20 seconds
+                self.assertEqual(response['Retry-After'], '20')
+                # Reads are never throttled
+                self.assertEqual(self.client.get('/api/cart/menu-items').status_code, status.HTTP_200_OK)
+
+                self.clock.return_value = 1010.0
+                self.assertEqual(self.add()['Retry-After'], '10')
+                self.clock.return_value = 1020.0
+                self.assertEqual(self.add().status_code, status.HTTP_200_OK)
+
+    def test_buckets_per_user_and_role(self):
+        for _ in range(3):
+            self.add()
+        self.assertEqual(self.add().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        other = User.objects.create_user('other')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.add().status_code, status.HTTP_201_CREATED)
+        # No rate for crew: unlimited
+        self.client.force_authenticate(self.crew)
+        self.assertEqual([self.add().status_code for _ in range(5)], [201, 200, 200, 200, 200])
+
+
+    @override_settings(LITTLELEMON_THROTTLE={'RATES': {'checkout': {'customer': '1/min'}}})
+    def test_replayed_retries_are_not_throttled(self):
+        self.fill_cart(self.customer, self.menu[:2])
+        first = self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        # Retried past the limit: still replayed
+        for _ in range(3):
+            retry = self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='checkout-1')
+            self.assertEqual((retry.status_code, retry['Idempotent-Replayed']), (status.HTTP_201_CREATED, 'true'))
+        # A new request is throttled, with or without a key
+        self.assertEqual(self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='checkout-2').status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.client.post('/api/orders').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+@override_settings(LITTLELEMON_LOAD_SHEDDING={'THRESHOLD': 0.1, 'RETRY_AFTER': 3})
+class LoadSheddingTests(LittleLemonTestCase):
+    def test_sheds_writes_while_slow(self):
+        self.client.force_authenticate(self.customer)
+        shedder = throttling.shedder()
+        for _ in range(20):
+            shedder.observe(1.0)
+        self.assertAlmostEqual(shedder.shed_probability(), 0.9, places=2)
+
+        with mock.patch.object(throttling.random, 'random', return_value=0.5):
+            response = self.client.post('/api/cart/menu-items', {'menuitems_id': self.menu[0].id})
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '3')
+            self.assertEqual(self.client.post('/api/orders').status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(self.client.get('/api/cart/menu-items').status_code, status.HTTP_200_OK)
+        self.assertFalse(Cart.objects.exists())
+
+        # The writes that are let through are fast and bring the average down
+        with mock.patch.object(throttling.random, 'random', return_value=0.95):
+            for _ in range(20):
+                self.client.post('/api/cart/menu-items', {'menuitems_id': self.menu[0].id})
+        self.assertEqual(shedder.shed_probability(), 0)
+        self.assertEqual(Cart.objects.get().quantity, 20)
+
+
+class IdempotencyTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.customer)
+
+    def checkout(self, key='checkout-1'):
+        return self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_checkout_is_replayed(self):
+        self.fill_cart(self.customer, self.menu[:2])
+        first = self.checkout()
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self.checkout()
+        # Only the database cache's own queries
+        self.assertEqual([q for q in ctx.captured_queries if 'littlelemon_cache' not in q['sql'] and 'SAVEPOINT' not in q['sql']], [])
+        self.assertEqual((retry.status_code, retry.content), (first.status_code, first.content))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+        # A new key is a new request
+        self.assertEqual(self.checkout('checkout-2').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_retry_on_another_worker_is_replayed(self):
+        self.fill_cart(self.customer, self.menu[:2])
+        first = self.checkout()
+        # Another worker process has its own cache connection to the same store
+        with mock.patch.object(idempotency, 'cache', caches.create_connection('default')):
+            retry = self.checkout()
+        self.assertEqual((retry.status_code, retry.content), (first.status_code, first.content))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_claim_outlives_slow_requests(self):
+        self.fill_cart(self.customer, self.menu[:1])
+        with mock.patch.object(idempotency.cache, 'add', wraps=idempotency.cache.add) as add:
+            self.checkout()
+        self.assertEqual(add.call_args.kwargs['timeout'], 300)
+
+    def test_keys_are_per_user_and_request(self):
+        add = lambda item: self.client.post('/api/cart/menu-items', {'menuitems_id': item.id}, HTTP_IDEMPOTENCY_KEY='add')
+        self.assertEqual(add(self.menu[0]).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(add(self.menu[0]).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Cart.objects.get().quantity, 1)
+        self.assertEqual(add(self.menu[1]).status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        self.client.force_authenticate(User.objects.create_user('other'))
+        self.assertEqual(add(self.menu[0]).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Cart.objects.count(), 2)
+
+    def test_duplicate_waits_for_first_request(self):
+        self.fill_cart(self.customer, self.menu[:1])
+        first = self.checkout()
+        cache_key = idempotency._cache_key(self.customer, 'checkout-1')
+        stored = cache.get(cache_key)
+
+        # The first request is still running, and finishes while the duplicate waits
+        cache.set(cache_key, idempotency.IN_PROGRESS)
+        with mock.patch.object(idempotency.time, 'sleep', side_effect=lambda seconds: cache.set(cache_key, stored)):
+            retry = self.checkout()
+        self.assertEqual((retry.status_code, retry.content), (first.status_code, first.content))
+
+        cache.set(cache_key, idempotency.IN_PROGRESS)
+        with override_settings(LITTLELEMON_IDEMPOTENCY={'WAIT': 0}):
+            self.assertEqual(self.checkout().status_code, status.HTTP_409_CONFLICT)
+
+    def test_errors_release_the_key(self):
+        self.fill_cart(self.customer, self.menu[:1])
+        with mock.patch.object(views, 'checkout', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.checkout()
+        self.assertEqual(self.checkout().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class MenuImportTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.manager)
+
+    def post(self, body, content_type='text/csv', **params):
+        query = '?' + '&'.join(f'{key}={value}' for key, value in params.items()) if params else ''
+        return self.client.post(f'/api/menu-items/import{query}', body, content_type=content_type)
+
+    def test_csv_import(self):
+        self.client.get('/api/menu-items')
+        body = ('title,price,featured,category\n'
+                'Cake 0,9.99,true,Desserts\n'
+                'Cake 1,5.50,false,Desserts\n'
+                'Lemon Soda,3,1,Drinks\n')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post(body)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data, {'created': 1, 'updated': 1, 'unchanged': 1, 'categories': 1, 'dry_run': False})
+
+        self.assertEqual(MenuItem.objects.get(title='Cake 0').price, Decimal('9.99'))
+        soda = MenuItem.objects.select_related('category').get(title='Lemon Soda')
+        self.assertEqual((soda.featured, soda.category.slug), (True, 'drinks'))
+        # Signals were skipped: the search index and menu cache are refreshed explicitly
+        titles = [item['title'] for item in self.client.get('/api/menu-items', {'search': 'soda'}).json()]
+        self.assertEqual(titles, ['Lemon Soda'])
+        self.assertEqual(len(self.client.get('/api/menu-items').json()), 6)
+
+    def test_invalid_rows_import_nothing(self):
+        body = ('title,price,featured,category\n'
+                'Tart,abc,false,Desserts\n'
+                'Pie,4.123,false,\n'
+                'Cake 9,4,false,Desserts\n'
+                'Cake 9,5,false,Desserts\n')
+        response = self.post(body)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error_count'], 3)
+        self.assertEqual([error['row'] for error in response.data['errors']], [1, 2, 4])
+        self.assertIn('price', response.data['errors'][0])
+        self.assertEqual(set(response.data['errors'][1]), {'row', 'price', 'category'})
+        self.assertFalse(MenuItem.objects.filter(title='Cake 9').exists())
+
+    def test_dry_run(self):
+        response = self.post('title,price,category\nTart,4,Pastries\n', dry_run='1')
+        self.assertEqual(response.data['created'], 1)
+        self.assertTrue(response.data['dry_run'])
+        self.assertFalse(Category.objects.filter(title='Pastries').exists())
+
+    def test_json_with_categories(self):
+        body = json.dumps({
+            'categories': [{'title': 'Mains', 'slug': 'main-courses'}],
+            'items': [{'title': 'Risotto', 'price': 12.5, 'featured': False, 'category': 'Mains'}],
+        })
+        response = self.post(body, content_type='application/json')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(MenuItem.objects.get(title='Risotto').category.slug, 'main-courses')
+
+    def test_malformed_json(self):
+        for body in ('5', '"menu"', '{"items": 3}', '{"categories": {"title": "Mains"}}'):
+            with self.subTest(body=body):
+                response = self.post(body, content_type='application/json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn('detail', response.data)
+
+        body = json.dumps({
+            'categories': ['Mains', {'slug': 'mains'}, {'title': 'Mains', 'slug': 'not a slug'}, {'title': 'Sides'}],
+            'items': [5, {'title': 'Risotto', 'price': 12.5, 'category': 'Mains'}],
+        })
+        response = self.post(body, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error_count'], 4)
+        self.assertEqual([error.get('category_row', error.get('row')) for error in response.data['errors']],
+                         [1, 2, 3, 1])
+        self.assertEqual(set(response.data['errors'][1]), {'category_row', 'title'})
+        self.assertEqual(set(response.data['errors'][2]), {'category_row', 'slug'})
+        self.assertIn('non_field_errors', response.data['errors'][3])
+        self.assertFalse(Category.objects.filter(title__in=['Mains', 'Sides']).exists())
+
+    def test_export_round_trip(self):
+        for format in ('csv', 'ndjson'):
+            with self.subTest(format=format):
+                response = self.client.get('/api/menu-items/export', {'format': format})
+                self.assertTrue(response.streaming)
+                body = b''.join(response.streaming_content).decode()
+                response = self.post(body, content_type=exports_content_type(format))
+                self.assertEqual(response.data['unchanged'], 5)
+                self.assertEqual(response.data['created'] + response.data['updated'], 0)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as menu:
+            menu.write('title,price,category\nCake 4,1.00,Desserts\n')
+        self.addCleanup(os.remove, menu.name)
+        out = io.StringIO()
+        call_command('import_menu', menu.name, stdout=out)
+        self.assertIn('updated 1', out.getvalue())
+        out = io.StringIO()
+        call_command('export_menu', '--format', 'ndjson', stdout=out)
+        self.assertEqual(json.loads(out.getvalue().splitlines()[4])['price'], '1.00')
+
+    def test_managers_only(self):
+        self.assertEqual(self.post('title\n', content_type='text/plain').status_code,
+                         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.post('title,price,category\nTart,4,Desserts\n').status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+
+def exports_content_type(format):
+    return {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}[format]
+
+
+class SalesRollupTests(LittleLemonTestCase):
+    def place_order(self, items, quantity=2):
+        self.fill_cart(self.customer, items, quantity)
+        return checkout(self.customer)
+
+    def snapshot(self):
+        return (
+            list(DailySales.objects.values_list('date', 'orders', 'delivered', 'revenue')),
+            sorted(ItemSales.objects.values_list('date', 'menuitem_id', 'quantity', 'revenue')),
+        )
+
+    def test_checkout_updates_rollups(self):
+        first = self.place_order(self.menu[:2])
+        second = self.place_order(self.menu[1:3], quantity=1)
+        daily = DailySales.objects.get()
+        self.assertEqual(daily.orders, 2)
+        self.assertEqual(daily.revenue, first.total + second.total)
+        self.assertEqual(ItemSales.objects.get(menuitem=self.menu[1]).quantity, 3)
+
+    def test_status_change_and_delete(self):
+        order = self.place_order(self.menu[:2])
+        self.client.force_authenticate(self.crew)
+        Order.objects.filter(pk=order.pk).update(delivery_crew=self.crew)
+        response = self.client.patch(f'/api/orders/{order.pk}', {'status': True})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(DailySales.objects.get().delivered, 1)
+
+        self.client.force_authenticate(self.manager)
+        response = self.client.patch(f'/api/orders/{order.pk}', {'status': False})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(DailySales.objects.get().delivered, 0)
+
+        response = self.client.delete(f'/api/orders/{order.pk}')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        daily = DailySales.objects.get()
+        self.assertEqual((daily.orders, daily.revenue), (0, 0))
+        self.assertFalse(ItemSales.objects.exclude(quantity=0).exists())
+
+    def test_concurrent_deliveries_counted_once(self):
+        order = self.place_order(self.menu[:2])
+        Order.objects.filter(pk=order.pk).update(delivery_crew=self.crew)
+        self.client.force_authenticate(self.crew)
+        is_delivery_crew = views.is_delivery_crew
+
+        def deliver_meanwhile(user):
+            # Another request delivers the order while this one is being handled
+            Order.objects.filter(pk=order.pk).update(status=True)
+            DailySales.objects.update(delivered=1)
+            return is_delivery_crew(user)
+
+        with mock.patch.object(views, 'is_delivery_crew', deliver_meanwhile):
+            response = self.client.patch(f'/api/orders/{order.pk}', {'status': True})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(DailySales.objects.get().delivered, 1)
+
+    def test_rebuild_matches_incremental(self):
+        self.place_order(self.menu[:2])
+        order = self.place_order(self.menu[2:5], quantity=3)
+        # Mark one order delivered behind the view's back, in both places
+        Order.objects.filter(pk=order.pk).update(status=True)
+        DailySales.objects.update(delivered=1)
+        incremental = self.snapshot()
+        call_command('rebuild_sales', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_report_reads_only_rollups(self):
+        self.place_order(self.menu[:2])
+        self.client.force_authenticate(self.manager)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/reports/sales', {'start': timezone.localdate().isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any('"LittleLemonAPI_order' in q['sql'] for q in ctx.captured_queries))
+        data = response.json()
+        self.assertEqual(data['totals']['orders'], 1)
+        self.assertEqual(len(data['days']), 1)
+        self.assertEqual({row['menuitem'] for row in data['items']}, {self.menu[0].pk, self.menu[1].pk})
+
+
+class AsyncViewTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+        self.fill_cart(self.customer, self.menu[:2])
+        checkout(self.customer)
+        self.fill_cart(self.customer, self.menu[2:4])
+
+    def sync_get(self, path, user=None, **params):
+        self.client.force_authenticate(user)
+        return self.client.get(path, params)
+
+    async def async_get(self, view, path, user=None, params=None, **kwargs):
+        headers = {}
+        if user is not None:
+            token, _ = await Token.objects.aget_or_create(user=user)
+            headers['Authorization'] = f'Token {token.key}'
+        return await view(self.factory.get(path, params or {}, headers=headers), **kwargs)
+
+    async def test_same_responses_as_sync_views(self):
+        cases = [
+            (async_views.menu_items, '/api/menu-items', None, {'perpage': 2, 'page': 2}, {}),
+            (async_views.menu_items, '/api/menu-items', None, {'cursor': '', 'search': 'cake'}, {}),
+            (async_views.single_items, f'/api/menu-items/{self.menu[1].pk}', None, {}, {'pk': self.menu[1].pk}),
+            (async_views.cart_menu_items, '/api/cart/menu-items', self.customer, {}, {}),
+            (async_views.orders, '/api/orders', self.customer, {}, {}),
+            (async_views.orders, '/api/orders', self.manager, {'cursor': ''}, {}),
+        ]
+        for view, path, user, params, kwargs in cases:
+            with self.subTest(path=path, params=params):
+                expected = await sync_to_async(self.sync_get)(path, user, **params)
+                response = await self.async_get(view, path, user, params, **kwargs)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(json.loads(response.content), expected.json())
+
+    async def test_errors(self):
+        response = await self.async_get(async_views.orders, '/api/orders')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+        response = await self.async_get(async_views.cart_menu_items, '/api/cart/menu-items', self.manager)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = await self.async_get(async_views.single_items, '/api/menu-items/0', pk=0)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        request = self.factory.get('/api/orders', headers={'Authorization': 'Token nope'})
+        response = await async_views.orders(request)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_other_methods_use_the_sync_view(self):
+        response = await async_views.menu_items(self.factory.post('/api/menu-items', {}))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CachedTokenAuthenticationTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.customer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_hot_path_skips_token_and_group_queries(self):
+        self.assertEqual(self.client.get('/api/cart/menu-items').status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get('/api/cart/menu-items').status_code, status.HTTP_200_OK)
+        self.assertFalse(any('authtoken_token' in q['sql'] or 'auth_group' in q['sql'] for q in ctx.captured_queries))
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_logout_invalidates(self):
+        self.client.get('/api/cart/menu-items')
+        response = self.client.post('/auth/token/logout/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get('/api/cart/menu-items').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivation_invalidates(self):
+        self.client.get('/api/cart/menu-items')
+        self.customer.is_active = False
+        self.customer.save()
+        self.assertEqual(self.client.get('/api/cart/menu-items').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_group_change_invalidates(self):
+        self.client.get('/api/cart/menu-items')
+        self.customer.groups.add(self.manager_group)
+        self.assertEqual(self.client.get('/api/cart/menu-items').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_change_during_load_is_not_cached(self):
+        def deactivate_meanwhile(user):
+            # The user is deactivated after their row was read, before it is cached
+            self.customer.save(update_fields=['is_active'])
+            return get_roles(user)
+
+        self.customer.is_active = False
+        with mock.patch('LittleLemonAPI.authentication.get_roles', deactivate_meanwhile):
+            self.assertEqual(self.client.get('/api/cart/menu-items').status_code, status.HTTP_200_OK)
+        self.assertIsNone(token_cache().get(self.token.key))
+        self.assertEqual(self.client.get('/api/cart/menu-items').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_expired_entries_leave_the_user_index(self):
+        cache = token_cache()
+        self.client.get('/api/cart/menu-items')
+        self.assertIn(self.token.key, cache._keys_by_user[self.customer.pk])
+        with mock.patch('LittleLemonAPI.lru.time.monotonic', return_value=time.monotonic() + 3600):
+            self.assertIsNone(cache.get(self.token.key))
+        self.assertNotIn(self.customer.pk, cache._keys_by_user)
+
+    def other_worker(self):
+        # Its own token cache and its own connection to the shared cache
+        other = TokenCache(100, settings.LITTLELEMON_TOKEN_CACHE['TTL'], settings.LITTLELEMON_TOKEN_CACHE['LOCAL_TTL'])
+        return other, mock.patch.object(authentication, 'cache', caches.create_connection('default'))
+
+    def test_entries_are_shared_between_workers(self):
+        self.client.get('/api/cart/menu-items')
+        other, shared = self.other_worker()
+        with shared, mock.patch.object(authentication, 'token_cache', lambda: other), \
+                CaptureQueriesContext(connection) as ctx:
+            user, _ = CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        self.assertEqual(user.pk, self.customer.pk)
+        self.assertFalse(any('authtoken_token' in q['sql'] or 'auth_group' in q['sql'] for q in ctx.captured_queries))
+
+    def test_revoked_through_another_worker(self):
+        self.client.get('/api/cart/menu-items')
+        # Deactivated through another worker: no signal reaches this process
+        User.objects.filter(pk=self.customer.pk).update(is_active=False)
+        other, shared = self.other_worker()
+        with shared:
+            other.invalidate_user(self.customer.pk)
+        # Only this process's short-lived copy may still be served
+        local_ttl = settings.LITTLELEMON_TOKEN_CACHE['LOCAL_TTL']
+        with mock.patch('LittleLemonAPI.lru.time.monotonic', return_value=time.monotonic() + local_ttl + 1):
+            self.assertEqual(self.client.get('/api/cart/menu-items').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_each_request_gets_its_own_user(self):
+        auth = CachedTokenAuthentication()
+        first, _ = auth.authenticate_credentials(self.token.key)
+        second, _ = auth.authenticate_credentials(self.token.key)
+        self.assertIsNot(first, second)
+        self.assertEqual(first.pk, second.pk)
+
+
+class EndpointQueryCountTests(LittleLemonTestCase):
+    """Query counts must not grow with the number of rows an endpoint returns."""
+
+    def add_orders(self, count, items_per_order):
+        orders = Order.objects.bulk_create([
+            Order(user=self.customer, delivery_crew=self.crew, status=False, total=0) for _ in range(count)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menuitem=item, quantity=1, unit_price=item.price, price=item.price)
+            for order in orders
+            for item in self.menu[:items_per_order]
+        ])
+        return orders
+
+    def count_queries(self, user, method, path, data=None):
+        # Each call starts cold, so both sizes pay for the same cache misses
+        self.clear_caches()
+        # A fresh instance, without roles memoized by an earlier request
+        self.client.force_authenticate(User.objects.get(pk=user.pk))
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(path, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, path)
+        return len(ctx.captured_queries)
+
+    def calls(self, order):
+        calls = []
+        for user in (self.customer, self.crew, self.manager):
+            calls += [
+                (user, 'get', '/api/menu-items?perpage=1000'),
+                (user, 'get', '/api/menu-items?cursor=&perpage=1000'),
+                (user, 'get', '/api/orders?perpage=1000'),
+                (user, 'get', '/api/orders?cursor=&perpage=1000'),
+                (user, 'get', f'/api/orders/{order.id}'),
+            ]
+        return calls + [
+            (self.customer, 'get', '/api/cart/menu-items'),
+            (self.manager, 'get', '/api/orders/export?format=ndjson'),
+            (self.manager, 'get', '/api/reports/sales'),
+            (self.manager, 'get', '/api/groups/manager/users'),
+            (self.manager, 'get', '/api/groups/delivery-crew/users'),
+        ]
+
+    def add_small_data(self):
+        """One order with one item and one cart line; returns the order."""
+        order = self.add_orders(1, 1)[0]
+        self.fill_cart(self.customer, self.menu[:1])
+        return order
+
+    def add_large_data(self, order):
+        """Grow every listing: more orders, items, cart lines, menu items and group members."""
+        self.add_orders(20, 5)
+        self.fill_cart(self.customer, self.menu[1:])
+        MenuItem.objects.bulk_create([
+            MenuItem(title=f'Pie {i}', price=Decimal('3.00'), featured=False, category=self.category)
+            for i in range(20)
+        ])
+        extra_users = [User.objects.create_user(f'user-{i}') for i in range(5)]
+        self.manager_group.user_set.add(*extra_users)
+        self.crew_group.user_set.add(*extra_users)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menuitem=item, quantity=1, unit_price=item.price, price=item.price)
+            for item in self.menu[1:]
+        ])
+
+    def test_reads_do_not_grow_with_result_size(self):
+        order = self.add_small_data()
+        before = [self.count_queries(*call) for call in self.calls(order)]
+
+        self.add_large_data(order)
+        for call, queries in zip(self.calls(order), before):
+            with self.subTest(user=call[0].username, path=call[2]):
+                self.assertEqual(self.count_queries(*call), queries)
+
+    def test_cart_writes_do_not_grow_with_cart_size(self):
+        self.fill_cart(self.customer, self.menu[:1])
+        add = (self.customer, 'post', '/api/cart/menu-items', {'menuitems_id': self.menu[0].id})
+        before = self.count_queries(*add)
+        Cart.objects.filter(user=self.customer).delete()
+        self.fill_cart(self.customer, self.menu)
+        self.assertEqual(self.count_queries(*add), before)
+
+
+class InstrumentationTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        instrumentation.REGISTRY.clear()
+
+    def test_server_timing_breakdown(self):
+        self.add_order()
+        token = Token.objects.create(user=self.manager)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = self.client.get('/api/orders')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        phases = {entry.split(';')[0].strip() for entry in response['Server-Timing'].split(',')}
+        self.assertEqual(phases, {'auth', 'roles', 'db', 'serialize', 'render', 'total'})
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries \(slowest [\d.]+ms\)"')
+
+    def test_server_timing_only_for_managers_and_staff(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/menu-items'))
+        self.client.force_authenticate(self.customer)
+        self.assertNotIn('Server-Timing', self.client.get('/api/orders'))
+        self.client.force_authenticate(User.objects.create_user('staff', is_staff=True))
+        self.assertIn('Server-Timing', self.client.get('/api/orders'))
+        # Still recorded for the metrics
+        self.assertIn('littlelemon_request_duration_seconds_count{view="api/menu-items",method="GET",status="200"} 1',
+                      instrumentation.REGISTRY.render())
+
+    @override_settings(LITTLELEMON_INSTRUMENTATION={'SERVER_TIMING': True})
+    def test_server_timing_for_everyone(self):
+        self.assertIn('Server-Timing', self.client.get('/api/menu-items'))
+
+    def test_metrics(self):
+        self.client.force_authenticate(self.customer)
+        self.client.get('/api/orders')
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(self.manager)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE littlelemon_request_duration_seconds histogram', body)
+        self.assertIn('littlelemon_request_duration_seconds_count{view="api/orders",method="GET",status="200"} 1', body)
+        self.assertIn('littlelemon_request_phase_seconds_bucket{view="api/orders",phase="serialize",le="+Inf"} 1', body)
+        self.assertRegex(body, r'littlelemon_request_queries_count\{view="api/orders"\} 1\n')
+
+    @override_settings(LITTLELEMON_INSTRUMENTATION=None)
+    def test_disabled(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.get('/api/orders')
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('api/orders', instrumentation.REGISTRY.render())
+
+    def add_order(self):
+        self.fill_cart(self.customer, self.menu[:2])
+        return checkout(self.customer)
+
+
+class RepresentationTests(LittleLemonTestCase):
+    """The fast read path must produce exactly what the DRF serializers do."""
+
+    def assertSameJSON(self, fast, slow):
+        self.assertEqual(JSONRenderer().render(fast), JSONRenderer().render(slow))
+
+    def test_menu_items(self):
+        items = MenuItem.objects.select_related('category').order_by('id')
+        self.assertSameJSON(
+            representations.MENU_ITEM.many(representations.MENU_ITEM.values(items)),
+            MenuItemSerializer(items, many=True).data)
+
+    def test_cart(self):
+        self.fill_cart(self.customer, self.menu[:3], quantity=3)
+        lines = Cart.objects.select_related('menuitems').order_by('id')
+        self.assertSameJSON(
+            representations.CART.many(representations.CART.values(lines)),
+            CartSerializer(lines, many=True).data)
+
+    def test_orders(self):
+        self.fill_cart(self.customer, self.menu[:3])
+        checkout(self.customer)
+        self.fill_cart(self.customer, self.menu[3:])
+        Order.objects.filter(pk=checkout(self.customer).pk).update(delivery_crew=self.crew, status=True)
+        orders = Order.objects.prefetch_related('orderitem_set__menuitem').order_by('id')
+        self.assertSameJSON(
+            representations.orders(representations.ORDER.values(orders)),
+            OrderSerializer(orders, many=True).data)
+
+    def test_order_endpoints_match_serializer(self):
+        self.fill_cart(self.customer, self.menu[:2])
+        order = checkout(self.customer)
+        self.client.force_authenticate(self.customer)
+        expected = OrderSerializer(Order.objects.get(pk=order.pk)).data
+        self.assertSameJSON(self.client.get(f'/api/orders/{order.pk}').json(), expected)
+        self.assertSameJSON(self.client.get('/api/orders').json(), [expected])
+
+
+class FastJSONTests(APITestCase):
+    data = {
+        'price': Decimal('4.50'),
+        'date': datetime.datetime(2024, 10, 19, 12, 22, 16, 149974, tzinfo=datetime.timezone.utc),
+        'local': datetime.datetime(2024, 10, 19, 12, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=5, minutes=30))),
+        'naive': datetime.datetime(2024, 10, 19, 12, 0, 5),
+        'day': datetime.date(2024, 10, 19),
+        'title': 'Café\u2028Lemon\u2029',
+        'lazy': gettext_lazy('Not found.'),
+        1: [1.5, None, True, ('a', 'b')],
+    }
+
+    def test_renderer_matches_drf(self):
+        self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+
+    def test_indented_output_falls_back(self):
+        self.assertEqual(
+            FastJSONRenderer().render(self.data, 'application/json; indent=4'),
+            JSONRenderer().render(self.data, 'application/json; indent=4'))
+
+    def test_parser(self):
+        parser = FastJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO('{"title": "Café", "n": [1, 2.5]}'.encode())),
+                         {'title': 'Café', 'n': [1, 2.5]})
+        for body in (b'{"a": ', b'{"a": NaN}', b'\xff'):
+            with self.assertRaises(ParseError):
+                parser.parse(io.BytesIO(body))
+
+    def test_api_uses_fast_json(self):
+        self.client.force_authenticate(User.objects.create_user('someone'))
+        response = self.client.post('/api/cart/menu-items', '{"menuitems_id": 999', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('JSON parse error', response.json()['detail'])
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    databases = {'default'}
+
+    def test_sqlite_profile(self):
+        database = database_profiles.databases(Path('/srv'), {})['default']
+        self.assertEqual(database['NAME'], Path('/srv/db.sqlite3'))
+        self.assertIn('PRAGMA journal_mode=WAL', database['OPTIONS']['init_command'])
+        self.assertEqual(database['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+
+    def test_postgresql_profile(self):
+        env = {'LITTLELEMON_DATABASE': 'postgresql', 'POSTGRES_HOST': 'db', 'CONN_MAX_AGE': '120'}
+        database = database_profiles.databases(Path('/srv'), env)['default']
+        self.assertEqual((database['ENGINE'], database['HOST']), ('django.db.backends.postgresql', 'db'))
+        self.assertEqual(database['CONN_MAX_AGE'], 120)
+        self.assertNotIn('pool', database['OPTIONS'])
+
+        database = database_profiles.databases(Path('/srv'), {**env, 'POSTGRES_POOL_SIZE': '16'})['default']
+        self.assertEqual(database['OPTIONS']['pool']['max_size'], 16)
+        self.assertNotIn('CONN_MAX_AGE', database)
+
+        with self.assertRaises(ValueError):
+            database_profiles.databases(Path('/srv'), {'LITTLELEMON_DATABASE': 'mysql'})
+
+    @skipUnless(connection.vendor == 'sqlite', "SQLite pragmas")
+    def test_pragmas_applied_on_connect(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], database_profiles.SQLITE_PRAGMAS['busy_timeout'])
+
+
+class JobTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer.email = 'customer@example.com'
+        self.customer.save()
+        self.calls = []
+        tasks = {**jobs.TASKS, 'flaky': self.flaky}
+        patcher = mock.patch.object(jobs, 'TASKS', tasks)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def flaky(self, fail=True):
+        self.calls.append(fail)
+        if fail:
+            raise RuntimeError("try again")
+
+    def test_checkout_queues_follow_up_work(self):
+        self.fill_cart(self.customer, self.menu[:2])
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/api/orders')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # Nothing ran yet
+        order = Order.objects.get()
+        self.assertIsNone(order.delivery_crew)
+        self.assertEqual(mail.outbox, [])
+        self.assertCountEqual(Job.objects.values_list('name', flat=True), ['send_receipt'])
+
+        self.assertEqual(jobs.run_batch(), (1, 0))
+        self.assertFalse(Job.objects.exists())
+        # Left to dispatch_orders
+        order.refresh_from_db()
+        self.assertIsNone(order.delivery_crew)
+        self.assertEqual(mail.outbox[0].to, ['customer@example.com'])
+        self.assertIn('2 x Cake 0', mail.outbox[0].body)
+
+        # A failed checkout queues nothing
+        self.client.post('/api/orders')
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(LITTLELEMON_DISPATCH_ON_CHECKOUT=True)
+    def test_dispatch_on_checkout(self):
+        self.customer.email = ''
+        self.customer.save()
+        self.fill_cart(self.customer, self.menu[:2])
+        order = checkout(self.customer)
+        # No receipt without an email address
+        self.assertCountEqual(Job.objects.values_list('name', flat=True), ['assign_delivery'])
+        self.assertEqual(jobs.run_batch(), (1, 0))
+        order.refresh_from_db()
+        self.assertEqual(order.delivery_crew, self.crew)
+
+    @override_settings(LITTLELEMON_JOBS={'MAX_ATTEMPTS': 2, 'BACKOFF': 10})
+    def test_retries_with_backoff(self):
+        job = jobs.enqueue('flaky')
+        self.assertEqual(jobs.run_batch(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('RuntimeError: try again', job.last_error)
+        self.assertAlmostEqual((job.run_at - timezone.now()).total_seconds(), 10, delta=1)
+        # Not due yet
+        self.assertEqual(jobs.run_batch(), (0, 0))
+
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(jobs.run_batch(), (0, 1))
+        job.refresh_from_db()
+        self.assertTrue(job.failed)
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(jobs.run_batch(), (0, 0))
+        self.assertEqual(len(self.calls), 2)
+
+    def test_visibility_timeout(self):
+        job = jobs.enqueue('flaky', {'fail': False})
+        [leased] = jobs.dequeue(visibility_timeout=30)
+        # Held by the first worker
+        self.assertEqual(jobs.dequeue(), [])
+
+        # The first worker died: the job is taken over once its lease expires
+        Job.objects.update(run_at=timezone.now())
+        [retaken] = jobs.dequeue()
+        self.assertEqual(retaken.pk, job.pk)
+        self.assertEqual(retaken.attempts, 2)
+        # A late finish under the expired lease changes nothing
+        jobs.complete(leased)
+        self.assertTrue(Job.objects.filter(pk=job.pk).exists())
+        jobs.complete(retaken)
+        self.assertFalse(Job.objects.exists())
+
+    def test_batches_and_command(self):
+        jobs.enqueue_many([('flaky', {'fail': False})] * 5)
+        jobs.enqueue('flaky', {'fail': False}, delay=60)
+        self.assertEqual(len(jobs.dequeue(batch_size=3)), 3)
+        # Their worker died
+        Job.objects.exclude(lease='').update(run_at=timezone.now())
+
+        out = io.StringIO()
+        call_command('runworker', '--once', '--concurrency', '2', stdout=out)
+        self.assertIn('Ran 5 jobs, 0 failed.', out.getvalue())
+        self.assertEqual(Job.objects.count(), 1)
+        with self.assertRaises(ValueError):
+            jobs.enqueue('nope')
+
+
+class DispatchTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.crew2 = User.objects.create_user('crew2')
+        self.crew2.groups.add(self.crew_group)
+        self.orders = Order.objects.bulk_create([Order(user=self.customer, total=Decimal('9.00')) for _ in range(5)])
+
+    def assigned(self):
+        return dict(Order.objects.values_list('id', 'delivery_crew'))
+
+    def test_least_loaded(self):
+        Order.objects.filter(pk__in=[self.orders[0].pk, self.orders[1].pk]).update(delivery_crew=self.crew)
+        # Delivered orders don't count towards the load
+        Order.objects.create(user=self.customer, delivery_crew=self.crew2, status=True)
+        self.assertEqual(dispatch.dispatch(strategy='least-loaded'), 3)
+        loads = Order.objects.filter(status=False).values('delivery_crew').annotate(n=Count('id'))
+        self.assertEqual(sorted(row['n'] for row in loads), [2, 3])
+        self.assertEqual(dispatch.dispatch(), 0)
+
+    def test_round_robin_continues_between_batches(self):
+        self.assertEqual(dispatch.dispatch(batch_size=3, strategy='round-robin'), 3)
+        self.assertEqual(dispatch.dispatch(batch_size=3, strategy='round-robin'), 2)
+        assigned = self.assigned()
+        self.assertEqual([assigned[order.pk] for order in self.orders],
+                         [self.crew.pk, self.crew2.pk, self.crew.pk, self.crew2.pk, self.crew.pk])
+
+    def test_only_queued_orders_are_dispatched(self):
+        Order.objects.filter(pk=self.orders[0].pk).update(status=True)
+        Order.objects.filter(pk=self.orders[1].pk).update(delivery_crew=self.crew2)
+        self.crew.is_active = False
+        self.crew.save()
+        self.assertEqual(dispatch.dispatch(), 3)
+        assigned = self.assigned()
+        self.assertIsNone(assigned[self.orders[0].pk])
+        self.assertEqual({assigned[order.pk] for order in self.orders[1:]}, {self.crew2.pk})
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            dispatch.dispatch(strategy='fastest')
+
+    def test_claim_next_order(self):
+        self.client.force_authenticate(self.crew)
+        claimed = [self.client.post('/api/orders/next').data['id'] for _ in self.orders]
+        self.assertEqual(claimed, [order.pk for order in self.orders])
+        self.assertEqual(set(self.assigned().values()), {self.crew.pk})
+
+        response = self.client.post('/api/orders/next')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(len(self.client.get('/api/orders').data), 5)
+
+    def test_claim_next_order_crew_only(self):
+        for user in (self.customer, self.manager):
+            self.client.force_authenticate(user)
+            self.assertEqual(self.client.post('/api/orders/next').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_dispatch_orders_command(self):
+        out = io.StringIO()
+        call_command('dispatch_orders', '--once', '--batch-size', '2', '--strategy', 'round-robin', stdout=out)
+        self.assertIn('drained', out.getvalue())
+        self.assertFalse(Order.objects.filter(dispatch.QUEUED).exists())
+
+
+@override_settings(LITTLELEMON_EVENTS_BACKEND='LittleLemonAPI.events.InProcessBroker', LITTLELEMON_EVENTS_HEARTBEAT=0.05)
+class OrderStreamTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user('other')
+        self.order = Order.objects.create(user=self.customer, total=Decimal('9.00'))
+        self.other_order = Order.objects.create(user=self.other, total=Decimal('9.00'))
+
+    async def open_stream(self, user):
+        token, _ = await Token.objects.aget_or_create(user=user)
+        request = AsyncRequestFactory().get('/api/orders/stream', headers={'Authorization': f'Token {token.key}'})
+        response = await async_views.orders_stream(request)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        return stream
+
+    async def next_events(self, stream, count=1):
+        received = []
+        for _ in range(count):
+            message = (await asyncio.wait_for(anext(stream), 1)).decode()
+            received.append(None if message.startswith(':') else json.loads(message.split('data: ')[1]))
+        return received
+
+    def patch(self, user, order, data):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/orders/{order.pk}', data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    async def test_changes_reach_the_users_who_can_see_the_order(self):
+        customer, crew, manager = [await self.open_stream(user) for user in (self.customer, self.crew, self.manager)]
+        await sync_to_async(self.patch)(self.manager, self.order, {'delivery_crew': self.crew.pk})
+        await sync_to_async(self.patch)(self.manager, self.other_order, {'status': True})
+        await sync_to_async(self.patch)(self.crew, self.order, {'status': True})
+
+        assigned = {'order': self.order.pk, 'user': self.customer.pk, 'delivery_crew': self.crew.pk,
+                    'status': False, 'previous_delivery_crew': None}
+        delivered = {'order': self.order.pk, 'user': self.customer.pk, 'delivery_crew': self.crew.pk, 'status': True}
+        self.assertEqual(await self.next_events(customer, 3), [assigned, delivered, None])
+        self.assertEqual(await self.next_events(crew, 3), [assigned, delivered, None])
+        events = await self.next_events(manager, 3)
+        self.assertEqual([event['order'] for event in events], [self.order.pk, self.other_order.pk, self.order.pk])
+
+    async def test_dispatch_assignments_are_published(self):
+        stream = await self.open_stream(self.crew)
+
+        def claim():
+            with self.captureOnCommitCallbacks(execute=True):
+                return dispatch.claim_next(self.crew)
+
+        self.assertEqual(await sync_to_async(claim)(), self.order.pk)
+        self.assertEqual((await self.next_events(stream))[0]['delivery_crew'], self.crew.pk)
+
+    async def test_logout_ends_the_stream(self):
+        stream = await self.open_stream(self.customer)
+        await Token.objects.filter(user=self.customer).adelete()
+        with self.assertRaises(StopAsyncIteration):
+            await self.next_events(stream, 2)
+
+    async def test_demoted_manager_only_hears_about_their_own_orders(self):
+        stream = await self.open_stream(self.manager)
+        await sync_to_async(self.manager.groups.remove)(self.manager_group)
+        # The next heartbeat rechecks the token
+        self.assertEqual(await self.next_events(stream), [None])
+        events.broker().publish({'id': 1, 'order': self.other_order.pk, 'user': self.other.pk,
+                                 'delivery_crew': None, 'status': True})
+        self.assertEqual(await self.next_events(stream), [None])
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    async def test_cache_broker_reaches_other_processes(self):
+        # The polling thread can't see writes to the database cache inside the test transaction
+        broker, publisher = events.CacheBroker(interval=0.01), events.CacheBroker()
+        publisher.publish({'id': 1, 'order': 6})
+        async with broker.subscribe() as subscription:
+            poller = broker._poller
+            await asyncio.sleep(0.1)
+            publisher.publish({'id': 1, 'order': 7})
+            publisher.publish({'id': 1, 'order': 8})
+            received = [await subscription.get(1) for _ in range(2)]
+        await sync_to_async(poller.join)(1)
+        self.assertFalse(poller.is_alive())
+        self.assertEqual([event['order'] for event in received], [7, 8])
+        self.assertEqual(received[1]['id'], received[0]['id'] + 1)
+
+    def test_requires_asgi(self):
+        self.assertEqual(self.client.get('/api/orders/stream').status_code, status.HTTP_401_UNAUTHORIZED)
+        token, _ = Token.objects.get_or_create(user=self.customer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(self.client.get('/api/orders/stream').status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+    async def test_slow_subscriber_keeps_newest_events(self):
+        broker = events.InProcessBroker(maxsize=2)
+        async with broker.subscribe() as subscription:
+            for i in range(3):
+                broker.publish({'id': i})
+            await asyncio.sleep(0)
+            self.assertEqual([await subscription.get(1) for _ in range(2)], [{'id': 1}, {'id': 2}])
+        self.assertFalse(broker._subscribers)
+
+
+@skipUnless(connection.vendor == 'sqlite', "SQLite query plans")
+class QueryPlanTests(LittleLemonTestCase):
+    def assertUsesIndexes(self, queryset):
+        plan = queryset.explain()
+        # "SCAN table" without an index is a full table scan
+        self.assertIsNone(re.search(r'\bSCAN \S+$', plan, re.MULTILINE), plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_menu_filters(self):
+        for params in ('category=Desserts', 'category=Desserts&price=5', 'price=5'):
+            with self.subTest(params=params):
+                self.assertUsesIndexes(representations.MENU_ITEM.values(views.menu_queryset(QueryDict(params))))
+
+    def test_cart(self):
+        self.assertUsesIndexes(representations.CART.values(Cart.objects.filter(user=self.customer)))
+
+    def test_order_pages(self):
+        cursor = encode_cursor([timezone.now().isoformat(), 10])
+        for user, params in ((self.customer, ''), (self.crew, ''), (self.manager, 'status=pending')):
+            orders = representations.ORDER.values(views.orders_queryset(user, QueryDict(params)))
+            for page in ('', cursor):
+                with self.subTest(user=user.username, cursor=page):
+                    self.assertUsesIndexes(keyset_query(orders, ('date', 'id'), page, 10)[0])
+
+    def test_order_items(self):
+        self.assertUsesIndexes(OrderItem.objects.select_related('menuitem').filter(order_id__in=[1, 2]))
+
+    def test_dispatch_queue(self):
+        self.assertUsesIndexes(Order.objects.filter(dispatch.QUEUED).order_by('date', 'id').values_list('id')[:5])
+
+
+@skipUnless(connection.vendor == 'sqlite', "SQLite files as primary and replica")
+@override_settings(LITTLELEMON_READ_REPLICAS=['replica1'])
+class ReplicaRoutingTests(LittleLemonTestCase):
+    @classmethod
+    def setUpClass(cls):
+        # A second SQLite file with the primary's schema stands in for the replica.
+        # The connection is registered outside settings.DATABASES, so it isn't
+        # part of the test transactions; setUp copies rows into it.
+        cls.workdir = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.workdir.name, 'replica.sqlite3')
+        connection.ensure_connection()
+        replica = sqlite3.connect(path)
+        connection.connection.backup(replica)
+        replica.close()
+        settings_dict = database_profiles.replica(connections.settings['default'], path)
+        connections['replica1'] = load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, 'replica1')
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica1'].close()
+        del connections['replica1']
+        cls.workdir.cleanup()
+
+    def setUp(self):
+        super().setUp()
+        # Replicate the menu, then change it on the primary only, as if the replica lagged
+        Category.objects.using('replica1').bulk_create(Category.objects.all())
+        MenuItem.objects.using('replica1').bulk_create(MenuItem.objects.all())
+        self.addCleanup(Category.objects.using('replica1').all().delete)
+        self.addCleanup(MenuItem.objects.using('replica1').all().delete)
+        self.item = self.menu[0]
+        MenuItem.objects.filter(pk=self.item.pk).update(title='Fresh cake')
+
+    def get_title(self, user):
+        self.client.force_authenticate(user)
+        return self.client.get(f'/api/menu-items/{self.item.pk}').data['title']
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.get_title(self.customer), 'Cake 0')
+        with routers.use_replica():
+            item = MenuItem.objects.get(pk=self.item.pk)
+        self.assertEqual(item._state.db, 'replica1')
+        self.assertEqual(MenuItem.objects.get(pk=self.item.pk).title, 'Fresh cake')
+
+    def test_writes_go_to_primary(self):
+        with routers.use_replica():
+            item = MenuItem.objects.get(pk=self.item.pk)
+            item.price = Decimal('9.99')
+            item.save()
+            Cart.objects.create(user=self.customer, menuitems=item, quantity=1,
+                                unit_price=item.price, price=item.price)
+        self.assertEqual(MenuItem.objects.get(pk=self.item.pk).price, Decimal('9.99'))
+        self.assertEqual(Cart.objects.filter(user=self.customer).count(), 1)
+        self.assertFalse(Cart.objects.using('replica1').exists())
+
+    def test_user_pinned_to_primary_after_write(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/api/cart/menu-items', {'menuitems_id': self.item.pk, 'quantity': 1})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.get_title(self.customer), 'Fresh cake')
+        # Cart lines exist only on the primary
+        self.assertEqual(len(self.client.get('/api/cart/menu-items').data), 1)
+        self.assertEqual(self.get_title(self.manager), 'Cake 0')
+
+        cache.delete(routers._pin_key(self.customer.pk))
+        self.assertEqual(self.get_title(self.customer), 'Cake 0')
+
+    def test_pins_reach_other_workers(self):
+        # Another worker process has its own cache connection to the same store
+        with mock.patch.object(routers, 'cache', caches.create_connection('default')):
+            routers.pin_to_primary(self.customer)
+        self.assertEqual(self.get_title(self.customer), 'Fresh cake')
+
+    def test_requires_shared_cache(self):
+        routers.check_shared_cache()
+        with override_settings(CACHES=LOCAL_CACHE):
+            with self.assertRaises(ImproperlyConfigured):
+                routers.check_shared_cache()
+
+    def test_failed_write_does_not_pin(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/api/orders')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(routers.is_pinned(self.customer))
+
+    def test_cached_menu_built_from_primary(self):
+        self.client.force_authenticate(self.customer)
+        titles = [item['title'] for item in self.client.get('/api/menu-items').json()]
+        self.assertIn('Fresh cake', titles)
+
+    async def test_async_reads_go_to_replica(self):
+        token, _ = await Token.objects.aget_or_create(user=self.customer)
+        request = AsyncRequestFactory().get(f'/api/menu-items/{self.item.pk}',
+                                            headers={'Authorization': f'Token {token.key}'})
+        response = await async_views.single_items(request, pk=self.item.pk)
+        self.assertEqual(json.loads(response.content)['title'], 'Cake 0')
+
+        await sync_to_async(routers.pin_to_primary)(self.customer)
+        response = await async_views.single_items(request, pk=self.item.pk)
+        self.assertEqual(json.loads(response.content)['title'], 'Fresh cake')
+
+
+class OrderArchiveTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fill_cart(self.customer, self.menu[:2])
+        self.old = checkout(self.customer)
+        self.fill_cart(self.customer, self.menu[2:3])
+        self.pending = checkout(self.customer)
+        self.fill_cart(self.customer, self.menu[3:5])
+        self.recent = checkout(self.customer)
+        # Two orders delivered long ago, one of them pending, and one delivered today
+        long_ago = timezone.now() - datetime.timedelta(days=200)
+        Order.objects.filter(pk__in=[self.old.pk, self.pending.pk]).update(date=long_ago)
+        Order.objects.filter(pk__in=[self.old.pk, self.recent.pk]).update(status=True)
+
+    def get(self, path, user=None, **params):
+        self.client.force_authenticate(user or self.customer)
+        return self.client.get(path, params)
+
+    def test_moves_old_delivered_orders(self):
+        expected = self.get(f'/api/orders/{self.old.pk}').json()
+        self.assertEqual(archive.archive_orders(90, batch_size=1), 1)
+        self.assertFalse(Order.objects.filter(pk=self.old.pk).exists())
+        self.assertFalse(OrderItem.objects.filter(order_id=self.old.pk).exists())
+        self.assertEqual(set(Order.objects.values_list('pk', flat=True)), {self.pending.pk, self.recent.pk})
+        self.assertEqual(ArchivedOrderItem.objects.filter(order_id=self.old.pk).count(), 2)
+
+        self.assertEqual(self.get(f'/api/orders/{self.old.pk}').status_code, status.HTTP_404_NOT_FOUND)
+        response = self.get(f'/api/orders/{self.old.pk}', include_archived=1)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), expected)
+        response = self.get(f'/api/orders/{self.old.pk}', self.crew, include_archived=1)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_listing_includes_archive_on_request(self):
+        everything = self.get('/api/orders', perpage=10).json()
+        archive.archive_orders(90)
+        self.assertEqual([order['id'] for order in self.get('/api/orders').json()],
+                         [self.pending.pk, self.recent.pk])
+        for user in (self.customer, self.manager):
+            with self.subTest(user=user.username):
+                self.assertEqual(self.get('/api/orders', user, perpage=10, include_archived=1).json(), everything)
+                first = self.get('/api/orders', user, cursor='', perpage=2, include_archived='true').json()
+                self.assertEqual(first['results'], everything[:2])
+                second = self.get('/api/orders', user, cursor=first['next'], perpage=2, include_archived=1).json()
+                self.assertEqual(second['results'], everything[2:])
+                back = self.get('/api/orders', user, cursor=second['previous'], perpage=2, include_archived=1).json()
+                self.assertEqual(back['results'], everything[:2])
+        # Nothing archived is pending
+        response = self.get('/api/orders', self.manager, status='pending', include_archived=1)
+        self.assertEqual([order['id'] for order in response.json()], [self.pending.pk])
+        self.assertEqual(self.get('/api/orders', User.objects.create_user('other'), include_archived=1).json(), [])
+
+    async def test_async_listing(self):
+        await sync_to_async(archive.archive_orders)(90)
+        expected = await sync_to_async(self.get)('/api/orders', include_archived=1)
+        token, _ = await Token.objects.aget_or_create(user=self.customer)
+        request = AsyncRequestFactory().get('/api/orders', {'include_archived': 1, 'cursor': ''},
+                                            headers={'Authorization': f'Token {token.key}'})
+        response = await async_views.orders(request)
+        self.assertEqual(json.loads(response.content)['results'], expected.json())
+        request = AsyncRequestFactory().get('/api/orders', {'include_archived': 1},
+                                            headers={'Authorization': f'Token {token.key}'})
+        response = await async_views.orders(request)
+        self.assertEqual(json.loads(response.content), expected.json())
+
+    def test_command_and_rebuild_sales(self):
+        call_command('rebuild_sales', stdout=io.StringIO())
+        before = list(DailySales.objects.order_by('date').values_list('date', 'orders', 'delivered', 'revenue'))
+        out = io.StringIO()
+        call_command('archive_orders', '--days', '90', stdout=out)
+        self.assertIn("Archived 1 orders", out.getvalue())
+        self.assertTrue(ArchivedOrder.objects.filter(pk=self.old.pk).exists())
+        call_command('rebuild_sales', stdout=io.StringIO())
+        self.assertEqual(
+            list(DailySales.objects.order_by('date').values_list('date', 'orders', 'delivered', 'revenue')), before)
@@ -0,0 +1,208 @@
+"""
+Write throttling and load shedding for the cart and checkout endpoints.
+
+Throttles are token buckets, one per user and scope, that hold up to the
+rate's number of requests and refill continuously over its period, so a
+client can burst up to the limit but not sustain more than the rate. The
+rate depends on the user's role (``LITTLELEMON_THROTTLE['RATES']``). Safe
+requests are never throttled, and neither are retries that only replay the
+response stored for their ``Idempotency-Key``. Throttled requests get DRF's ``429`` with a
+``Retry-After`` of the time until the next token.
+
+Buckets live in ``LITTLELEMON_THROTTLE['STORE']``: ``'cache'`` (the Django
+cache, shared between workers when the cache is; concurrent requests may
+occasionally both take the last token) or ``'local'`` (exact, but per
+process).
+
+``shed_writes`` protects the database under overload: it keeps a moving
+average of how long the writes it wraps take, and once that exceeds
+``LITTLELEMON_LOAD_SHEDDING['THRESHOLD']`` seconds it turns away a share of
+new writes with ``503``, the larger the further over the threshold. The
+writes it still admits keep the average current, so shedding stops by
+itself once they are fast again.
+"""
+import math
+import random
+import threading
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+from .lru import LRUCache
+from .roles import is_manager, is_delivery_crew
+from . import idempotency
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+# Never shed every write: the ones let through measure whether it is over
+MAX_SHED = 0.9
+
+_store = None
+_shedder = None
+
+
+def parse_rate(rate):
+    """``'10/min'`` -> ``(capacity, tokens per second)``; None for no limit."""
+    if rate is None:
+        return None
+    count, period = rate.split('/')
+    return int(count), int(count) / PERIODS[period[0]]
+
+
+def take(state, capacity, per_second, now):
+    """
+    Take a token from the bucket ``state`` (``(tokens, updated)`` or None for
+    a full bucket). Returns the new state and the seconds to wait for a
+    token, 0 if one was taken.
+    """
+    tokens, updated = state or (capacity, now)
+    tokens = min(capacity, tokens + (now - updated) * per_second)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / per_second
+
+
+class CacheBucketStore:
+    def consume(self, key, capacity, per_second, now):
+        key = f'littlelemon:throttle:{key}'
+        state, wait = take(cache.get(key), capacity, per_second, now)
+        # Expires once it would have refilled anyway
+        cache.set(key, state, timeout=math.ceil(capacity / per_second))
+        return wait
+
+
+class LocalBucketStore:
+    def __init__(self, maxsize=65536):
+        self._buckets = LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, per_second, now):
+        with self._lock:
+            state, wait = take(self._buckets.get(key), capacity, per_second, now)
+            self._buckets.set(key, state)
+        return wait
+
+
+STORES = {
+    'cache': CacheBucketStore,
+    'local': LocalBucketStore,
+}
+
+
+def _options():
+    return getattr(settings, 'LITTLELEMON_THROTTLE', None) or {}
+
+
+def store():
+    global _store
+    if _store is None:
+        name = _options().get('STORE', 'cache')
+        _store = (STORES[name] if name in STORES else import_string(name))()
+    return _store
+
+
+def role(user):
+    if not user.is_authenticated:
+        return 'anon'
+    if is_manager(user):
+        return 'manager'
+    if is_delivery_crew(user):
+        return 'crew'
+    return 'customer'
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Token bucket per user for the unsafe requests of a view; subclasses set ``scope``."""
+    scope = None
+    timer = time.time
+
+    def allow_request(self, request, view):
+        if request.method in SAFE_METHODS:
+            return True
+        rate = parse_rate(_options().get('RATES', {}).get(self.scope, {}).get(role(request.user)))
+        if rate is None:
+            return True
+        if idempotency.has_stored_response(request):
+            # A retry that only replays the first response costs nothing
+            return True
+        ident = request.user.pk if request.user.is_authenticated else self.get_ident(request)
+        self.wait_seconds = store().consume(f'{self.scope}:{ident}', *rate, self.timer())
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class CartThrottle(TokenBucketThrottle):
+    scope = 'cart'
+
+
+class CheckoutThrottle(TokenBucketThrottle):
+    scope = 'checkout'
+
+
+class LoadShedder:
+    def __init__(self, threshold, smoothing=0.2):
+        self.threshold = threshold
+        self.smoothing = smoothing
+        self.latency = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.latency += self.smoothing * (seconds - self.latency)
+
+    def shed_probability(self):
+        if self.latency <= self.threshold:
+            return 0.0
+        return min(MAX_SHED, 1 - self.threshold / self.latency)
+
+    def should_shed(self):
+        return random.random() < self.shed_probability()
+
+
+def shedder():
+    global _shedder
+    options = getattr(settings, 'LITTLELEMON_LOAD_SHEDDING', None)
+    if not options:
+        return None
+    if _shedder is None:
+        _shedder = LoadShedder(options.get('THRESHOLD', 0.5))
+    return _shedder
+
+
+@receiver(setting_changed)
+def _reset(setting, **kwargs):
+    global _store, _shedder
+    if setting == 'LITTLELEMON_THROTTLE':
+        _store = None
+    elif setting == 'LITTLELEMON_LOAD_SHEDDING':
+        _shedder = None
+
+
+def shed_writes(view):
+    """
+    Answer unsafe requests to a DRF function view with ``503`` while writes
+    are overloaded. Goes below ``@api_view``, like ``replica_reads``.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        load_shedder = shedder()
+        if load_shedder is None or request.method in SAFE_METHODS:
+            return view(request, *args, **kwargs)
+        if load_shedder.should_shed():
+            retry_after = settings.LITTLELEMON_LOAD_SHEDDING.get('RETRY_AFTER', 2)
+            return Response({"detail": "Service overloaded, try again later"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(retry_after)})
+        start = time.perf_counter()
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            load_shedder.observe(time.perf_counter() - start)
+    return wrapper
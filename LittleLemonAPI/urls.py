@@ -1,15 +1,26 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework.authtoken.views import obtain_auth_token
-from . import views
+from . import views, async_views
+
+# The hot read endpoints have async implementations for ASGI deployments
+hot_views = async_views if settings.LITTLELEMON_ASYNC_VIEWS else views
 
 urlpatterns = [
-    path('menu-items', views.menu_items, name='menu_items'),
-    path('menu-items/<int:pk>', views.single_items, name='single_items'),
-    path('cart/menu-items', views.cart_menu_items, name='cart_menu_items'),
-    path('orders', views.orders, name='orders'),
+    path('menu-items', hot_views.menu_items, name='menu_items'),
+    path('menu-items/import', views.menu_import, name='menu_import'),
+    path('menu-items/export', views.menu_export, name='menu_export'),
+    path('menu-items/<int:pk>', hot_views.single_items, name='single_items'),
+    path('cart/menu-items', hot_views.cart_menu_items, name='cart_menu_items'),
+    path('cart/menu-items/batch', views.cart_batch, name='cart_batch'),
+    path('orders', hot_views.orders, name='orders'),
+    path('orders/export', views.orders_export, name='orders_export'),
+    path('orders/next', views.next_order, name='next_order'),
+    path('orders/stream', async_views.orders_stream, name='orders_stream'),
     path('orders/<int:pk>', views.single_order, name='single_order'),
+    path('reports/sales', views.sales_report, name='sales_report'),
     path('groups/manager/users', views.managers, name='managers'),
     path('groups/manager/users/<int:pk>', views.single_manager, name='managers'),
     path('groups/delivery-crew/users', views.delivery_crew, name='delivery_crew'),
     path('groups/delivery-crew/users/<int:pk>', views.single_delivery_crew, name='delivery_crew'),
-]
\ No newline at end of file
+]
@@ -1,44 +1,86 @@
-from django.db.models import Prefetch
+import csv
+import datetime
+from django.db import transaction
+from django.db.models import Prefetch, Sum
 from django.contrib.auth.models import User, Group
 from django.shortcuts import render, get_object_or_404
 from django.core.paginator import Paginator, EmptyPage
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ParseError
+from rest_framework.decorators import api_view, permission_classes, renderer_classes, throttle_classes
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
-from .models import MenuItem, Cart, Order, OrderItem
-from .serializers import MenuItemSerializer, UserSerializer, CartSerializer,OrderItemSerializer, OrderSerializer
+from .models import MenuItem, Cart, Order, OrderItem, ArchivedOrder, DailySales, ItemSales
+from .serializers import MenuItemSerializer, UserSerializer, CartSerializer,OrderItemSerializer, OrderSerializer, DailySalesSerializer, ItemSalesReportSerializer, SalesTotalsSerializer, CartBatchSerializer
+from .services import checkout, EmptyCartError, add_to_cart, apply_cart_changes, CartChangeError
+from . import archive, catalogue, dispatch, events, exports, imports, rollups, snapshot
+from .instrumentation import REGISTRY, CONTENT_TYPE
+from . import representations
+from .representations import MENU_ITEM, CART, ORDER
+from .idempotency import idempotent
+from .routers import replica_reads
+from .throttling import CartThrottle, CheckoutThrottle, shed_writes
+from .permissions import IsManager, IsDeliveryCrew
+from .renderers import NDJSONRenderer, CSVRenderer
+from .search import filter_menu_items
+from .pagination import keyset_page, keyset_queries, keyset_merged, cursor_response_data
+from .roles import MANAGER, DELIVERY_CREW, has_role, is_manager, is_delivery_crew, is_customer
 
 # Create your views here.
 
+def menu_queryset(query_params, search_index=None):
+    items = MenuItem.objects.select_related('category').all()
+    category_name = query_params.get('category')
+    to_price = query_params.get('price')
+    search = query_params.get('search')
+
+    if category_name:
+        items = items.filter(category__title=category_name)
+    if to_price:
+        items = items.filter(price__lte=to_price)
+    if search:
+        items = filter_menu_items(items, search, index=search_index)
+    return items
+
+
+def menu_page(query_params):
+    data = snapshot.menu_page(query_params)
+    if data is not None:
+        return data
+
+    items = MENU_ITEM.values(menu_queryset(query_params))
+    perpage = query_params.get('perpage', default=10)
+    page = query_params.get('page', default=1)
+
+    if 'cursor' in query_params:
+        # Keyset pagination on id: no COUNT(*) and no OFFSET
+        items, next_cursor, previous_cursor = keyset_page(
+            items, ('id',), query_params['cursor'], perpage, key=MENU_ITEM.key(('id',)))
+        return cursor_response_data(MENU_ITEM.many(items), next_cursor, previous_cursor)
+
+    paginator = Paginator(items, per_page=perpage)
+    try:
+        items = paginator.page(number=page)
+    except EmptyPage:
+        items = []
+    return MENU_ITEM.many(items)
+
+
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticatedOrReadOnly])
+@replica_reads
 def menu_items(request):
     if request.method == 'GET':
-        items = MenuItem.objects.select_related('category').all()
-        category_name = request.query_params.get('category')
-        to_price = request.query_params.get('price')
-        search = request.query_params.get('search')
-        perpage = request.query_params.get('perpage', default=10)
-        page = request.query_params.get('page', default=1)
-
-        if category_name:
-            items = items.filter(category__title=category_name)
-        if to_price:
-            items = items.filter(price__lte=to_price)
-        if search:
-            items = items.filter(title__icontains=search)
-
-        paginator = Paginator(items, per_page=perpage)
-        try:
-            items = paginator.page(number=page)
-        except EmptyPage:
-            items = []
-        serializer = MenuItemSerializer(items, many=True)
-        return Response(serializer.data)
+        # JSON responses are served as pre-rendered bytes from the catalogue cache
+        if request.accepted_renderer.format == 'json':
+            return catalogue.menu_response(request, menu_page)
+        return Response(menu_page(request.query_params))
     
     if request.method == 'POST':
-        if request.user.groups.filter(name='Manager').exists() or request.user.is_superuser:
+        if is_manager(request.user):
             serializer = MenuItemSerializer(data=request.data)
             if serializer.is_valid():
                 serializer.save()
@@ -47,15 +89,54 @@ def menu_items(request):
         return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
     
 
+MENU_IMPORT_FORMATS = {'text/csv': 'csv', 'application/json': 'json', 'application/x-ndjson': 'ndjson'}
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, IsManager])
+@replica_reads
+def menu_import(request):
+    # The body is streamed into imports.import_menu, not parsed by DRF
+    format = MENU_IMPORT_FORMATS.get(request.content_type.split(';')[0].strip())
+    if format is None:
+        return Response({"detail": "Send the menu as text/csv, application/json or application/x-ndjson"},
+                        status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    if request.stream is None:
+        return Response({"detail": "Empty menu"}, status=status.HTTP_400_BAD_REQUEST)
+    dry_run = request.query_params.get('dry_run') in ('1', 'true')
+    try:
+        categories, items = imports.read_rows(imports.decode_lines(request.stream), format)
+        report = imports.import_menu(items, categories, dry_run=dry_run)
+    except imports.MenuImportError as exc:
+        return Response({"errors": exc.errors, "error_count": exc.error_count}, status=status.HTTP_400_BAD_REQUEST)
+    except (ValueError, csv.Error) as exc:
+        return Response({"detail": f"Invalid {format}: {exc}"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({**report, "dry_run": dry_run})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsManager])
+@renderer_classes([CSVRenderer, NDJSONRenderer])
+def menu_export(request):
+    # Columns match what menu_import reads, so an export can be edited and imported back
+    renderer = request.accepted_renderer
+    items = MenuItem.objects.all()
+    rows = exports.menu_csv_rows(items) if renderer.format == 'csv' else exports.menu_ndjson_rows(items)
+    response = StreamingHttpResponse(rows, content_type=f'{renderer.media_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="menu.{renderer.format}"'
+    return response
+
+
 @api_view(['GET', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticatedOrReadOnly])
+@replica_reads
 def single_items(request, pk):
-    items = get_object_or_404(MenuItem, pk=pk)
     if request.method == 'GET':
-        serializer = MenuItemSerializer(items)
-        return Response(serializer.data)
+        return Response(MENU_ITEM.one(get_object_or_404(MENU_ITEM.values(MenuItem.objects), pk=pk)))
+
+    items = get_object_or_404(MenuItem, pk=pk)
     
-    is_manager_or_superuser = request.user.groups.filter(name='Manager').exists() or request.user.is_superuser
+    is_manager_or_superuser = is_manager(request.user)
     
     if request.method == 'PUT':
         if is_manager_or_superuser:
@@ -75,12 +156,13 @@ def single_items(request, pk):
 
 @api_view(['GET', 'POST'])   
 @permission_classes([IsAuthenticated])
+@replica_reads
 def managers(request):
-    is_manager_or_superuser = request.user.groups.filter(name='Manager').exists() or request.user.is_superuser
+    is_manager_or_superuser = is_manager(request.user)
 
     if request.method == 'GET':
         if is_manager_or_superuser:
-            users = User.objects.filter(groups__name='Manager')
+            users = User.objects.filter(groups__name=MANAGER)
             serializer = UserSerializer(users, many=True)
             return Response(serializer.data)
         return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
@@ -91,9 +173,9 @@ def managers(request):
             if not user_id:
                 return Response({"detail": "User ID required"}, status=status.HTTP_400_BAD_REQUEST)
             user = get_object_or_404(User, pk=user_id) if user_id else get_object_or_404(User, username=user_name)
-            if user.groups.filter(name='Manager').exists():
+            if has_role(user, MANAGER):
                 return Response({"detail": "User already in manager group"}, status=status.HTTP_400_BAD_REQUEST)
-            manager_group = Group.objects.get(name='Manager')
+            manager_group = Group.objects.get(name=MANAGER)
             user.groups.add(manager_group)
             return Response({"detail": "User added to manager group"}, status=status.HTTP_201_CREATED)
         return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
@@ -101,13 +183,14 @@ def managers(request):
 
 @api_view(['GET', 'DELETE'])   
 @permission_classes([IsAuthenticated])
+@replica_reads
 def single_manager(request, pk):
     user = get_object_or_404(User, id=pk)
-    is_manager_or_superuser = request.user.groups.filter(name='Manager').exists() or request.user.is_superuser
+    is_manager_or_superuser = is_manager(request.user)
 
     if request.method == 'GET':
         if is_manager_or_superuser:
-            if not user.groups.filter(name='Manager').exists():
+            if not has_role(user, MANAGER):
                 return Response({"detail": "User not in manager group"}, status=status.HTTP_400_BAD_REQUEST)
             serializer = UserSerializer(user)
             return Response(serializer.data)
@@ -115,8 +198,8 @@ def single_manager(request, pk):
 
     if request.method == 'DELETE':
         if is_manager_or_superuser:
-            if user.groups.filter(name='Manager').exists():
-                manager_group = Group.objects.get(name='Manager')
+            if has_role(user, MANAGER):
+                manager_group = Group.objects.get(name=MANAGER)
                 user.groups.remove(manager_group)
                 return Response({"detail": "User removed from manager group"}, status=status.HTTP_204_NO_CONTENT)
             return Response({"detail": "User not in manager group"}, status=status.HTTP_400_BAD_REQUEST)
@@ -125,12 +208,13 @@ def single_manager(request, pk):
 
 @api_view(['GET', 'POST'])   
 @permission_classes([IsAuthenticated])
+@replica_reads
 def delivery_crew(request):
-    is_manager_or_superuser = request.user.groups.filter(name='Manager').exists() or request.user.is_superuser
+    is_manager_or_superuser = is_manager(request.user)
 
     if request.method == 'GET':
         if is_manager_or_superuser:
-            users = User.objects.filter(groups__name='Delivery Crew')
+            users = User.objects.filter(groups__name=DELIVERY_CREW)
             serializer = UserSerializer(users, many=True)
             return Response(serializer.data)
         return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
@@ -141,9 +225,9 @@ def delivery_crew(request):
             if not user_id:
                 return Response({"detail": "User ID required"}, status=status.HTTP_400_BAD_REQUEST)
             user = get_object_or_404(User, pk=user_id) if user_id else get_object_or_404(User, username=user_name)
-            if user.groups.filter(name='Delivery Crew').exists():
+            if has_role(user, DELIVERY_CREW):
                 return Response({"detail": "User already in delivery crew group"}, status=status.HTTP_400_BAD_REQUEST)
-            delivery_crew_group = Group.objects.get(name='Delivery Crew')
+            delivery_crew_group = Group.objects.get(name=DELIVERY_CREW)
             user.groups.add(delivery_crew_group)
             return Response({"detail": "User added to delivery crew group"}, status=status.HTTP_201_CREATED)
         return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
@@ -151,13 +235,14 @@ def delivery_crew(request):
 
 @api_view(['GET', 'DELETE'])   
 @permission_classes([IsAuthenticated])
+@replica_reads
 def single_delivery_crew(request, pk):
     user = get_object_or_404(User, id=pk)
-    is_manager_or_superuser = request.user.groups.filter(name='Manager').exists() or request.user.is_superuser
+    is_manager_or_superuser = is_manager(request.user)
 
     if request.method == 'GET':
         if is_manager_or_superuser:
-            if not user.groups.filter(name='Delivery Crew').exists():
+            if not has_role(user, DELIVERY_CREW):
                 return Response({"detail": "User not in delivery crew group"}, status=status.HTTP_400_BAD_REQUEST)
             serializer = UserSerializer(user)
             return Response(serializer.data)
@@ -165,8 +250,8 @@ def single_delivery_crew(request, pk):
 
     if request.method == 'DELETE':
         if is_manager_or_superuser:
-            if user.groups.filter(name='Delivery Crew').exists():
-                delivery_crew_group = Group.objects.get(name='Delivery Crew')
+            if has_role(user, DELIVERY_CREW):
+                delivery_crew_group = Group.objects.get(name=DELIVERY_CREW)
                 user.groups.remove(delivery_crew_group)
                 return Response({"detail": "User removed from delivery crew group"}, status=status.HTTP_204_NO_CONTENT)
             return Response({"detail": "User not in delivery crew group"}, status=status.HTTP_400_BAD_REQUEST)
@@ -175,39 +260,38 @@ def single_delivery_crew(request, pk):
 
 @api_view(['GET', 'POST', 'DELETE'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([CartThrottle])
+@replica_reads
+@idempotent
+@shed_writes
 def cart_menu_items(request):
     user = request.user
 
-    if request.user.groups.filter(name='Manager').exists() or request.user.is_superuser:
+    if is_manager(request.user):
         return Response({"detail": "Managers and Superusers are not allowed to access this endpoint."}, status=status.HTTP_403_FORBIDDEN)
 
     if request.method == 'GET':
-        cart_items = Cart.objects.select_related('menuitems').filter(user=user)
-        serializer = CartSerializer(cart_items, many=True)
-        return Response(serializer.data)
+        cart_items = CART.values(Cart.objects.filter(user=user))
+        return Response(CART.many(cart_items))
     
     if request.method == 'POST':
         menuitem_id = request.data.get('menuitems_id')
         menuitem = get_object_or_404(MenuItem, id=menuitem_id)
 
-        if Cart.objects.filter(user=user, menuitems=menuitem).exists():
-            return Response({"detail": "Item already in cart"}, status=status.HTTP_400_BAD_REQUEST)
-        quantity = int(request.data.get('quantity', 1))
+        try:
+            quantity = int(request.data.get('quantity', 1))
+        except (TypeError, ValueError):
+            return Response({"detail": "Quantity must be a whole number"}, status=status.HTTP_400_BAD_REQUEST)
         if quantity < 1:
             return Response({"detail": "Quantity must be at least 1"}, status=status.HTTP_400_BAD_REQUEST)
-        unit_price = round(menuitem.price, 2)
-        total_price = round(unit_price * quantity, 2)
-
-        serializer = CartSerializer(data={
-            'menuitems_id': menuitem.id,
-            'quantity': quantity,
-            'unit_price': unit_price,
-            'price': total_price
-        })
-        if serializer.is_valid():
-            serializer.save(user=user)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Adding an item that is already in the cart increments its quantity
+        try:
+            cart_item, created = add_to_cart(user, menuitem, quantity)
+        except CartChangeError as exc:
+            return Response(exc.errors, status=status.HTTP_400_BAD_REQUEST)
+        serializer = CartSerializer(cart_item)
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
     
     if request.method == 'DELETE':
         cart_items = Cart.objects.filter(user=request.user)
@@ -217,117 +301,256 @@ def cart_menu_items(request):
         return Response({"detail": "All cart items delcleraed successfully"}, status=status.HTTP_204_NO_CONTENT)
     
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([CartThrottle])
+@replica_reads
+@idempotent
+@shed_writes
+def cart_batch(request):
+    if is_manager(request.user):
+        return Response({"detail": "Managers and Superusers are not allowed to access this endpoint."}, status=status.HTTP_403_FORBIDDEN)
+
+    serializer = CartBatchSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        cart_items = apply_cart_changes(
+            request.user, serializer.validated_data['items'], replace=serializer.validated_data['replace'])
+    except CartChangeError as exc:
+        return Response({"items": exc.errors}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(CartSerializer(cart_items, many=True).data)
+
+
+def orders_queryset(user, query_params):
+    if is_manager(user):
+        # Managers: Return all orders
+        orders = Order.objects.prefetch_related(
+            Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('menuitem'))).all()
+        
+        order_status = query_params.get('status')
+        if order_status == 'delivered':
+            orders = orders.filter(status=True)
+        elif order_status == 'pending':
+            orders = orders.filter(status=False)
+    elif is_delivery_crew(user):
+        # Delivery crew: Return all orders assigned to this crew member
+        orders = Order.objects.prefetch_related(
+            Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('menuitem'))
+            ).filter(delivery_crew=user, status=False)
+    else:
+        # Customers: Return orders created by this user
+        orders = Order.objects.prefetch_related(
+        Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('menuitem'))).filter(user=user)
+    return orders
+
+
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([CheckoutThrottle])
+@replica_reads
+@idempotent
+@shed_writes
 def orders(request):
     user = request.user
     perpage = request.query_params.get('perpage', default=10)
     page = request.query_params.get('page', default=1)
 
     if request.method == 'GET':
-        if user.groups.filter(name='Manager').exists() or user.is_superuser:
-            # Managers: Return all orders
-            orders = Order.objects.prefetch_related(
-                Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('menuitem'))).all()
-            
-            order_status = request.query_params.get('status')
-            if order_status == 'delivered':
-                orders = orders.filter(status=True)
-            elif order_status == 'pending':
-                orders = orders.filter(status=False)
-        elif user.groups.filter(name='Delivery Crew').exists():
-            # Delivery crew: Return all orders assigned to this crew member
-            orders = Order.objects.prefetch_related(
-                Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('menuitem'))
-                ).filter(delivery_crew=user, status=False)
-        else:
-            # Customers: Return orders created by this user
-            orders = Order.objects.prefetch_related(
-            Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('menuitem'))).filter(user=user)
+        orders = ORDER.values(orders_queryset(user, request.query_params))
+        archived = archive.archived_queryset(user, request.query_params)
 
+        if 'cursor' in request.query_params:
+            # Keyset pagination on (date, id): no COUNT(*) and no OFFSET
+            key = ORDER.key(('date', 'id'))
+            if archived is None:
+                orders, next_cursor, previous_cursor = keyset_page(
+                    orders, ('date', 'id'), request.query_params['cursor'], perpage, key=key)
+            else:
+                # A page from each table, merged
+                queries, state = keyset_queries(
+                    [orders, ORDER.values(archived)], ('date', 'id'), request.query_params['cursor'], perpage)
+                orders, next_cursor, previous_cursor = keyset_merged([list(query) for query in queries], state, key)
+            return Response(cursor_response_data(
+                representations.orders(orders, archived is not None), next_cursor, previous_cursor))
+
+        if archived is not None:
+            orders = orders.union(ORDER.values(archived), all=True).order_by('date', 'id')
         # Apply pagination to the orders
         paginator = Paginator(orders, per_page=perpage)
         try:
             orders = paginator.page(number=page)
         except EmptyPage:
             orders = []
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        return Response(representations.orders(orders, archived is not None))
     
     if request.method == 'POST':
-        if not user.groups.filter(name__in=['Manager', 'Delivery Crew']).exists() and not user.is_superuser:
-            # Get the cart items for this user
-            cart_items = Cart.objects.filter(user=user)
-            if not cart_items.exists():
+        if is_customer(user):
+            # Create the order from the cart items and clear the cart in one transaction
+            try:
+                checkout(user)
+            except EmptyCartError:
                 return Response({"detail": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Create a new order for the user
-            order = Order.objects.create(user=user, total=0)
+            return Response({"detail": "Order created successfully"}, status=status.HTTP_201_CREATED)
+        return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
+    
 
-            total_price = 0
-            # Create order items from the cart items
-            for item in cart_items:
-                order_item = OrderItem.objects.create(
-                    order=order,
-                    menuitem=item.menuitems,
-                    quantity=item.quantity,
-                    unit_price=item.unit_price,
-                    price=item.price
-                )
-                total_price += order_item.price
+def date_range(query_params):
+    """Parse the optional inclusive ?start= and ?end= dates."""
+    days = []
+    for param in ('start', 'end'):
+        value = query_params.get(param)
+        try:
+            day = parse_date(value) if value else None
+        except ValueError:
+            day = None
+        if value and day is None:
+            raise ParseError(f"Invalid {param} date, use YYYY-MM-DD")
+        days.append(day)
+    return days
 
-            # Update the total price of the order
-            order.total = total_price
-            order.save()
 
-            # Clear the cart after creating the order
-            cart_items.delete()
+def day_start(value):
+    return timezone.make_aware(datetime.datetime.combine(value, datetime.time.min))
 
-            return Response({"detail": "Order created successfully"}, status=status.HTTP_201_CREATED)
-        return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsManager])
+@renderer_classes([NDJSONRenderer, CSVRenderer])
+def orders_export(request):
+    orders = Order.objects.all()
+
+    order_status = request.query_params.get('status')
+    if order_status == 'delivered':
+        orders = orders.filter(status=True)
+    elif order_status == 'pending':
+        orders = orders.filter(status=False)
+
+    # Inclusive date range, filtered as a datetime range so the date index is used
+    start, end = date_range(request.query_params)
+    if start:
+        orders = orders.filter(date__gte=day_start(start))
+    if end:
+        orders = orders.filter(date__lt=day_start(end + datetime.timedelta(days=1)))
+
+    renderer = request.accepted_renderer
+    rows = exports.csv_rows(orders) if renderer.format == 'csv' else exports.ndjson_rows(orders)
+    response = StreamingHttpResponse(rows, content_type=f'{renderer.media_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="orders.{renderer.format}"'
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, IsDeliveryCrew])
+@replica_reads
+def next_order(request):
+    # Delivery crew: claim the oldest unassigned pending order
+    order_id = dispatch.claim_next(request.user)
+    if order_id is None:
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    order = ORDER.one(ORDER.values(Order.objects).get(pk=order_id))
+    return Response(representations.with_items([order])[0])
     
 
 @api_view(['GET', 'PUT', 'PATCH', 'DELETE'])
 @permission_classes([IsAuthenticated])
+@replica_reads
 def single_order(request, pk):
     user = request.user
-    order = get_object_or_404(
-    Order.objects.prefetch_related('orderitem_set__menuitem').select_related('user', 'delivery_crew'), pk=pk)
     # Check if the user is allowed to access this order
     if request.method == 'GET':
+        order = ORDER.values(Order.objects).filter(pk=pk).first()
+        if order is None and archive.requested(request.query_params):
+            order = ORDER.values(ArchivedOrder.objects).filter(pk=pk).first()
+        if order is None:
+            return Response({"detail": "No Order matches the given query."}, status=status.HTTP_404_NOT_FOUND)
+        order = ORDER.one(order)
         # Customers: Only access their own orders
-        if not user.groups.filter(name__in=['Manager', 'Delivery Crew']).exists() and not user.is_superuser:
-            if order.user != user:
+        if is_customer(user):
+            if order['user'] != user.pk:
                 return Response({"detail": "Not authorized to view this order"}, status=status.HTTP_403_FORBIDDEN)
         # Delivery Crew: Only access orders assigned to them
-        elif user.groups.filter(name='Delivery Crew').exists():
-            if order.delivery_crew != user:
+        elif is_delivery_crew(user):
+            if order['delivery_crew'] != user.pk:
                 return Response({"detail": "Not authorized to view this order"}, status=status.HTTP_403_FORBIDDEN)
-        serializer = OrderSerializer(order)
-        return Response(serializer.data)
-    
-    elif request.method in ['PUT', 'PATCH']:
-        if user.groups.filter(name='Manager').exists() or user.is_superuser:
+        return Response(representations.with_items([order], archive.requested(request.query_params))[0])
+
+    # Locked: concurrent changes to the same order must each see the other's
+    # status, or the rollups would count a delivery (or deletion) twice
+    locked = Order.objects.select_for_update().prefetch_related('orderitem_set__menuitem')
+    if request.method in ['PUT', 'PATCH']:
+        if is_manager(user):
             # Managers: Can update delivery crew and status
-            serializer = OrderSerializer(order, data=request.data, partial=True)
-            if serializer.is_valid():
+            with transaction.atomic():
+                order = get_object_or_404(locked, pk=pk)
+                serializer = OrderSerializer(order, data=request.data, partial=True)
+                if not serializer.is_valid():
+                    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+                was_delivered, was_crew = order.status, order.delivery_crew_id
                 serializer.save()
-                return Response(serializer.data)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+                rollups.record_status_change(order, was_delivered)
+                if order.status != was_delivered or order.delivery_crew_id != was_crew:
+                    events.publish_order_change(order, was_crew)
+            return Response(serializer.data)
         
-        elif user.groups.filter(name='Delivery Crew').exists():
+        elif is_delivery_crew(user):
             # Delivery Crew: Can only update order status
             if 'status' not in request.data:
                 return Response({"detail": "Only status can be updated by delivery crew"}, status=status.HTTP_400_BAD_REQUEST)
-            order.status = request.data['status']
-            order.save()
+            with transaction.atomic():
+                order = get_object_or_404(locked, pk=pk)
+                was_delivered = order.status
+                order.status = Order._meta.get_field('status').to_python(request.data['status'])
+                order.save()
+                rollups.record_status_change(order, was_delivered)
+                if order.status != was_delivered:
+                    events.publish_order_change(order, order.delivery_crew_id)
             return Response({"detail": "Order status updated successfully"}, status=status.HTTP_200_OK)
         else:
             return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
     elif request.method == 'DELETE':
-        if user.groups.filter(name='Manager').exists() or user.is_superuser:
+        if is_manager(user):
             # Managers can delete orders
-            order.delete()
+            with transaction.atomic():
+                order = get_object_or_404(locked, pk=pk)
+                rollups.unrecord_order(order, [
+                    (item.menuitem_id, item.quantity, item.price) for item in order.orderitem_set.all()
+                ])
+                order.delete()
             return Response({"detail": "Order deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
         return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
-    
\ No newline at end of file
+    
+    
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsManager])
+@replica_reads
+def sales_report(request):
+    # Reads only the rollup tables, never Order/OrderItem
+    start, end = date_range(request.query_params)
+    days = DailySales.objects.order_by('date')
+    items = ItemSales.objects.all()
+    if start:
+        days = days.filter(date__gte=start)
+        items = items.filter(date__gte=start)
+    if end:
+        days = days.filter(date__lte=end)
+        items = items.filter(date__lte=end)
+
+    totals = days.aggregate(orders=Sum('orders'), delivered=Sum('delivered'), revenue=Sum('revenue'))
+    items = (items.values('menuitem_id', 'menuitem__title')
+             .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'))
+             .order_by('-revenue', 'menuitem_id'))
+    return Response({
+        "totals": SalesTotalsSerializer({key: value or 0 for key, value in totals.items()}).data,
+        "days": DailySalesSerializer(days, many=True).data,
+        "items": ItemSalesReportSerializer(items, many=True).data,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsManager])
+def metrics(request):
+    # Prometheus text format; scrape with a manager's token
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
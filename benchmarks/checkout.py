@@ -0,0 +1,51 @@
+"""
+Checkout cost as the cart grows.
+
+    python -m benchmarks.checkout [--repeat N]
+
+The number of queries should stay flat from 1 to 200 cart lines; latency
+should only grow with the bytes written, not with extra round trips.
+"""
+import argparse
+from decimal import Decimal
+
+from .common import setup_django, measure, summarize, print_table
+
+CART_SIZES = [1, 10, 50, 100, 200]
+
+
+def run(repeat):
+    from django.contrib.auth.models import User
+    from LittleLemonAPI.models import Category, MenuItem, Cart
+    from LittleLemonAPI.services import checkout
+
+    category = Category.objects.create(title='Bench', slug='bench')
+    menu = MenuItem.objects.bulk_create([
+        MenuItem(title=f'Item {i}', price=Decimal('4.50'), featured=False, category=category)
+        for i in range(max(CART_SIZES))
+    ])
+    user = User.objects.create_user('bench-customer')
+
+    rows = []
+    for size in CART_SIZES:
+        timings, queries = [], set()
+        for _ in range(repeat):
+            Cart.objects.bulk_create([
+                Cart(user=user, menuitems=item, quantity=2, unit_price=item.price, price=2 * item.price)
+                for item in menu[:size]
+            ])
+            with measure() as result:
+                checkout(user)
+            timings.append(result['ms'])
+            queries.add(result['queries'])
+        stats = summarize(timings)
+        rows.append((size, ','.join(map(str, sorted(queries))), stats['median_ms'], stats['p95_ms']))
+    print_table(['cart lines', 'queries', 'median ms', 'p95 ms'], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    setup_django()
+    run(args.repeat)
@@ -0,0 +1,54 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks run against a throwaway test database, never ``db.sqlite3``:
+
+    python -m benchmarks.checkout
+"""
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+
+def setup_django(create_db=True):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LittleLemon.settings')
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import override_settings, setup_test_environment
+    setup_test_environment()
+    # Measure the endpoints, not the write limits in front of them
+    override_settings(LITTLELEMON_THROTTLE=None, LITTLELEMON_LOAD_SHEDDING=None).enable()
+    if create_db:
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+
+
+@contextmanager
+def measure():
+    """Yield a dict that is filled with the wall time (ms) and query count of the block."""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    result = {}
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        yield result
+        result['ms'] = (time.perf_counter() - start) * 1000
+    result['queries'] = len(ctx.captured_queries)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+    }
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    print('  '.join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print('  '.join(str(c).ljust(w) for c, w in zip(row, widths)))
@@ -0,0 +1,134 @@
+"""
+Checkout throughput with parallel writers.
+
+    python -m benchmarks.concurrency [--writers 8] [--duration 5]
+    LITTLELEMON_DATABASE=postgresql python -m benchmarks.concurrency
+
+Each writer thread is a customer that fills its cart and checks out in a
+loop, closing old connections between iterations like a request cycle does.
+The database profile from ``LittleLemon/databases.py`` is compared with a
+baseline:
+
+* SQLite: a rollback journal with deferred transactions (Django's
+  defaults) vs. the WAL profile. SQLite runs on a temporary file, since
+  an in-memory database can't show file locking.
+* PostgreSQL: a new connection per request (``CONN_MAX_AGE=0``) vs. the
+  persistent or pooled profile.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from .common import setup_django, summarize, print_table
+
+
+def baseline(settings_dict):
+    if settings_dict['ENGINE'].endswith('sqlite3'):
+        return 'rollback journal', {
+            **settings_dict,
+            'OPTIONS': {'init_command': 'PRAGMA journal_mode=DELETE'},
+            'CONN_MAX_AGE': 0,
+        }
+    return 'reconnect per request', {
+        **settings_dict,
+        'OPTIONS': {key: value for key, value in settings_dict['OPTIONS'].items() if key != 'pool'},
+        'CONN_MAX_AGE': 0,
+    }
+
+
+def use_profile(profile, workdir, label):
+    """Point the default connection at ``profile`` and create a fresh test database for it."""
+    from django.db import connections
+
+    connections.close_all()
+    settings_dict = connections.settings['default']
+    settings_dict.clear()
+    settings_dict.update(profile)
+    if settings_dict['ENGINE'].endswith('sqlite3'):
+        settings_dict['TEST'] = {**settings_dict['TEST'], 'NAME': os.path.join(workdir, f'{label}.sqlite3')}
+    connections['default'].creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+
+
+def seed(writers):
+    from django.contrib.auth.models import User
+    from LittleLemonAPI.models import Category, MenuItem
+
+    category = Category.objects.create(title='Bench', slug='bench')
+    menu = MenuItem.objects.bulk_create([
+        MenuItem(title=f'Item {i}', price=Decimal('4.50'), featured=False, category=category)
+        for i in range(10)
+    ])
+    users = [User.objects.create_user(f'bench-writer-{i}') for i in range(writers)]
+    return menu, users
+
+
+def writer(user, menu, deadline, latencies, errors):
+    from django.db import close_old_connections, connections
+    from django.db.utils import OperationalError
+    from LittleLemonAPI.models import Cart
+    from LittleLemonAPI.services import checkout
+
+    while time.perf_counter() < deadline:
+        close_old_connections()
+        start = time.perf_counter()
+        try:
+            # ignore_conflicts: lines left behind by a failed checkout are reused
+            Cart.objects.bulk_create([
+                Cart(user=user, menuitems=item, quantity=1, unit_price=item.price, price=item.price)
+                for item in menu[:3]
+            ], ignore_conflicts=True)
+            checkout(user)
+        except OperationalError as exc:
+            errors[str(exc).splitlines()[0][:60]] += 1
+        else:
+            latencies.append((time.perf_counter() - start) * 1000)
+    connections.close_all()
+
+
+def run_profile(writers, duration):
+    menu, users = seed(writers)
+    latencies, errors = [], Counter()
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=writer, args=(user, menu, deadline, latencies, errors))
+        for user in users
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def main(writers, duration):
+    from django.db import connections
+
+    profile = dict(connections.settings['default'])
+    baseline_label, baseline_profile = baseline(profile)
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for label, settings_dict in ((baseline_label, baseline_profile), ('tuned profile', profile)):
+            use_profile(settings_dict, workdir, label.replace(' ', '-'))
+            latencies, errors = run_profile(writers, duration)
+            stats = summarize(latencies) if latencies else {'median_ms': '-', 'p95_ms': '-'}
+            rows.append((
+                label, len(latencies), round(len(latencies) / duration, 1),
+                stats['median_ms'], stats['p95_ms'],
+                ', '.join(f'{count}x {message}' for message, count in errors.items()) or '-',
+            ))
+        connections.close_all()
+    print(f"{connections['default'].vendor}, {writers} writers, {duration}s each")
+    print_table(['profile', 'checkouts', 'per second', 'median ms', 'p95 ms', 'errors'], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5)
+    args = parser.parse_args()
+    setup_django(create_db=False)
+    main(args.writers, args.duration)
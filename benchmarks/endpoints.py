@@ -0,0 +1,254 @@
+"""
+Query counts, latency and allocations for every API route.
+
+    python -m benchmarks.endpoints [--scales 1 10] [--repeat N] [--json results.json]
+
+Seeds a menu, customers with carts and orders with many items, a delivery
+crew and a manager at each scale, then calls every route in
+``LittleLemonAPI/urls.py`` as each role that can use it. Listings are
+requested with a page size large enough to return everything, so result
+size grows with the scale.
+
+For each call we record the queries of a cold request (all process caches
+cleared), the median/p95 wall time of warm requests and the peak memory
+allocated by one request. The script exits with status 1 when any call
+issues more queries at a larger scale, which is how N+1 regressions show up.
+"""
+import argparse
+import json
+import sys
+import tracemalloc
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from .common import setup_django, measure, summarize, print_table
+
+BASE = {
+    'menu': 20,
+    'customers': 3,
+    'crew': 2,
+    'orders_per_customer': 5,
+    'items_per_order': 3,
+    'cart_lines': 3,
+}
+PERPAGE = 100_000
+
+
+def seed(scale):
+    """Create a data set ``scale`` times the base size; return the objects scenarios need."""
+    from django.contrib.auth.models import User, Group
+    from rest_framework.authtoken.models import Token
+    from LittleLemonAPI.models import Category, MenuItem, Cart, Order, OrderItem
+    from LittleLemonAPI.roles import MANAGER, DELIVERY_CREW
+    from LittleLemonAPI import rollups, search
+
+    sizes = {name: count * scale for name, count in BASE.items()}
+    manager_group = Group.objects.create(name=MANAGER)
+    crew_group = Group.objects.create(name=DELIVERY_CREW)
+
+    category = Category.objects.create(title='Bench', slug='bench')
+    menu = MenuItem.objects.bulk_create([
+        MenuItem(title=f'Lemon Dish {i}', price=Decimal('4.50') + i % 10, featured=False, category=category)
+        for i in range(sizes['menu'])
+    ])
+    search.rebuild_index()
+
+    manager = User.objects.create_user('bench-manager')
+    manager.groups.add(manager_group)
+    crew = [User.objects.create_user(f'bench-crew-{i}') for i in range(sizes['crew'])]
+    crew_group.user_set.add(*crew)
+    customers = [User.objects.create_user(f'bench-customer-{i}') for i in range(sizes['customers'])]
+
+    start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+    orders = Order.objects.bulk_create([
+        Order(user=customer, delivery_crew=crew[i % len(crew)], status=False, total=0,
+              date=start + timedelta(hours=i))
+        for customer in customers
+        for i in range(sizes['orders_per_customer'])
+    ])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, menuitem=menu[(order.pk + j) % len(menu)], quantity=2,
+                  unit_price=menu[(order.pk + j) % len(menu)].price,
+                  price=2 * menu[(order.pk + j) % len(menu)].price)
+        for order in orders
+        for j in range(sizes['items_per_order'])
+    ], batch_size=2000)
+    rollups.rebuild(Order.objects.all())
+
+    for customer in customers:
+        Cart.objects.bulk_create([
+            Cart(user=customer, menuitems=item, quantity=1, unit_price=item.price, price=item.price)
+            for item in menu[:sizes['cart_lines']]
+        ])
+
+    tokens = {
+        'customer': Token.objects.create(user=customers[0]).key,
+        'crew': Token.objects.create(user=crew[0]).key,
+        'manager': Token.objects.create(user=manager).key,
+    }
+    customer_order = Order.objects.filter(user=customers[0]).order_by('id').first()
+    return {
+        'sizes': sizes,
+        'tokens': tokens,
+        'menu': menu,
+        'customer': customers[0],
+        'crew': crew[0],
+        'manager': manager,
+        'order': customer_order,
+    }
+
+
+def scenarios(data):
+    """``(name, role, method, path, body, setup)`` for every route and role."""
+    menu, order, crew = data['menu'], data['order'], data['crew']
+    item = menu[0]
+    batch = {'items': [{'menuitems_id': m.id, 'quantity': 1, 'op': 'set'} for m in menu[:data['sizes']['cart_lines']]]}
+
+    def refill_cart():
+        from LittleLemonAPI.models import Cart
+        Cart.objects.bulk_create([
+            Cart(user=data['customer'], menuitems=m, quantity=1, unit_price=m.price, price=m.price)
+            for m in menu[:data['sizes']['cart_lines']]
+        ], ignore_conflicts=True)
+
+    def queue_order():
+        from LittleLemonAPI.models import Order
+        Order.objects.create(user=data['customer'], total=item.price)
+
+    rows = []
+    for role in ('customer', 'crew', 'manager'):
+        rows += [
+            ('menu list', role, 'get', f'/api/menu-items?perpage={PERPAGE}', None, None),
+            ('menu cursor', role, 'get', f'/api/menu-items?cursor=&perpage={PERPAGE}', None, None),
+            ('menu search', role, 'get', f'/api/menu-items?search=Dish&perpage={PERPAGE}', None, None),
+            ('menu item', role, 'get', f'/api/menu-items/{item.id}', None, None),
+            ('orders list', role, 'get', f'/api/orders?perpage={PERPAGE}', None, None),
+            ('orders cursor', role, 'get', f'/api/orders?cursor=&perpage={PERPAGE}', None, None),
+            ('order detail', role, 'get', f'/api/orders/{order.id}', None, None),
+        ]
+    rows += [
+        ('cart list', 'customer', 'get', '/api/cart/menu-items', None, None),
+        ('cart add', 'customer', 'post', '/api/cart/menu-items', {'menuitems_id': item.id, 'quantity': 1}, None),
+        ('cart batch', 'customer', 'post', '/api/cart/menu-items/batch', batch, None),
+        ('checkout', 'customer', 'post', '/api/orders', None, refill_cart),
+        ('order status', 'crew', 'patch', f'/api/orders/{order.id}', {'status': False}, None),
+        ('order assign', 'manager', 'patch', f'/api/orders/{order.id}', {'delivery_crew': crew.id}, None),
+        ('next order', 'crew', 'post', '/api/orders/next', None, queue_order),
+        ('orders export', 'manager', 'get', '/api/orders/export?format=ndjson', None, None),
+        ('sales report', 'manager', 'get', '/api/reports/sales', None, None),
+        ('managers', 'manager', 'get', '/api/groups/manager/users', None, None),
+        ('manager detail', 'manager', 'get', f'/api/groups/manager/users/{data["manager"].id}', None, None),
+        ('crew list', 'manager', 'get', '/api/groups/delivery-crew/users', None, None),
+        ('crew detail', 'manager', 'get', f'/api/groups/delivery-crew/users/{crew.id}', None, None),
+    ]
+    return rows
+
+
+def clear_caches():
+    from django.core.cache import cache
+    from LittleLemonAPI.authentication import token_cache
+    from LittleLemonAPI.roles import invalidate_roles
+    cache.clear()
+    invalidate_roles()
+    token_cache().clear()
+
+
+def call(client, method, path, body):
+    response = getattr(client, method)(path, body, format='json')
+    if getattr(response, 'streaming', False):
+        b''.join(response.streaming_content)
+    assert response.status_code < 400, (method, path, response.status_code)
+    return response
+
+
+def run_scale(scale, repeat):
+    from django.core.management import call_command
+    from rest_framework.test import APIClient
+
+    call_command('flush', interactive=False, verbosity=0)
+    clear_caches()
+    data = seed(scale)
+    clients = {}
+    for role, key in data['tokens'].items():
+        clients[role] = APIClient()
+        clients[role].credentials(HTTP_AUTHORIZATION=f'Token {key}')
+
+    results = {}
+    for name, role, method, path, body, setup in scenarios(data):
+        client = clients[role]
+        if setup:
+            setup()
+        clear_caches()
+        with measure() as cold:
+            call(client, method, path, body)
+
+        timings = []
+        for _ in range(repeat):
+            if setup:
+                setup()
+            with measure() as warm:
+                call(client, method, path, body)
+            timings.append(warm['ms'])
+
+        if setup:
+            setup()
+        tracemalloc.start()
+        call(client, method, path, body)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[f'{name} ({role})'] = {
+            'method': method.upper(),
+            'path': path.split('?')[0],
+            'queries': cold['queries'],
+            'warm_queries': warm['queries'],
+            'peak_kb': round(peak / 1024, 1),
+            **summarize(timings),
+        }
+    return {'sizes': data['sizes'], 'results': results}
+
+
+def regressions(runs):
+    """Calls whose cold query count grows with the scale."""
+    found = []
+    scales = sorted(runs)
+    for name in runs[scales[0]]['results']:
+        counts = [runs[scale]['results'][name]['queries'] for scale in scales]
+        if any(later > earlier for earlier, later in zip(counts, counts[1:])):
+            found.append((name, counts))
+    return found
+
+
+def main(scales, repeat, json_path=None):
+    runs = {scale: run_scale(scale, repeat) for scale in scales}
+    largest = max(scales)
+    rows = []
+    for name, result in runs[largest]['results'].items():
+        counts = '/'.join(str(runs[scale]['results'][name]['queries']) for scale in sorted(scales))
+        rows.append((name, counts, result['warm_queries'], result['median_ms'], result['p95_ms'], result['peak_kb']))
+    print(f"scales {sorted(scales)}; timings and allocations at scale {largest}")
+    print_table(['call', 'cold queries', 'warm queries', 'median ms', 'p95 ms', 'peak KB'], rows)
+
+    found = regressions(runs)
+    if json_path:
+        report = {
+            'scales': {str(scale): run for scale, run in runs.items()},
+            'regressions': [{'call': name, 'queries': counts} for name, counts in found],
+        }
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    for name, counts in found:
+        print(f"query count grows with scale: {name} {counts}", file=sys.stderr)
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--json', dest='json_path', help="write machine-readable results to this file")
+    args = parser.parse_args()
+    if len(set(args.scales)) < 2:
+        parser.error("need at least two different scales to compare query counts")
+    setup_django()
+    sys.exit(main(args.scales, args.repeat, args.json_path))
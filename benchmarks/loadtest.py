@@ -0,0 +1,140 @@
+"""
+HTTP load test for comparing WSGI and ASGI deployments.
+
+Start the same code base both ways, for example:
+
+    gunicorn LittleLemon.wsgi -w 4 --threads 32 -b 127.0.0.1:8000
+    LITTLELEMON_ASYNC_VIEWS=1 uvicorn LittleLemon.asgi:application --workers 4 --port 8001
+
+then drive both with the same number of concurrent keep-alive clients:
+
+    python -m benchmarks.loadtest /api/menu-items \\
+        --target wsgi=http://127.0.0.1:8000 --target asgi=http://127.0.0.1:8001 \\
+        --concurrency 500 --duration 30 [--token TOKEN] [--json results.json]
+
+The client is plain asyncio with no third-party dependencies, and does not
+need Django settings.
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+from .common import print_table
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        headers['connection'] = 'close'
+    return status, headers.get('connection', '').lower() == 'close'
+
+
+async def client(host, port, request, deadline, stats):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, close = await read_response(reader)
+            stats.latencies.append(time.perf_counter() - start)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            if close:
+                writer.close()
+                writer = None
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            stats.errors += 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.01)
+    if writer is not None:
+        writer.close()
+
+
+async def run_target(base_url, path, concurrency, duration, token):
+    url = urlsplit(base_url)
+    host, port = url.hostname, url.port or 80
+    headers = [f'GET {path} HTTP/1.1', f'Host: {url.netloc}', 'Accept: application/json', 'Connection: keep-alive']
+    if token:
+        headers.append(f'Authorization: Token {token}')
+    request = ('\r\n'.join(headers) + '\r\n\r\n').encode()
+
+    stats = Stats()
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(client(host, port, request, deadline, stats) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(stats.latencies)
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2) if latencies else None
+
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': percentile(0.50),
+        'p99_ms': percentile(0.99),
+        'errors': stats.errors,
+        'statuses': stats.statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help="Request path, e.g. /api/menu-items?perpage=20")
+    parser.add_argument('--target', action='append', required=True, help="label=base URL, repeatable")
+    parser.add_argument('--concurrency', type=int, default=500)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--token', help="Auth token for endpoints that need a user")
+    parser.add_argument('--json', help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for target in args.target:
+        label, _, base_url = target.partition('=')
+        results[label] = asyncio.run(run_target(base_url, args.path, args.concurrency, args.duration, args.token))
+
+    print_table(
+        ['target', 'requests', 'req/s', 'p50 ms', 'p99 ms', 'errors', 'statuses'],
+        [(label, r['requests'], r['rps'], r['p50_ms'], r['p99_ms'], r['errors'], r['statuses'])
+         for label, r in results.items()])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'path': args.path, 'concurrency': args.concurrency, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Bulk menu import and export.
+
+    python -m benchmarks.menu_import [--rows 100000] [--categories 50]
+
+Imports a generated CSV menu into an empty table, imports it again
+unchanged, then with every price changed, and streams it back out.
+"""
+import argparse
+import io
+from decimal import Decimal
+
+from .common import setup_django, measure, print_table
+
+
+def menu_csv(rows, categories, price):
+    buffer = io.StringIO()
+    buffer.write('title,price,featured,category\n')
+    for i in range(rows):
+        buffer.write(f'Item {i},{price + i % 100},{i % 7 == 0},Category {i % categories}\n')
+    return buffer.getvalue()
+
+
+def run(rows, categories):
+    from django.db import reset_queries
+    from LittleLemonAPI import exports, imports
+    from LittleLemonAPI.models import MenuItem
+
+    new_menu = menu_csv(rows, categories, Decimal('4.50'))
+    table = []
+    for label, body in (('import new', new_menu),
+                        ('import unchanged', new_menu),
+                        ('import new prices', menu_csv(rows, categories, Decimal('5.25')))):
+        reset_queries()
+        with measure() as result:
+            report = imports.import_menu(*reversed(imports.read_rows(io.StringIO(body), 'csv')))
+        table.append((label, rows, round(result['ms']), result['queries'],
+                      f"{report['created']} created, {report['updated']} updated, {report['unchanged']} unchanged"))
+    reset_queries()
+    with measure() as result:
+        size = sum(len(row) for row in exports.menu_csv_rows(MenuItem.objects.all()))
+    table.append(('export csv', rows, round(result['ms']), result['queries'], f'{size // 1024} KB'))
+    print_table(['step', 'rows', 'ms', 'queries', 'result'], table)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--categories', type=int, default=50)
+    args = parser.parse_args()
+    setup_django()
+    run(args.rows, args.categories)
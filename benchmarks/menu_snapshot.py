@@ -0,0 +1,91 @@
+"""
+Filtered menu reads from SQL vs. the in-process menu snapshot.
+
+    python -m benchmarks.menu_snapshot [--items 200 2000 10000] [--repeat N]
+
+Times ``views.menu_page`` (what a ``menu_items`` GET builds on a response
+cache miss) for typical filter combinations, with ``LITTLELEMON_MENU_SNAPSHOT``
+off and on, plus the time to load a snapshot after a menu change. The
+snapshot is timed against the configured ``CACHES`` (the database cache
+unless ``REDIS_URL`` is set), with the per-process version check and with
+the version read from that cache on every call
+(``LITTLELEMON_MENU_LOCAL_CACHE=None``).
+"""
+import argparse
+import random
+from decimal import Decimal
+
+from .common import setup_django, measure, summarize, print_table
+
+WORDS = ['lemon', 'chocolate', 'cake', 'grilled', 'salmon', 'greek', 'salad', 'bruschetta',
+         'pasta', 'pesto', 'spicy', 'chicken', 'vegan', 'burger', 'tart', 'iced', 'tea']
+CATEGORIES = ['Starters', 'Mains', 'Desserts', 'Drinks', 'Specials']
+PARAMS = ['', 'category=Mains', 'price=12', 'category=Desserts&price=8', 'search=lem',
+          'search=chocolate cake&category=Desserts', 'cursor=&perpage=10&category=Drinks&price=20']
+
+
+def seed(count):
+    from django.core.management import call_command
+    from LittleLemonAPI.models import Category, MenuItem
+    from LittleLemonAPI import search
+
+    call_command('flush', interactive=False, verbosity=0)
+    rng = random.Random(42)
+    categories = [Category.objects.create(title=title, slug=title.lower()) for title in CATEGORIES]
+    MenuItem.objects.bulk_create((
+        MenuItem(title=f'{" ".join(rng.sample(WORDS, 3)).title()} #{i}',
+                 price=Decimal(rng.randrange(200, 3000)) / 100, featured=False, category=rng.choice(categories))
+        for i in range(count)
+    ), batch_size=5000)
+    search.rebuild_index()
+
+
+def run(count, repeat):
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.http import QueryDict
+    from django.test import override_settings
+    from LittleLemonAPI import snapshot, views
+
+    rows = []
+    with override_settings(LITTLELEMON_MENU_SNAPSHOT={'MAX_ITEMS': count}):
+        cache.clear()
+        with measure() as build:
+            snapshot.get_snapshot()
+        rows.append((count, '(load snapshot)', '-', '-', round(build['ms'], 3), build['queries'], '-', '-'))
+        for params in PARAMS:
+            query = QueryDict(params)
+            results = {}
+            local = settings.LITTLELEMON_MENU_LOCAL_CACHE
+            for label, options, local_cache in (('sql', None, local), ('snapshot', {'MAX_ITEMS': count}, local),
+                                                ('uncached version', {'MAX_ITEMS': count}, None)):
+                with override_settings(LITTLELEMON_MENU_SNAPSHOT=options, LITTLELEMON_MENU_LOCAL_CACHE=local_cache):
+                    views.menu_page(query)
+                    timings = []
+                    for _ in range(repeat):
+                        with measure() as result:
+                            views.menu_page(query)
+                        timings.append(result['ms'])
+                    results[label] = (summarize(timings)['median_ms'], result['queries'])
+            rows.append((count, params or '(none)', *results['sql'], *results['snapshot'], *results['uncached version']))
+    return rows
+
+
+def main(sizes, repeat):
+    rows = []
+    for count in sizes:
+        seed(count)
+        rows += run(count, repeat)
+    from django.core.cache import caches
+    print(f'cache: {type(caches["default"]).__name__}')
+    print_table(['items', 'params', 'sql ms', 'sql queries', 'snapshot ms', 'snapshot queries',
+                 'uncached version ms', 'uncached version queries'], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, nargs='+', default=[200, 2000, 10_000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    setup_django()
+    main(args.items, args.repeat)
@@ -0,0 +1,78 @@
+"""
+JSON rendering and parsing of large order pages.
+
+    python -m benchmarks.rendering [--pages 100 1000 5000] [--items 5] [--repeat N]
+
+Renders ``orders`` pages shaped like the API response with DRF's
+``JSONRenderer`` and with ``FastJSONRenderer``. It also renders the raw
+``Decimal``/``datetime`` values (the encoder's fallback path) and parses the
+rendered page back with both parsers.
+"""
+import argparse
+import io
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from .common import setup_django, measure, summarize, print_table
+
+
+def order_page(count, items_per_order, raw):
+    from LittleLemonAPI.exports import format_decimal, format_datetime
+
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    decimal = (lambda value: value) if raw else format_decimal
+    date = (lambda value: value) if raw else format_datetime
+    return [{
+        'id': i,
+        'user': i % 50,
+        'delivery_crew': None if i % 3 else 7,
+        'status': bool(i % 2),
+        'total': decimal(Decimal('22.45')),
+        'date': date(start + timedelta(minutes=i, microseconds=123456)),
+        'orderitem_set': [{
+            'id': i * items_per_order + j,
+            'menuitem': f'Lemon Dessert {j}',
+            'quantity': 2,
+            'unit_price': decimal(Decimal('4.49')),
+            'price': decimal(Decimal('8.98')),
+        } for j in range(items_per_order)],
+    } for i in range(count)]
+
+
+def median_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        with measure() as result:
+            func()
+        samples.append(result['ms'])
+    return summarize(samples)['median_ms']
+
+
+def run(pages, items_per_order, repeat):
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+    from LittleLemonAPI.parsers import FastJSONParser
+    from LittleLemonAPI.renderers import FastJSONRenderer
+
+    rows = []
+    for count in pages:
+        for label, raw in (('strings', False), ('Decimal/datetime', True)):
+            page = order_page(count, items_per_order, raw)
+            drf = median_ms(lambda: JSONRenderer().render(page), repeat)
+            fast = median_ms(lambda: FastJSONRenderer().render(page), repeat)
+            rows.append((count, f'render {label}', drf, fast, f'{drf / fast:.1f}x'))
+        body = JSONRenderer().render(order_page(count, items_per_order, False))
+        drf = median_ms(lambda: JSONParser().parse(io.BytesIO(body)), repeat)
+        fast = median_ms(lambda: FastJSONParser().parse(io.BytesIO(body)), repeat)
+        rows.append((count, f'parse ({len(body) // 1024} KB)', drf, fast, f'{drf / fast:.1f}x'))
+    print_table(['orders', 'work', 'DRF median ms', 'fast median ms', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--items', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    setup_django()
+    run(args.pages, args.items, args.repeat)
@@ -0,0 +1,67 @@
+"""
+Menu search at scale.
+
+    python -m benchmarks.search [--items 100000] [--repeat N]
+
+Compares the ``like``, ``fts`` and ``memory`` backends for typical kiosk
+queries (short prefixes, whole words and misses).
+"""
+import argparse
+import random
+from decimal import Decimal
+
+from .common import setup_django, measure, summarize, print_table
+
+WORDS = ['lemon', 'chocolate', 'cake', 'grilled', 'salmon', 'greek', 'salad', 'bruschetta',
+         'pasta', 'pesto', 'spicy', 'chicken', 'vegan', 'burger', 'tart', 'iced', 'tea']
+QUERIES = ['lem', 'chocolate cake', 'salmon', 'pesto pasta', 'nothing-matches']
+
+
+def seed(count):
+    from LittleLemonAPI.models import Category, MenuItem
+    from LittleLemonAPI import search
+
+    rng = random.Random(42)
+    category = Category.objects.create(title='Bench', slug='bench')
+    MenuItem.objects.bulk_create((
+        MenuItem(title=f'{" ".join(rng.sample(WORDS, 3)).title()} #{i}', price=Decimal('9.99'),
+                 featured=False, category=category)
+        for i in range(count)
+    ), batch_size=5000)
+    search.rebuild_index()
+
+
+def run(repeat):
+    from django.test import override_settings
+    from LittleLemonAPI.models import MenuItem
+    from LittleLemonAPI.search import filter_menu_items, memory_index
+
+    rows = []
+    for backend in ('like', 'fts', 'memory'):
+        with override_settings(LITTLELEMON_MENU_SEARCH=backend):
+            if backend == 'memory':
+                with measure() as build:
+                    memory_index()
+                rows.append((backend, '(build index)', '-', round(build['ms'], 3), '-'))
+            for query in QUERIES:
+                timings = []
+                for _ in range(repeat):
+                    with measure() as result:
+                        # Count plus first page, as the menu_items view serves it
+                        matches = filter_menu_items(MenuItem.objects.all(), query)
+                        hits = matches.count()
+                        page = list(matches[:10])
+                    timings.append(result['ms'])
+                stats = summarize(timings)
+                rows.append((backend, query, hits, stats['median_ms'], stats['p95_ms']))
+    print_table(['backend', 'query', 'hits', 'median ms', 'p95 ms'], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    setup_django()
+    seed(args.items)
+    run(args.repeat)
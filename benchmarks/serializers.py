@@ -0,0 +1,102 @@
+"""
+DRF serializers vs. the compiled read representations.
+
+    python -m benchmarks.serializers [--rows 100] [--items 5] [--repeat N]
+
+Times one page of menu items, cart lines and orders (each with ``--items``
+order items) both ways: fetch plus serialization, as the views do it, and
+serialization alone on rows that are already loaded.
+"""
+import argparse
+from decimal import Decimal
+
+from .common import setup_django, measure, summarize, print_table
+
+
+def seed(rows, items_per_order):
+    from django.contrib.auth.models import User
+    from LittleLemonAPI.models import Category, MenuItem, Cart, Order, OrderItem
+
+    category = Category.objects.create(title='Bench', slug='bench')
+    menu = MenuItem.objects.bulk_create([
+        MenuItem(title=f'Item {i}', price=Decimal('4.50'), featured=False, category=category)
+        for i in range(max(rows, items_per_order))
+    ])
+    user = User.objects.create_user('bench-customer')
+    Cart.objects.bulk_create([
+        Cart(user=user, menuitems=item, quantity=2, unit_price=item.price, price=2 * item.price)
+        for item in menu[:rows]
+    ])
+    orders = Order.objects.bulk_create([Order(user=user, total=Decimal('9.00')) for _ in range(rows)])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, menuitem=item, quantity=2, unit_price=item.price, price=2 * item.price)
+        for order in orders
+        for item in menu[:items_per_order]
+    ])
+
+
+def cases(rows):
+    from django.db.models import Prefetch
+    from LittleLemonAPI.models import MenuItem, Cart, Order, OrderItem
+    from LittleLemonAPI.serializers import MenuItemSerializer, CartSerializer, OrderSerializer
+    from LittleLemonAPI import representations
+    from LittleLemonAPI.representations import MENU_ITEM, CART, ORDER
+
+    menu = MenuItem.objects.select_related('category').order_by('id')[:rows]
+    cart = Cart.objects.select_related('menuitems').order_by('id')[:rows]
+    orders = Order.objects.prefetch_related(
+        Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('menuitem'))).order_by('id')[:rows]
+    return [
+        ('menu items',
+         lambda: MenuItemSerializer(menu.all(), many=True).data,
+         lambda: MENU_ITEM.many(MENU_ITEM.values(menu))),
+        ('cart lines',
+         lambda: CartSerializer(cart.all(), many=True).data,
+         lambda: CART.many(CART.values(cart))),
+        ('orders',
+         lambda: OrderSerializer(orders.all(), many=True).data,
+         lambda: representations.orders(ORDER.values(orders))),
+    ], [
+        ('menu items',
+         lambda rows: MenuItemSerializer(rows, many=True).data, list(menu),
+         lambda rows: MENU_ITEM.many(rows), list(MENU_ITEM.values(menu))),
+        ('cart lines',
+         lambda rows: CartSerializer(rows, many=True).data, list(cart),
+         lambda rows: CART.many(rows), list(CART.values(cart))),
+    ]
+
+
+def timings(func, repeat, *args):
+    samples = []
+    for _ in range(repeat):
+        with measure() as result:
+            func(*args)
+        samples.append(result['ms'])
+    return summarize(samples)
+
+
+def run(rows, items_per_order, repeat):
+    seed(rows, items_per_order)
+    end_to_end, serialize_only = cases(rows)
+
+    table = []
+    for name, drf, fast in end_to_end:
+        slow_stats, fast_stats = timings(drf, repeat), timings(fast, repeat)
+        table.append((name, 'fetch + serialize', slow_stats['median_ms'], fast_stats['median_ms'],
+                      f"{slow_stats['median_ms'] / fast_stats['median_ms']:.1f}x"))
+    for name, drf, instances, fast, values in serialize_only:
+        slow_stats, fast_stats = timings(drf, repeat, instances), timings(fast, repeat, values)
+        table.append((name, 'serialize only', slow_stats['median_ms'], fast_stats['median_ms'],
+                      f"{slow_stats['median_ms'] / fast_stats['median_ms']:.1f}x"))
+    print(f"{rows} rows per page, {items_per_order} items per order")
+    print_table(['page', 'work', 'DRF median ms', 'fast median ms', 'speedup'], table)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--items', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    setup_django()
+    run(args.rows, args.items, args.repeat)